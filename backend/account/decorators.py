@@ -1,4 +1,4 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import redirect
 from django.conf import settings
 
@@ -45,3 +45,25 @@ def allowed_users(allowed_groups=None, body="Access Denied"):
         return wrapper_func
 
     return decorator
+
+
+def api_user_passes_test(test_func):
+    """
+    Allows access to an API view only to authenticated users that pass the test.
+    Unlike user_passes_test, API clients get a 401 or 403 JSON response instead of a
+    redirect to the login page.
+
+    :param test_func: Callable taking the user, e.g. is_admin.
+    """
+
+    def decorator(view_func):
+        def wrapper_func(request, *args, **kwargs):
+            if not request.user.is_authenticated:
+                return JsonResponse({'message': "Authentication required."}, status=401)
+            if not test_func(request.user):
+                return JsonResponse({'message': "Access Denied"}, status=403)
+            return view_func(request, *args, **kwargs)
+
+        return wrapper_func
+
+    return decorator
@@ -280,6 +280,10 @@ CELERY_TASK_MAX_RETRIES = 3
 CELERY_TIMEZONE = 'UTC'
 CELERY_BEAT_SCHEDULE = {
     # Example: 'task_name': {'task': 'task_path', 'schedule': 'interval_or_cron'}
+    'compact-orphaned-rows': {
+        'task': 'main.tasks.compact_orphaned_rows',
+        'schedule': env.float('AGRIWEBB_COMPACTION_INTERVAL', default=24 * 60 * 60),
+    },
 }
 
 CKEDITOR_5_CONFIGS = BASE_CKEDITOR_5_CONFIGS
@@ -341,3 +345,96 @@ AGRIWEBB_REDIRECT_URI = "agriwebb:agriwebb_oauth2_callback"
 AGRIWEBB_TOKEN_URL = 'https://auth.agriwebb.com/oauth2/token'
 AGRIWEBB_AUTHORIZATION_URL = 'https://auth.agriwebb.com/oauth2/authorize'
 AGRIWEBB_API_URL = 'https://api.agriwebb.com/graphql'
+
+# AgriWebb HTTP connection pool
+AGRIWEBB_POOL_CONNECTIONS = env.int('AGRIWEBB_POOL_CONNECTIONS', default=10)
+AGRIWEBB_POOL_MAXSIZE = env.int('AGRIWEBB_POOL_MAXSIZE', default=10)
+AGRIWEBB_POOL_BLOCK = env.bool('AGRIWEBB_POOL_BLOCK', default=False)
+AGRIWEBB_CONNECT_TIMEOUT = env.float('AGRIWEBB_CONNECT_TIMEOUT', default=5)
+AGRIWEBB_READ_TIMEOUT = env.float('AGRIWEBB_READ_TIMEOUT', default=60)
+AGRIWEBB_KEEP_ALIVE = env.bool('AGRIWEBB_KEEP_ALIVE', default=True)
+AGRIWEBB_KEEP_ALIVE_IDLE = env.int('AGRIWEBB_KEEP_ALIVE_IDLE', default=60)
+
+# AgriWebb paging, the page size adapts between MIN and MAX to hit the target response time
+AGRIWEBB_PAGE_SIZE = env.int('AGRIWEBB_PAGE_SIZE', default=500)
+AGRIWEBB_PAGE_SIZE_MIN = env.int('AGRIWEBB_PAGE_SIZE_MIN', default=100)
+AGRIWEBB_PAGE_SIZE_MAX = env.int('AGRIWEBB_PAGE_SIZE_MAX', default=2000)
+AGRIWEBB_PAGE_TARGET_SECONDS = env.float('AGRIWEBB_PAGE_TARGET_SECONDS', default=2.0)
+
+# Parse compressed AgriWebb animal responses incrementally instead of loading them at once
+AGRIWEBB_STREAM_RESPONSES = env.bool('AGRIWEBB_STREAM_RESPONSES', default=False)
+
+# Incremental animal sync, farms are synced from the latest stored observation date and
+# the whole herd is reconciled every FULL_SYNC_INTERVAL seconds to drop deleted animals
+AGRIWEBB_INCREMENTAL_FILTER_FIELD = env('AGRIWEBB_INCREMENTAL_FILTER_FIELD', default='_observationDate')
+AGRIWEBB_INCREMENTAL_OVERLAP = env.int('AGRIWEBB_INCREMENTAL_OVERLAP', default=300)
+AGRIWEBB_FULL_SYNC_INTERVAL = env.int('AGRIWEBB_FULL_SYNC_INTERVAL', default=24 * 60 * 60)
+# A full sync does not remove the missing animals when they are more than this fraction of the herd
+AGRIWEBB_FULL_SYNC_MAX_DELETE_FRACTION = env.float('AGRIWEBB_FULL_SYNC_MAX_DELETE_FRACTION', default=0.2)
+
+# Animal payloads stored together by the set-based ingest, and rows per bulk query
+AGRIWEBB_INGEST_CHUNK_SIZE = env.int('AGRIWEBB_INGEST_CHUNK_SIZE', default=500)
+AGRIWEBB_INGEST_BULK_SIZE = env.int('AGRIWEBB_INGEST_BULK_SIZE', default=1000)
+# A running ingest run that committed no chunk for this many seconds is resumed by the next task
+AGRIWEBB_INGEST_RUN_STALE_AFTER = env.int('AGRIWEBB_INGEST_RUN_STALE_AFTER', default=15 * 60)
+# Skip the sections of an animal whose payload hash did not change since the last ingest
+AGRIWEBB_INGEST_FINGERPRINTS = env.bool('AGRIWEBB_INGEST_FINGERPRINTS', default=True)
+# Interned unit values, e.g. weights and condition scores, whose primary keys are kept in memory per model
+AGRIWEBB_INTERN_CACHE_SIZE = env.int('AGRIWEBB_INTERN_CACHE_SIZE', default=10000)
+# Hash partitions of a herd stored concurrently by the parallel ingest
+AGRIWEBB_INGEST_PARTITIONS = env.int('AGRIWEBB_INGEST_PARTITIONS', default=4)
+
+# Orphaned ingest rows deleted per batch, pause between batches (seconds), run time limit
+# (seconds) and lock timeout of a batch (milliseconds)
+AGRIWEBB_COMPACTION_BATCH_SIZE = env.int('AGRIWEBB_COMPACTION_BATCH_SIZE', default=1000)
+AGRIWEBB_COMPACTION_PAUSE = env.float('AGRIWEBB_COMPACTION_PAUSE', default=0.1)
+AGRIWEBB_COMPACTION_TIME_LIMIT = env.int('AGRIWEBB_COMPACTION_TIME_LIMIT', default=600)
+AGRIWEBB_COMPACTION_LOCK_TIMEOUT = env.int('AGRIWEBB_COMPACTION_LOCK_TIMEOUT', default=2000)
+
+# Changed rows kept per model by a detailed dry run of an ingest
+AGRIWEBB_DRY_RUN_DETAIL_LIMIT = env.int('AGRIWEBB_DRY_RUN_DETAIL_LIMIT', default=1000)
+
+# Web map zoom levels the field and map feature geometries are simplified for
+AGRIWEBB_GEOMETRY_ZOOM_LEVELS = env.list('AGRIWEBB_GEOMETRY_ZOOM_LEVELS', cast=int, default=[8, 11, 14, 17])
+
+# Point to field resolution: 'database' (needs a spatial database) or 'memory', empty picks by database,
+# and points resolved per query
+AGRIWEBB_SPATIAL_BACKEND = env('AGRIWEBB_SPATIAL_BACKEND', default='')
+AGRIWEBB_SPATIAL_BATCH_SIZE = env.int('AGRIWEBB_SPATIAL_BATCH_SIZE', default=10000)
+
+# Zoom levels vector tiles are served for, seconds a tile stays cached and tiles dropped one by one
+# when a geometry changes before the whole farm is dropped instead
+AGRIWEBB_TILE_MIN_ZOOM = env.int('AGRIWEBB_TILE_MIN_ZOOM', default=8)
+AGRIWEBB_TILE_MAX_ZOOM = env.int('AGRIWEBB_TILE_MAX_ZOOM', default=20)
+AGRIWEBB_TILE_CACHE_TIMEOUT = env.int('AGRIWEBB_TILE_CACHE_TIMEOUT', default=24 * 60 * 60)
+AGRIWEBB_TILE_INVALIDATION_LIMIT = env.int('AGRIWEBB_TILE_INVALIDATION_LIMIT', default=10000)
+
+# Maximum number of in-flight requests of the asyncio AgriWebb client
+AGRIWEBB_ASYNC_CONCURRENCY = env.int('AGRIWEBB_ASYNC_CONCURRENCY', default=8)
+
+# AgriWebb multi-farm batching, a batch is capped by the estimated number of animals it
+# returns (cost), the estimated response size and the number of aliased queries
+AGRIWEBB_BATCH_MAX_COST = env.int('AGRIWEBB_BATCH_MAX_COST', default=5000)
+AGRIWEBB_BATCH_MAX_RESPONSE_BYTES = env.int('AGRIWEBB_BATCH_MAX_RESPONSE_BYTES', default=32 * 1024 * 1024)
+AGRIWEBB_BATCH_MAX_ALIASES = env.int('AGRIWEBB_BATCH_MAX_ALIASES', default=25)
+AGRIWEBB_BATCH_BYTES_PER_ANIMAL = env.int('AGRIWEBB_BATCH_BYTES_PER_ANIMAL', default=4096)
+
+# AgriWebb tokens are cached per process and refreshed REFRESH_MARGIN seconds before they expire
+AGRIWEBB_TOKEN_CACHE_TTL = env.int('AGRIWEBB_TOKEN_CACHE_TTL', default=300)
+AGRIWEBB_TOKEN_REFRESH_MARGIN = env.int('AGRIWEBB_TOKEN_REFRESH_MARGIN', default=120)
+AGRIWEBB_TOKEN_LOCK_TIMEOUT = env.int('AGRIWEBB_TOKEN_LOCK_TIMEOUT', default=30)
+
+# AgriWebb rate limiting, token buckets in requests per second shared by every worker through
+# Redis (in-process buckets without a Redis URL), and retry backoff in seconds
+AGRIWEBB_RATE_LIMIT_REDIS_URL = env('AGRIWEBB_RATE_LIMIT_REDIS_URL', default=env('REDIS_HOST', default=''))
+AGRIWEBB_RATE_LIMIT_GLOBAL_RATE = env.float('AGRIWEBB_RATE_LIMIT_GLOBAL_RATE', default=20)
+AGRIWEBB_RATE_LIMIT_GLOBAL_BURST = env.float('AGRIWEBB_RATE_LIMIT_GLOBAL_BURST', default=40)
+AGRIWEBB_RATE_LIMIT_ORGANIZATION_RATE = env.float('AGRIWEBB_RATE_LIMIT_ORGANIZATION_RATE', default=5)
+AGRIWEBB_RATE_LIMIT_ORGANIZATION_BURST = env.float('AGRIWEBB_RATE_LIMIT_ORGANIZATION_BURST', default=10)
+AGRIWEBB_RATE_LIMIT_MAX_WAIT = env.float('AGRIWEBB_RATE_LIMIT_MAX_WAIT', default=60)
+AGRIWEBB_MAX_RETRIES = env.int('AGRIWEBB_MAX_RETRIES', default=5)
+AGRIWEBB_RETRY_BACKOFF_BASE = env.float('AGRIWEBB_RETRY_BACKOFF_BASE', default=0.5)
+AGRIWEBB_RETRY_BACKOFF_MAX = env.float('AGRIWEBB_RETRY_BACKOFF_MAX', default=30)
+
+# Send registered GraphQL queries as their sha256 hash once the API stored them
+AGRIWEBB_PERSISTED_QUERIES = env.bool('AGRIWEBB_PERSISTED_QUERIES', default=False)
@@ -1,3 +1,5 @@
+import time
+
 import requests
 
 from django.conf import settings
@@ -5,7 +7,17 @@ from django.urls import reverse
 from urllib.error import HTTPError
 from requests_oauthlib import OAuth2Session
 
-from .models.auth import AgriWebbToken
+from . import queries
+from .batching import AnimalQueryBatcher
+from .exceptions import AgriWebbGraphQLError, AgriWebbHTTPError, AgriWebbRateLimitError
+from .pagination import AnimalPageIterator
+from .registry import PERSISTED_QUERY_NOT_SUPPORTED, persisted_query_error, registry
+from .streaming import GraphQLStream
+from .throttling import RateLimiter, backoff_delay, retry_after_seconds
+from .tokens import TokenProvider
+from .transport import get_session, get_timeout
+
+RETRY_STATUS_CODES = (429, 502, 503, 504)
 
 
 class AgriWebb:
@@ -17,6 +29,8 @@ class AgriWebb:
             token_url=None,
             authorization_url=None,
             api_url=None,
+            session=None,
+            timeout=None,
     ):
         """
         Initializes the AgriWebb class.
@@ -27,6 +41,8 @@ class AgriWebb:
         :param token_url: OAuth2 token URL for obtaining access tokens
         :param authorization_url: The URL where users are redirected to authorize access
         :param api_url: URL of the AgriWebb GraphQL API
+        :param session: requests session to send API calls through, defaults to the pooled per-process session
+        :param timeout: (connect, read) timeout in seconds, defaults to AGRIWEBB_CONNECT_TIMEOUT/AGRIWEBB_READ_TIMEOUT
         """
         self.client_id = client_id or getattr(settings, 'AGRIWEBB_CLIENT_ID', None)
         if not self.client_id:
@@ -73,6 +89,12 @@ class AgriWebb:
         if not self.api_url:
             raise ValueError("AGRIWEBB_API_URL is required")
 
+        self.session = session or get_session()
+        self.timeout = timeout or get_timeout()
+
+        self.tokens = TokenProvider(self)
+        self.limiter = RateLimiter()
+
         self.token = None
 
     def get_authorization_url(self, organization=None):
@@ -111,11 +133,22 @@ class AgriWebb:
         :param token_id: The ID of the AgriWebbToken record to refresh
         :return: The new token data after refreshing.
         """
-        try:
-            token = AgriWebbToken.objects.get(id=token_id)
-        except AgriWebbToken.DoesNotExist:
-            raise ValueError("Token not found")
+        token = self.tokens.refresh(token_id, force=True)
+
+        return {
+            'access_token': token.access_token,
+            'refresh_token': token.refresh_token,
+            'token_type': token.token_type,
+            'expires_in': token.expires_in_seconds,
+        }
 
+    def refresh_token(self, token):
+        """
+        Exchanges the refresh token of an AgriWebbToken for a new access token and saves it.
+
+        :param token: The AgriWebbToken to refresh.
+        :return: The new token data after refreshing.
+        """
         oauth = OAuth2Session(
             self.client_id, token={
                 'access_token': token.access_token,
@@ -141,42 +174,165 @@ class AgriWebb:
         except HTTPError as e:
             raise Exception(f"Failed to refresh token: {e}")
 
-    def get_graphql_data(self, token_id, query, variables=None):
+    def get_graphql_data(self, token_id, query, variables=None, stream_path=None):
         """
         Sends a GraphQL query to the AgriWebb API and returns the data.
 
+        The token comes from the in-process token cache, a token the API rejects is
+        refreshed once and the query retried. Every call waits for the shared rate limiter,
+        throttled (429) and unavailable (5xx) responses and connection errors are retried
+        with jittered exponential backoff, honoring `Retry-After`.
+
+        With a `stream_path` the body is not loaded at once, the compressed response is
+        decoded and parsed while the returned stream is iterated.
+
+        Queries go through the persisted-query registry, see send_query.
+
         :param token_id: ID of the token stored in the database.
         :param query: The GraphQL query string.
         :param variables: The variables for the query, if any.
-        :return: The JSON response containing the query result.
+        :param stream_path: Dotted path of a list under `data` to stream, e.g. "animals" (optional).
+        :return: The JSON response containing the query result, or a GraphQLStream over the
+                 objects at `stream_path`.
         """
-        try:
-            token = AgriWebbToken.objects.get(id=token_id)
-        except AgriWebbToken.DoesNotExist:
-            raise ValueError("Token not found")
-
-        headers = {
-            "Authorization": f"{token.token_type or 'Bearer'} {token.access_token}",
-            "Content-Type": "application/json"
-        }
-
-        payload = {
-            "query": query,
-            "variables": variables or {}
-        }
-
-        response = requests.post(self.api_url, headers=headers, json=payload)
+        token = self.tokens.get(token_id)
+        persisted = registry.register(query)
+
+        stream = stream_path is not None
+        response, data = self.send_query(token, persisted, variables, stream=stream)
+
+        if response.status_code == 401:
+            response.close()
+            token = self.tokens.refresh(token_id, rejected=token.access_token)
+            response, data = self.send_query(token, persisted, variables, stream=stream)
+
+        if response.status_code == 429:
+            raise AgriWebbRateLimitError(
+                f"Rate limited: {response.text}",
+                response=response,
+                retry_after=retry_after_seconds(response)
+            )
 
         if response.status_code != 200:
-            raise Exception(f"Failed to get data: {response.text}")
+            raise AgriWebbHTTPError(
+                f"Failed to get data: {response.text}",
+                status_code=response.status_code,
+                response=response
+            )
 
-        data = response.json()
+        if stream:
+            return GraphQLStream(response, stream_path)
+
+        if data is None:
+            data = response.json()
 
         if 'errors' in data:
-            raise Exception(f"GraphQL Error: {data['errors']}")
+            raise AgriWebbGraphQLError(f"GraphQL Error: {data['errors']}", errors=data['errors'])
 
         return data['data']
 
+    def send_query(self, token, persisted, variables=None, stream=False):
+        """
+        Sends a registered query, as its hash only once the server stored it.
+
+        A hash the server does not know (any more) is answered by sending the full text,
+        a server refusing persisted queries gets the full text from then on. Streamed
+        responses can not be replayed, so they always carry the full text.
+
+        :param token: The AgriWebbToken to authorize with.
+        :param persisted: The PersistedQuery to send.
+        :param variables: The variables for the query, if any.
+        :return: A (response, data) tuple, data is the parsed body if it was already read.
+        """
+        hashed = not stream and registry.uses_hash(persisted, self.api_url)
+        response = self.send_persisted(token, persisted, variables, hashed, stream)
+        data = None
+
+        if hashed and response.status_code in (200, 400):
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+
+            error = persisted_query_error(data)
+            if error:
+                self.limiter.record('persisted_query_misses')
+                registry.forget(persisted, self.api_url)
+                if error == PERSISTED_QUERY_NOT_SUPPORTED:
+                    registry.refuse(self.api_url)
+
+                response = self.send_persisted(token, persisted, variables, False, stream)
+                data = None
+
+        if response.status_code == 200 and registry.enabled(self.api_url):
+            registry.stored(persisted, self.api_url)
+
+        return response, data
+
+    def send_persisted(self, token, persisted, variables, hashed, stream):
+        payload = persisted.payload(
+            variables,
+            include_document=not hashed,
+            persisted=registry.enabled(self.api_url)
+        )
+        response = self.send(token, payload, stream=stream)
+
+        self.limiter.record(f"queries:{persisted.name}:requests")
+        self.limiter.record(f"queries:{persisted.name}:request_bytes", len(response.request.body or b''))
+        if hashed:
+            self.limiter.record(f"queries:{persisted.name}:hashed")
+
+        return response
+
+    def send(self, token, payload, stream=False):
+        """
+        Posts the payload under the rate limiter and retries throttled, unavailable and
+        failed requests up to AGRIWEBB_MAX_RETRIES times.
+
+        :return: The last response.
+        """
+        max_retries = getattr(settings, 'AGRIWEBB_MAX_RETRIES', 5)
+
+        for attempt in range(max_retries + 1):
+            self.limiter.acquire(token.organization)
+
+            try:
+                response = self.post(token, payload, stream=stream)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == max_retries:
+                    raise
+                self.limiter.record('retries')
+                time.sleep(backoff_delay(attempt))
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+                return response
+
+            response.close()
+            retry_after = retry_after_seconds(response)
+            if response.status_code == 429:
+                self.limiter.record('rate_limited')
+                self.limiter.pause(token.organization, retry_after or backoff_delay(attempt))
+
+            self.limiter.record('retries')
+            time.sleep(retry_after if retry_after is not None else backoff_delay(attempt))
+
+        return response
+
+    def post(self, token, payload, stream=False):
+        headers = {
+            "Authorization": f"{token.token_type or 'Bearer'} {token.access_token}",
+            "Content-Type": "application/json"
+        }
+
+        return self.session.post(
+            self.api_url,
+            headers=headers,
+            json=payload,
+            timeout=self.timeout,
+            stream=stream
+        )
+
     def animals(
             self,
             token_id,
@@ -186,7 +342,9 @@ class AgriWebb:
             limit=None,
             skip=None,
             observation_date=None,
-            capabilities=None
+            capabilities=None,
+            projection=None,
+            stream=False
     ):
         """
         Retrieves the list of animals from the AgriWebb GraphQL API.
@@ -199,67 +357,33 @@ class AgriWebb:
         :param skip: Skip a number of results (optional).
         :param observation_date: Date of observation (optional).
         :param capabilities: List of capabilities (optional).
+        :param projection: Named selection set, e.g. identity or state_weights, defaults to full (optional).
+        :param stream: Return a GraphQLStream yielding the animals as they are parsed.
         :return: The list of animals.
         """
-        query = """
-         query animals(
-           $farmId: String!
-           $filter: AnimalFilter
-           $sort: [AnimalSort!]
-           $limit: Int
-           $skip: Int
-           $observationDate: Timestamp
-           $_capabilities: [String]
-         ) {
-           animals(
-             farmId: $farmId
-             filter: $filter
-             sort: $sort
-             limit: $limit
-             skip: $skip
-             observationDate: $observationDate
-             _capabilities: $_capabilities
-           ) {
-             ... # need to list the fields needed
-           }
-         }
-         """
-
-        variables = {
-            "farmId": farm_id,
-            "filter": filter,
-            "sort": sort,
-            "limit": limit,
-            "skip": skip,
-            "observationDate": observation_date,
-            "_capabilities": capabilities
-        }
+        query, variables = queries.build_animals(
+            farm_id,
+            filter=filter,
+            sort=sort,
+            limit=limit,
+            skip=skip,
+            observation_date=observation_date,
+            capabilities=capabilities,
+            projection=projection
+        )
 
-        return self.get_graphql_data(token_id, query, variables)
+        return self.get_graphql_data(token_id, query, variables, stream_path='animals' if stream else None)
 
-    def farms(self, token_id, farm_ids=None):
+    def farms(self, token_id, farm_ids=None, projection=None):
         """
         Retrieves the list of farms from the AgriWebb GraphQL API.
 
         :param token_id: ID of the token stored in the database.
         :param farm_ids: A list of farm IDs to filter by (optional).
+        :param projection: Named selection set, e.g. identity or fields, defaults to full (optional).
         :return: The list of farms.
         """
-        query = """
-        query farms(
-          $farmIds: [String]
-        ) {
-          farms(
-            farmIds: $farmIds
-          ) {
-            ... # need to list the fields needed
-          }
-        }
-        """
-
-        variables = {
-            "farmIds": farm_ids
-        }
+        query, variables = queries.build_farms(farm_ids, projection=projection)
 
         return self.get_graphql_data(token_id, query, variables)
 
@@ -272,7 +396,9 @@ class AgriWebb:
             limit=None,
             skip=None,
             observation_date=None,
-            capabilities=None
+            capabilities=None,
+            projection=None,
+            stream=False
     ):
         """
         Retrieves the list of animals with a count from the AgriWebb GraphQL API.
@@ -285,43 +411,166 @@ class AgriWebb:
         :param skip: Skip a number of results (optional).
         :param observation_date: Date of observation (optional).
         :param capabilities: List of capabilities (optional).
+        :param projection: Named selection set, e.g. identity or state_weights, defaults to full (optional).
+        :param stream: Return a GraphQLStream yielding the animals as they are parsed, the
+                       count is then available in its `values` once it was read.
         :return: The list of animals with count.
         """
-        query = """
-        query animalsWithCount(
-          $farmId: String!
-          $filter: AnimalFilter
-          $sort: [AnimalSort!]
-          $limit: Int
-          $skip: Int
-          $observationDate: Timestamp
-          $_capabilities: [String]
-        ) {
-          animalsWithCount(
-            farmId: $farmId
-            filter: $filter
-            sort: $sort
-            limit: $limit
-            skip: $skip
-            observationDate: $observationDate
-            _capabilities: $_capabilities
-          ) {
-            animals {
-              ... # need to list the fields needed
-            }
-            count
-          }
-        }
+        query, variables = queries.build_animals_with_count(
+            farm_id,
+            filter=filter,
+            sort=sort,
+            limit=limit,
+            skip=skip,
+            observation_date=observation_date,
+            capabilities=capabilities,
+            projection=projection
+        )
+
+        return self.get_graphql_data(
+            token_id,
+            query,
+            variables,
+            stream_path='animalsWithCount.animals' if stream else None
+        )
+
+    def animals_batch(self, token_id, requests, projection=None, **budget):
         """
+        Retrieves the animals of several farm/page requests with aliased GraphQL documents,
+        sending as few HTTP requests as the batch budgets allow.
 
-        variables = {
-            "farmId": farm_id,
-            "filter": filter,
-            "sort": sort,
-            "limit": limit,
-            "skip": skip,
-            "observationDate": observation_date,
-            "_capabilities": capabilities
-        }
+        :param token_id: ID of the token stored in the database.
+        :param requests: A list of dicts with a `farm_id` and optionally filter, sort, limit,
+                         skip, observation_date and capabilities.
+        :param projection: Named selection set, defaults to full (optional).
+        :param budget: max_cost, max_response_bytes, max_aliases or bytes_per_animal overrides (optional).
+        :return: The list of animals of each request, in the order of the requests.
+        """
+        return AnimalQueryBatcher(self, projection=projection, **budget).fetch(token_id, requests)
 
-        return self.get_graphql_data(token_id, query, variables)
+    def iter_animals(
+            self,
+            token_id,
+            farm_id,
+            filter=None,
+            sort=None,
+            skip=None,
+            observation_date=None,
+            capabilities=None,
+            projection=None,
+            page_size=None,
+            prefetch=True,
+            adaptive=True,
+            stream=False,
+    ):
+        """
+        Walks every page of `animals` and yields the animals one at a time.
+
+        :param token_id: ID of the token stored in the database.
+        :param farm_id: The ID of the farm.
+        :param filter: Filter criteria for the animals (optional).
+        :param sort: Sorting criteria (optional).
+        :param skip: Skip a number of results before the first page (optional).
+        :param observation_date: Date of observation (optional).
+        :param capabilities: List of capabilities (optional).
+        :param projection: Named selection set, defaults to full (optional).
+        :param page_size: Size of the first page, defaults to AGRIWEBB_PAGE_SIZE (optional).
+        :param prefetch: Fetch the next page while the current one is consumed.
+        :param adaptive: Adapt the page size to the observed response times.
+        :param stream: Parse every page while it is consumed instead of loading it at once.
+        :return: An AnimalPageIterator over the animals.
+        """
+
+        def fetch_page(limit, offset):
+            return self.animals(
+                token_id,
+                farm_id,
+                filter=filter,
+                sort=sort,
+                limit=limit,
+                skip=offset,
+                observation_date=observation_date,
+                capabilities=capabilities,
+                projection=projection,
+                stream=stream
+            )
+
+        def extract(data):
+            if stream:
+                return None, None
+            return data['animals'] or [], None
+
+        return AnimalPageIterator(
+            fetch_page,
+            extract,
+            page_size=page_size,
+            skip=skip,
+            prefetch=prefetch,
+            adaptive=adaptive,
+            stream=stream
+        )
+
+    def iter_animals_with_count(
+            self,
+            token_id,
+            farm_id,
+            filter=None,
+            sort=None,
+            skip=None,
+            observation_date=None,
+            capabilities=None,
+            projection=None,
+            page_size=None,
+            prefetch=True,
+            adaptive=True,
+            stream=False,
+    ):
+        """
+        Walks every page of `animalsWithCount` until `nonPagedCount` animals were read and
+        yields the animals one at a time. The count is available on the returned iterator
+        as `non_paged_count` once the first page was read.
+
+        :param token_id: ID of the token stored in the database.
+        :param farm_id: The ID of the farm.
+        :param filter: Filter criteria for the animals (optional).
+        :param sort: Sorting criteria (optional).
+        :param skip: Skip a number of results before the first page (optional).
+        :param observation_date: Date of observation (optional).
+        :param capabilities: List of capabilities (optional).
+        :param projection: Named selection set, defaults to full (optional).
+        :param page_size: Size of the first page, defaults to AGRIWEBB_PAGE_SIZE (optional).
+        :param prefetch: Fetch the next page while the current one is consumed.
+        :param adaptive: Adapt the page size to the observed response times.
+        :param stream: Parse every page while it is consumed instead of loading it at once.
+        :return: An AnimalPageIterator over the animals.
+        """
+
+        def fetch_page(limit, offset):
+            return self.animals_with_count(
+                token_id,
+                farm_id,
+                filter=filter,
+                sort=sort,
+                limit=limit,
+                skip=offset,
+                observation_date=observation_date,
+                capabilities=capabilities,
+                projection=projection,
+                stream=stream
+            )
+
+        def extract(data):
+            if stream:
+                return None, data.values.get('animalsWithCount.nonPagedCount')
+            animals_with_count = data['animalsWithCount']
+            return animals_with_count['animals'] or [], animals_with_count.get('nonPagedCount')
+
+        return AnimalPageIterator(
+            fetch_page,
+            extract,
+            page_size=page_size,
+            skip=skip,
+            prefetch=prefetch,
+            adaptive=adaptive,
+            stream=stream
+        )
@@ -0,0 +1,324 @@
+import asyncio
+
+import httpx
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+
+from . import queries
+from .agriwebb import RETRY_STATUS_CODES
+from .exceptions import AgriWebbGraphQLError, AgriWebbHTTPError, AgriWebbRateLimitError
+from .registry import PERSISTED_QUERY_NOT_SUPPORTED, persisted_query_error, registry
+from .throttling import RateLimiter, backoff_delay, retry_after_seconds
+from .tokens import TokenProvider
+from .transport import get_timeout
+
+
+class AsyncAgriWebb:
+    def __init__(self, api_url=None, concurrency=None, timeout=None, client=None):
+        """
+        Initializes the asyncio AgriWebb client, it shares the query builders of the AgriWebb
+        class and runs at most `concurrency` requests at once.
+
+        :param api_url: URL of the AgriWebb GraphQL API
+        :param concurrency: Maximum number of in-flight requests, defaults to AGRIWEBB_ASYNC_CONCURRENCY
+        :param timeout: (connect, read) timeout in seconds, defaults to AGRIWEBB_CONNECT_TIMEOUT/AGRIWEBB_READ_TIMEOUT
+        :param client: httpx.AsyncClient to send API calls through (optional)
+        """
+        self.api_url = api_url or getattr(settings, 'AGRIWEBB_API_URL', None)
+        if not self.api_url:
+            raise ValueError("AGRIWEBB_API_URL is required")
+
+        self.concurrency = concurrency or getattr(settings, 'AGRIWEBB_ASYNC_CONCURRENCY', 8)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        if client is None:
+            connect_timeout, read_timeout = timeout or get_timeout()
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.concurrency,
+                    max_keepalive_connections=self.concurrency,
+                ),
+            )
+            self._owns_client = True
+        else:
+            self._owns_client = False
+
+        self.client = client
+        self.tokens = TokenProvider()
+        self.limiter = RateLimiter()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        """
+        Closes the underlying connection pool if this client created it.
+        """
+        if self._owns_client:
+            await self.client.aclose()
+
+    async def get_token(self, token_id):
+        return await sync_to_async(self.tokens.get)(token_id)
+
+    async def refresh_token(self, token_id, rejected):
+        return await sync_to_async(self.tokens.refresh)(token_id, rejected=rejected)
+
+    async def get_graphql_data(self, token_id, query, variables=None):
+        """
+        Sends a GraphQL query to the AgriWebb API and returns the data.
+
+        :param token_id: ID of the token stored in the database.
+        :param query: The GraphQL query string.
+        :param variables: The variables for the query, if any.
+        :return: The JSON response containing the query result.
+        """
+        token = await self.get_token(token_id)
+        persisted = registry.register(query)
+
+        response, data = await self.send_query(token, persisted, variables)
+
+        if response.status_code == 401:
+            token = await self.refresh_token(token_id, token.access_token)
+            response, data = await self.send_query(token, persisted, variables)
+
+        if response.status_code == 429:
+            raise AgriWebbRateLimitError(
+                f"Rate limited: {response.text}",
+                response=response,
+                retry_after=retry_after_seconds(response)
+            )
+
+        if response.status_code != 200:
+            raise AgriWebbHTTPError(
+                f"Failed to get data: {response.text}",
+                status_code=response.status_code,
+                response=response
+            )
+
+        if data is None:
+            data = response.json()
+
+        if 'errors' in data:
+            raise AgriWebbGraphQLError(f"GraphQL Error: {data['errors']}", errors=data['errors'])
+
+        return data['data']
+
+    async def acquire(self, organization):
+        """
+        Waits without blocking the event loop until the shared rate limiter grants a token.
+        """
+        waited = 0
+
+        while True:
+            wait = await sync_to_async(self.limiter.try_acquire, thread_sensitive=False)(organization)
+            if wait <= 0:
+                break
+            if waited + wait > self.limiter.max_wait:
+                raise AgriWebbRateLimitError(
+                    f"Waited {waited:.1f}s for an AgriWebb rate limit token",
+                    status_code=None,
+                    retry_after=wait
+                )
+            await asyncio.sleep(wait)
+            waited += wait
+
+        counts = {'requests': 1}
+        if waited:
+            counts.update({'throttled': 1, 'throttled_seconds': float(waited)})
+        await self.record(counts)
+
+    async def record(self, counts):
+        """
+        Adds to the shared counters of the rate limiter off the event loop.
+        """
+        await sync_to_async(self.limiter.record_many, thread_sensitive=False)(counts)
+
+    async def send_query(self, token, persisted, variables=None):
+        """
+        Sends a registered query, as its hash only once the server stored it, see
+        AgriWebb.send_query.
+
+        :return: A (response, data) tuple, data is the parsed body if it was already read.
+        """
+        hashed = registry.uses_hash(persisted, self.api_url)
+        response = await self.send_persisted(token, persisted, variables, hashed)
+        data = None
+
+        if hashed and response.status_code in (200, 400):
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+
+            error = persisted_query_error(data)
+            if error:
+                await self.record({'persisted_query_misses': 1})
+                registry.forget(persisted, self.api_url)
+                if error == PERSISTED_QUERY_NOT_SUPPORTED:
+                    registry.refuse(self.api_url)
+
+                response = await self.send_persisted(token, persisted, variables, False)
+                data = None
+
+        if response.status_code == 200 and registry.enabled(self.api_url):
+            registry.stored(persisted, self.api_url)
+
+        return response, data
+
+    async def send_persisted(self, token, persisted, variables, hashed):
+        payload = persisted.payload(
+            variables,
+            include_document=not hashed,
+            persisted=registry.enabled(self.api_url)
+        )
+        response = await self.send(token, payload)
+
+        counts = {
+            f"queries:{persisted.name}:requests": 1,
+            f"queries:{persisted.name}:request_bytes": len(response.request.content),
+        }
+        if hashed:
+            counts[f"queries:{persisted.name}:hashed"] = 1
+        await self.record(counts)
+
+        return response
+
+    async def send(self, token, payload):
+        """
+        Posts the payload under the rate limiter and retries throttled, unavailable and
+        failed requests up to AGRIWEBB_MAX_RETRIES times, see AgriWebb.send.
+        """
+        max_retries = getattr(settings, 'AGRIWEBB_MAX_RETRIES', 5)
+
+        for attempt in range(max_retries + 1):
+            await self.acquire(token.organization)
+
+            try:
+                response = await self.post(token, payload)
+            except httpx.TransportError:
+                if attempt == max_retries:
+                    raise
+                await self.record({'retries': 1})
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES or attempt == max_retries:
+                return response
+
+            retry_after = retry_after_seconds(response)
+            counts = {'retries': 1}
+            if response.status_code == 429:
+                counts['rate_limited'] = 1
+                await sync_to_async(self.limiter.pause, thread_sensitive=False)(
+                    token.organization,
+                    retry_after or backoff_delay(attempt)
+                )
+
+            await self.record(counts)
+            await asyncio.sleep(retry_after if retry_after is not None else backoff_delay(attempt))
+
+        return response
+
+    async def post(self, token, payload):
+        headers = {
+            "Authorization": f"{token.token_type or 'Bearer'} {token.access_token}",
+            "Content-Type": "application/json"
+        }
+
+        async with self.semaphore:
+            return await self.client.post(self.api_url, headers=headers, json=payload)
+
+    async def animals(self, token_id, farm_id, **kwargs):
+        """
+        Retrieves the list of animals, takes the same arguments as AgriWebb.animals.
+        """
+        query, variables = queries.build_animals(farm_id, **kwargs)
+        return await self.get_graphql_data(token_id, query, variables)
+
+    async def farms(self, token_id, farm_ids=None, projection=None):
+        """
+        Retrieves the list of farms, takes the same arguments as AgriWebb.farms.
+        """
+        query, variables = queries.build_farms(farm_ids, projection=projection)
+        return await self.get_graphql_data(token_id, query, variables)
+
+    async def animals_with_count(self, token_id, farm_id, **kwargs):
+        """
+        Retrieves the list of animals with a count, takes the same arguments as AgriWebb.animals_with_count.
+        """
+        query, variables = queries.build_animals_with_count(farm_id, **kwargs)
+        return await self.get_graphql_data(token_id, query, variables)
+
+    async def all_animals(self, token_id, farm_id, page_size=None, **kwargs):
+        """
+        Retrieves every animal of a farm. The first page tells the `nonPagedCount`, the
+        remaining pages are then requested concurrently.
+
+        :param token_id: ID of the token stored in the database.
+        :param farm_id: The ID of the farm.
+        :param page_size: Number of animals per page, defaults to AGRIWEBB_PAGE_SIZE.
+        :param kwargs: filter, sort, observation_date and capabilities (optional).
+        :return: The list of animals.
+        """
+        page_size = page_size or getattr(settings, 'AGRIWEBB_PAGE_SIZE', 500)
+
+        first_page = await self.animals_with_count(token_id, farm_id, limit=page_size, skip=0, **kwargs)
+        animals_with_count = first_page['animalsWithCount']
+        animals = list(animals_with_count['animals'] or [])
+
+        non_paged_count = animals_with_count.get('nonPagedCount') or len(animals)
+
+        pages = await asyncio.gather(
+            *(
+                self.animals_with_count(token_id, farm_id, limit=page_size, skip=skip, **kwargs)
+                for skip in range(page_size, non_paged_count, page_size)
+            )
+        )
+
+        for page in pages:
+            animals.extend(page['animalsWithCount']['animals'] or [])
+
+        return animals
+
+    async def organization_animals(self, token_id, farm_ids=None, page_size=None, **kwargs):
+        """
+        Retrieves every animal of every farm the token has access to, all farms and pages
+        are requested concurrently under the client's semaphore.
+
+        :param token_id: ID of the token stored in the database.
+        :param farm_ids: A list of farm IDs, defaults to every farm of the organization.
+        :param page_size: Number of animals per page, defaults to AGRIWEBB_PAGE_SIZE.
+        :param kwargs: filter, sort, observation_date and capabilities (optional).
+        :return: A dict of farm ID to the list of its animals.
+        """
+        if farm_ids is None:
+            farms_data = await self.farms(token_id, projection='identity')
+            farm_ids = [farm['id'] for farm in farms_data['farms']]
+
+        results = await asyncio.gather(
+            *(self.all_animals(token_id, farm_id, page_size=page_size, **kwargs) for farm_id in farm_ids)
+        )
+
+        return dict(zip(farm_ids, results))
+
+
+def fetch_organization_animals(token_id, farm_ids=None, page_size=None, concurrency=None, **kwargs):
+    """
+    Synchronous entry point for tasks and management commands, see AsyncAgriWebb.organization_animals.
+    """
+
+    async def fetch():
+        async with AsyncAgriWebb(concurrency=concurrency) as agriwebb:
+            return await agriwebb.organization_animals(
+                token_id,
+                farm_ids=farm_ids,
+                page_size=page_size,
+                **kwargs
+            )
+
+    return async_to_sync(fetch)()
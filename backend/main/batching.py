@@ -0,0 +1,133 @@
+from django.conf import settings
+
+from . import queries
+
+
+class AnimalQueryBatcher:
+    """
+    Groups `animals` page requests for several farms into aliased GraphQL documents so many
+    small farms share a single HTTP request.
+
+    A batch is closed once adding another request would go over the query-cost budget (the
+    estimated number of animals returned), the estimated response size or the alias cap.
+    """
+
+    def __init__(
+            self,
+            agriwebb,
+            max_cost=None,
+            max_response_bytes=None,
+            max_aliases=None,
+            bytes_per_animal=None,
+            projection=None
+    ):
+        """
+        :param agriwebb: AgriWebb client the batches are sent through.
+        :param max_cost: Query-cost budget of one batch, in animals, defaults to AGRIWEBB_BATCH_MAX_COST.
+        :param max_response_bytes: Response-size budget of one batch, defaults to AGRIWEBB_BATCH_MAX_RESPONSE_BYTES.
+        :param max_aliases: Maximum number of aliased queries in one batch, defaults to AGRIWEBB_BATCH_MAX_ALIASES.
+        :param bytes_per_animal: Estimated response size of one animal, defaults to AGRIWEBB_BATCH_BYTES_PER_ANIMAL.
+        :param projection: Named animal selection set of the batched queries, defaults to full.
+        """
+        self.agriwebb = agriwebb
+        self.projection = projection
+        self.max_cost = max_cost or getattr(settings, 'AGRIWEBB_BATCH_MAX_COST', 5000)
+        self.max_response_bytes = max_response_bytes or getattr(
+            settings,
+            'AGRIWEBB_BATCH_MAX_RESPONSE_BYTES',
+            32 * 1024 * 1024
+        )
+        self.max_aliases = max_aliases or getattr(settings, 'AGRIWEBB_BATCH_MAX_ALIASES', 25)
+        self.bytes_per_animal = bytes_per_animal or getattr(settings, 'AGRIWEBB_BATCH_BYTES_PER_ANIMAL', 4096)
+
+    def cost(self, request):
+        """
+        Estimates the cost of a request as the number of animals it may return, plus one
+        for the query itself. Unlimited requests take the whole budget.
+        """
+        limit = request.get('limit')
+        if limit is None:
+            return self.max_cost
+        return limit + 1
+
+    def plan(self, requests):
+        """
+        Splits the requests into batches that each fit the budgets, keeping their order.
+
+        :param requests: A list of request dicts, see queries.build_animals_batch.
+        :return: A list of batches, each a list of request dicts.
+        """
+        batches = []
+        batch = []
+        batch_cost = 0
+
+        for request in requests:
+            cost = self.cost(request)
+
+            over_budget = (
+                    batch_cost + cost > self.max_cost
+                    or (batch_cost + cost) * self.bytes_per_animal > self.max_response_bytes
+                    or len(batch) >= self.max_aliases
+            )
+            if batch and over_budget:
+                batches.append(batch)
+                batch = []
+                batch_cost = 0
+
+            batch.append(request)
+            batch_cost += cost
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def fetch(self, token_id, requests):
+        """
+        Sends the requests in as few batches as the budgets allow.
+
+        :param token_id: ID of the token stored in the database.
+        :param requests: A list of request dicts, see queries.build_animals_batch.
+        :return: The list of animals of each request, in the order of the requests.
+        """
+        results = []
+
+        for batch in self.plan(requests):
+            query, variables, aliases = queries.build_animals_batch(batch, projection=self.projection)
+            data = self.agriwebb.get_graphql_data(token_id, query, variables)
+            results.extend(data[alias] or [] for alias in aliases)
+
+        return results
+
+    def walk(self, token_id, farm_ids, page_size=None, **kwargs):
+        """
+        Pages through the animals of several farms, asking for the next page of every farm
+        whose last page was full in the same batch.
+
+        :param token_id: ID of the token stored in the database.
+        :param farm_ids: A list of farm IDs.
+        :param page_size: Number of animals per page, defaults to AGRIWEBB_PAGE_SIZE.
+        :param kwargs: filter, sort, observation_date and capabilities (optional).
+        :return: A generator of (farm_id, animals) tuples, one per fetched page.
+        """
+        page_size = page_size or getattr(settings, 'AGRIWEBB_PAGE_SIZE', 500)
+        offsets = {farm_id: 0 for farm_id in farm_ids}
+
+        while offsets:
+            requests = [
+                {'farm_id': farm_id, 'limit': page_size, 'skip': offset, **kwargs}
+                for farm_id, offset in offsets.items()
+            ]
+
+            pages = self.fetch(token_id, requests)
+
+            for request, animals in zip(requests, pages):
+                farm_id = request['farm_id']
+
+                if len(animals) < page_size:
+                    del offsets[farm_id]
+                else:
+                    offsets[farm_id] += len(animals)
+
+                if animals:
+                    yield farm_id, animals
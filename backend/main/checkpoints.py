@@ -0,0 +1,192 @@
+import logging
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .fingerprints import digest
+from .ingest import AnimalIngest, chunked
+from .models import IngestRun, QuarantinedAnimal
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointedIngest:
+    """
+    Stores the animals of a farm a chunk at a time, each chunk in its own transaction
+    together with the checkpoint of its IngestRun.
+
+    A task that fails or is killed leaves its run with the offset of the last committed
+    chunk, the next task with the same query arguments resumes from there instead of
+    starting over. Resuming skips the committed animals of the query, so it relies on
+    the query returning the animals in the same order, and a run is only resumed when
+    its arguments have a `sort` or the animals are known to be ordered.
+
+    An animal that cannot be stored goes to the QuarantinedAnimal table with its payload
+    and error, the rest of its chunk is stored without it.
+    """
+
+    def __init__(self, farm_id, kind, arguments, chunk_size=None, resume=True, ingest=None, ordered=None):
+        """
+        :param farm_id: The ID of the farm.
+        :param kind: The IngestRun.Kind of the query.
+        :param arguments: Dict of the query arguments, runs with equal arguments and a `sort`
+                          resume each other.
+        :param chunk_size: Animals per committed chunk, defaults to AGRIWEBB_INGEST_CHUNK_SIZE.
+        :param resume: Resume the last unfinished run with the same arguments, ignored
+                       when the animals are not ordered.
+        :param ingest: The AnimalIngest to store the chunks with (optional).
+        :param ordered: Whether the animals come in the same order every time, defaults to
+                        whether the arguments have a `sort`.
+        """
+        self.farm_id = farm_id
+        self.kind = kind
+        self.run_key = digest(arguments)
+        self.chunk_size = chunk_size or getattr(settings, 'AGRIWEBB_INGEST_CHUNK_SIZE', 500)
+        # without a sort the query may return the animals in another order, resuming
+        # after the committed offset would then skip animals that were never stored
+        if ordered is None:
+            ordered = arguments.get('sort') is not None
+        self.resume = resume and ordered
+        if resume and not ordered:
+            logger.info("Not resuming the %s runs of farm %s, the query has no sort", kind, farm_id)
+        self.ingest = ingest or AnimalIngest(farm_id)
+        self.run = None
+
+    @property
+    def stats(self):
+        return self.ingest.stats
+
+    @property
+    def offset(self):
+        """
+        Number of animals of the query the run already committed.
+        """
+        return self.run.committed_offset if self.run else 0
+
+    def start(self):
+        """
+        Claims the last unfinished run with the same arguments, or starts a new one.
+
+        A failed run is resumed, a running one only when it did not commit a chunk for
+        AGRIWEBB_INGEST_RUN_STALE_AFTER seconds, i.e. its task died without marking it
+        failed. The run is claimed under a row lock, so two tasks never resume the same run.
+        """
+        stale_after = getattr(settings, 'AGRIWEBB_INGEST_RUN_STALE_AFTER', 15 * 60)
+        stale = timezone.now() - timezone.timedelta(seconds=stale_after)
+
+        with transaction.atomic():
+            run = None
+            if self.resume:
+                run = (
+                    IngestRun.objects
+                    .select_for_update(skip_locked=True)
+                    .filter(farm_id=self.farm_id, kind=self.kind, run_key=self.run_key)
+                    .filter(
+                        Q(status=IngestRun.Status.FAILED)
+                        | Q(status=IngestRun.Status.RUNNING, updated_at__lt=stale)
+                    )
+                    .order_by('-created_at')
+                    .first()
+                )
+
+            if run is None:
+                run = IngestRun.objects.create(
+                    farm_id=self.farm_id,
+                    kind=self.kind,
+                    run_key=self.run_key,
+                    chunk_size=self.chunk_size,
+                )
+            else:
+                logger.info("Resuming %s after %s animals", run, run.committed_offset)
+                run.status = IngestRun.Status.RUNNING
+                run.save(update_fields=['status', 'updated_at'])
+
+        self.run = run
+        return run
+
+    @contextmanager
+    def running(self):
+        """
+        Starts or resumes the run and marks it completed, or failed with the error, when
+        the block ends.
+        """
+        run = self.start()
+        try:
+            yield run
+        except Exception as e:
+            run.status = IngestRun.Status.FAILED
+            run.last_error = str(e)
+            run.save(update_fields=['status', 'last_error', 'updated_at'])
+            raise
+
+        run.status = IngestRun.Status.COMPLETED
+        run.completed_at = timezone.now()
+        run.save(update_fields=['status', 'completed_at', 'updated_at'])
+
+    def ingest_iter(self, animals, on_chunk=None):
+        """
+        Stores an iterable of animal payloads, starting after the committed offset of the run.
+
+        :param animals: An iterable of the animal payloads that follow the committed offset.
+        :param on_chunk: Callable taking the stored Animals of a chunk, called in the
+                         transaction of the chunk (optional).
+        :return: A generator of the stored Animals of every chunk.
+        """
+        for chunk in chunked(animals, self.chunk_size):
+            with transaction.atomic():
+                stored = self.store(chunk)
+                if on_chunk is not None:
+                    on_chunk(stored)
+                self.checkpoint(len(chunk))
+            yield stored
+
+    def ingest_all(self, animals, on_chunk=None):
+        """
+        Stores an iterable of animal payloads a chunk at a time.
+
+        :return: The IngestStats of the engine.
+        """
+        for _ in self.ingest_iter(animals, on_chunk):
+            pass
+        return self.stats
+
+    def store(self, chunk):
+        """
+        Stores a chunk, falling back to one animal at a time to quarantine the failing ones.
+        """
+        try:
+            with transaction.atomic():
+                return self.ingest.ingest(chunk)
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception:
+            logger.warning("Storing a chunk of %s failed, storing its animals one by one", self.run, exc_info=True)
+
+        stored = []
+        for animal in chunk:
+            try:
+                with transaction.atomic():
+                    stored.extend(self.ingest.ingest([animal]))
+            except (OperationalError, InterfaceError):
+                raise
+            except Exception as e:
+                self.quarantine(animal, e)
+        return stored
+
+    def quarantine(self, animal, error):
+        QuarantinedAnimal.objects.create(
+            run=self.run,
+            farm_id=self.farm_id,
+            animal_id=str(animal.get('animalId') or ''),
+            payload=animal,
+            error=f"{type(error).__name__}: {error}",
+        )
+        self.run.quarantined_count += 1
+
+    def checkpoint(self, count):
+        self.run.committed_offset += count
+        self.run.committed_chunks += 1
+        self.run.save(update_fields=['committed_offset', 'committed_chunks', 'quarantined_count', 'updated_at'])
@@ -0,0 +1,174 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import Exists, OuterRef
+
+from . import interning
+from .models import Parentage, AnimalIdentity, AnimalCharacteristics, AnimalState, AnimalWeightSummary, Weight, \
+    WeightGain
+
+logger = logging.getLogger(__name__)
+
+# rows written per animal and left behind when an animal gets a new one or is deleted, then
+# the weight summaries, which hold a timestamp and so grow with every weighing, and the
+# weights they point to. In dependency order, a deleted state orphans its summary and a
+# deleted summary its weights
+COMPACTED_MODELS = (
+    Parentage, AnimalIdentity, AnimalCharacteristics, AnimalState, AnimalWeightSummary, Weight, WeightGain
+)
+
+
+def orphan_conditions(model):
+    """
+    Returns a filter per relation pointing at the model that is true when no row of the
+    relation references the row.
+    """
+    conditions = []
+    for relation in model._meta.related_objects:
+        if relation.many_to_many:
+            through = relation.through
+            field = relation.field.m2m_reverse_field_name()
+            references = through.objects.filter(**{field: OuterRef('pk')})
+        else:
+            references = relation.related_model._base_manager.filter(**{relation.field.name: OuterRef('pk')})
+        conditions.append(~Exists(references))
+    return conditions
+
+
+class Compactor:
+    """
+    Deletes the rows of COMPACTED_MODELS no other row references.
+
+    Orphans are found and deleted in small batches in primary key order, each batch in
+    its own short transaction with a lock timeout, and the compactor pauses between
+    batches so running ingests keep the database to themselves. A batch re-checks that
+    its rows are still orphans once it holds their locks, and the interner of an interned
+    model forgets the cached primary keys after every batch that deleted some.
+    """
+
+    def __init__(self, batch_size=None, pause=None, time_limit=None, lock_timeout=None):
+        """
+        :param batch_size: Rows deleted per batch, defaults to AGRIWEBB_COMPACTION_BATCH_SIZE.
+        :param pause: Seconds to sleep between batches, defaults to AGRIWEBB_COMPACTION_PAUSE.
+        :param time_limit: Seconds after which the run stops, defaults to AGRIWEBB_COMPACTION_TIME_LIMIT.
+        :param lock_timeout: Milliseconds a batch waits for a lock before it is skipped,
+                             defaults to AGRIWEBB_COMPACTION_LOCK_TIMEOUT.
+        """
+        self.batch_size = batch_size or getattr(settings, 'AGRIWEBB_COMPACTION_BATCH_SIZE', 1000)
+        self.pause = pause if pause is not None else getattr(settings, 'AGRIWEBB_COMPACTION_PAUSE', 0.1)
+        self.time_limit = time_limit or getattr(settings, 'AGRIWEBB_COMPACTION_TIME_LIMIT', 600)
+        self.lock_timeout = lock_timeout or getattr(settings, 'AGRIWEBB_COMPACTION_LOCK_TIMEOUT', 2000)
+
+    def run(self, models=COMPACTED_MODELS):
+        """
+        Compacts the given models until they have no orphans left or the time limit is hit.
+
+        :return: A dict with the `reclaimed` rows of every model, the `table_sizes` after the
+                 run, whether it `finished` and its `elapsed` seconds.
+        """
+        started = time.monotonic()
+        deadline = started + self.time_limit
+        reclaimed = {}
+        finished = True
+
+        for model in models:
+            reclaimed[model._meta.label], done = self.compact(model, deadline)
+            if not done:
+                finished = False
+                break
+
+        return {
+            'reclaimed': reclaimed,
+            'table_sizes': table_sizes(models),
+            'finished': finished,
+            'elapsed': round(time.monotonic() - started, 2),
+        }
+
+    def compact(self, model, deadline):
+        """
+        Deletes the orphans of one model a batch at a time.
+
+        :return: A tuple of the number of deleted rows and whether the model was finished
+                 before the deadline.
+        """
+        conditions = orphan_conditions(model)
+        orphans = model._base_manager.filter(*conditions).order_by('pk')
+        interners = [interner for interner in interning.INTERNERS if interner.model is model]
+
+        deleted = 0
+        last_pk = None
+        while True:
+            if time.monotonic() >= deadline:
+                return deleted, False
+
+            batch = orphans if last_pk is None else orphans.filter(pk__gt=last_pk)
+            pks = list(batch.values_list('pk', flat=True)[:self.batch_size])
+            if not pks:
+                return deleted, True
+            last_pk = pks[-1]
+
+            try:
+                removed = self.delete_batch(model, conditions, pks)
+            except OperationalError:
+                # a running ingest holds the rows, they are picked up again by the next run
+                logger.info("Skipped a locked batch of %s after pk %s", model._meta.label, pks[0])
+            else:
+                deleted += removed
+                if removed:
+                    for interner in interners:
+                        interner.forget()
+
+            if self.pause:
+                time.sleep(self.pause)
+
+    def delete_batch(self, model, conditions, pks):
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(f"SET LOCAL lock_timeout = {int(self.lock_timeout)}")
+
+            locked = list(
+                model._base_manager
+                .filter(pk__in=pks)
+                .filter(*conditions)
+                .select_for_update(skip_locked=True)
+                .values_list('pk', flat=True)
+            )
+            if not locked:
+                return 0
+
+            # the select above saw the references of its snapshot, one committed since would
+            # be set to NULL by the delete. Rows referencing a locked row wait for the lock,
+            # so the check in a new statement sees every reference there will be
+            _, deleted_by_model = model._base_manager.filter(pk__in=locked).filter(*conditions).delete()
+            return deleted_by_model.get(model._meta.label, 0)
+
+
+def table_sizes(models):
+    """
+    Returns the estimated rows and the bytes on disk, indexes included, of the tables of
+    the given models. The bytes are only known on PostgreSQL.
+    """
+    sizes = {}
+    for model in models:
+        table = model._meta.db_table
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint, pg_total_relation_size(oid) FROM pg_class WHERE oid = %s::regclass",
+                    [table]
+                )
+                rows, size = cursor.fetchone()
+        else:
+            rows, size = model._base_manager.count(), None
+        sizes[model._meta.label] = {'table': table, 'rows': rows, 'bytes': size}
+    return sizes
+
+
+def compact_orphans(models=COMPACTED_MODELS, **options):
+    """
+    Runs a Compactor over the given models, see Compactor.run.
+    """
+    return Compactor(**options).run(models)
@@ -0,0 +1,454 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from . import interning, mapping
+from .fingerprints import ANIMAL, CHARACTERISTICS, IDENTITY, PARENTAGE, RECORDS, STATE
+from .helpers import animal_defaults, characteristics_defaults, date_confidence_lookup, field_defaults, \
+    identity_defaults, state_defaults
+from .ingest import AnimalIngest, chunked
+from .models import Animal, AnimalIdentity, AnimalCharacteristics, AnimalState, AnimalRecord, ManagementGroup, \
+    Enterprise, AnimalTag, GeneticParent, ParentAnimalIdentity, Surrogate, Parentage, Farm, MapFeature, Field
+
+INSERT = 'insert'
+UPDATE = 'update'
+UNCHANGED = 'unchanged'
+DELETE = 'delete'
+
+
+def related(prefix, values):
+    """
+    Prefixes the field names of a related row with the relation, e.g. enterprise__name.
+    """
+    return {f"{prefix}__{name}": value for name, value in values.items()}
+
+
+def target_field(model, path):
+    """
+    Returns the model field a lookup path like `enterprise__enterprise_id` ends on.
+    """
+    *relations, name = path.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
+
+
+def comparable(field, value):
+    if value is None:
+        return None
+    try:
+        return field.to_python(value)
+    except ValidationError:
+        return value
+
+
+def weights_lookup(weights_data):
+    """
+    The AnimalWeightSummary of a weights payload by lookup path, the interned weight gains
+    and weights compared by their unit and value, see helpers.weight_summary_lookup.
+    """
+    weights_data = weights_data or {}
+    values = {'live_weight_date': mapping.from_timestamp(weights_data.get('liveWeightDate'))}
+    for name, key, spec in (
+            ('live_average_daily_gain', 'liveAverageDailyGain', mapping.WEIGHT_GAIN),
+            ('overall_average_daily_gain', 'overallAverageDailyGain', mapping.WEIGHT_GAIN),
+            ('assumed_average_daily_gain', 'assumedAverageDailyGain', mapping.WEIGHT_GAIN),
+            ('live_weight', 'liveWeight', mapping.WEIGHT),
+            ('estimated_weight', 'estimatedWeight', mapping.WEIGHT),
+    ):
+        values.update(related(name, spec(weights_data.get(key))))
+    return values
+
+
+def geometry_lookup(geometry):
+    """
+    The content hash of the interned GeoFeature of a GeoJSON geometry payload, geometries
+    are compared by it.
+    """
+    if not geometry:
+        return {'geometry__content_hash': None}
+    return {'geometry__content_hash': interning.geo_features.content_hash(mapping.geo_feature(geometry))}
+
+
+class Changeset:
+    """
+    The rows of one model an ingest would insert, update, leave unchanged and delete.
+    """
+
+    def __init__(self, label, detail=False, detail_limit=None):
+        self.label = label
+        self.counts = dict.fromkeys((INSERT, UPDATE, UNCHANGED, DELETE), 0)
+        self.detail = detail
+        self.detail_limit = detail_limit
+        self.rows = []
+
+    def __bool__(self):
+        return any(self.counts.values())
+
+    def add(self, action, key, changes=None):
+        self.counts[action] += 1
+        if self.detail and action != UNCHANGED and (
+                self.detail_limit is None or len(self.rows) < self.detail_limit
+        ):
+            row = {'action': action, 'key': key}
+            if changes:
+                row['changes'] = changes
+            self.rows.append(row)
+
+    def as_dict(self):
+        values = dict(self.counts)
+        if self.detail:
+            values['rows'] = self.rows
+        return values
+
+    def __str__(self):
+        return (
+            f"{self.label}: +{self.counts[INSERT]} ~{self.counts[UPDATE]} "
+            f"={self.counts[UNCHANGED]} -{self.counts[DELETE]}"
+        )
+
+
+class DryRun:
+    """
+    Compares the rows an ingest would write with the stored ones without writing anything.
+
+    The stored rows are loaded with one `values` query per model and chunk of natural
+    keys, related rows are compared through their natural keys or fields by lookup paths,
+    so a chunk costs a query per model however many rows it has.
+    """
+
+    def __init__(self, detail=False, batch_size=None):
+        """
+        :param detail: Keep the key and the changed fields of every inserted, updated and
+                       deleted row, up to AGRIWEBB_DRY_RUN_DETAIL_LIMIT per model.
+        :param batch_size: Natural keys per query, defaults to AGRIWEBB_INGEST_BULK_SIZE.
+        """
+        self.detail = detail
+        self.detail_limit = getattr(settings, 'AGRIWEBB_DRY_RUN_DETAIL_LIMIT', 1000)
+        self.batch_size = batch_size or getattr(settings, 'AGRIWEBB_INGEST_BULK_SIZE', 1000)
+        self.changesets = {}
+
+    def changeset(self, label):
+        if label not in self.changesets:
+            self.changesets[label] = Changeset(label, self.detail, self.detail_limit)
+        return self.changesets[label]
+
+    def stored(self, model, field, keys, names):
+        """
+        Loads the given fields, by lookup path, of the stored rows of the given natural keys.
+        The first row of a key wins, like AnimalIngest.existing.
+        """
+        rows = {}
+        values = [key for key in keys if key is not None]
+        for chunk in chunked(values, self.batch_size):
+            queryset = model.objects.filter(**{f"{field}__in": chunk}).order_by('pk')
+            for row in queryset.values(field, *names):
+                rows.setdefault(row.pop(field), row)
+        if None in keys:
+            row = model.objects.filter(**{f"{field}__isnull": True}).order_by('pk').values(*names).first()
+            if row is not None:
+                rows[None] = row
+        return rows
+
+    def compare(self, model, field, rows, update=True):
+        """
+        Compares rows keyed by natural key with the stored ones, like AnimalIngest.upsert
+        would write them.
+
+        :param rows: Dict of natural key to the field values, related fields by lookup path.
+        :param update: Whether existing rows would be updated, rows only created are unchanged.
+        """
+        changeset = self.changeset(model._meta.label)
+        if not rows:
+            return changeset
+
+        names = sorted({name for values in rows.values() for name in values}) if update else []
+        fields = {name: target_field(model, name) for name in names}
+        stored = self.stored(model, field, list(rows), names)
+
+        for key, values in rows.items():
+            current = stored.get(key)
+            if current is None:
+                changeset.add(INSERT, key, values if self.detail else None)
+                continue
+
+            changes = {}
+            if update:
+                for name, value in values.items():
+                    old, new = comparable(fields[name], current[name]), comparable(fields[name], value)
+                    if old != new:
+                        changes[name] = [old, new]
+            changeset.add(UPDATE if changes else UNCHANGED, key, changes)
+
+        return changeset
+
+    def delete(self, model, field, queryset, keys):
+        """
+        Counts the rows of a queryset whose natural key is not among the given keys.
+        """
+        changeset = self.changeset(model._meta.label)
+        for key in queryset.exclude(**{f"{field}__in": [key for key in keys if key is not None]}).values_list(
+                field, flat=True
+        ).iterator():
+            changeset.add(DELETE, key)
+        return changeset
+
+    def links(self, relation, source_key, target_key, desired, replaced=()):
+        """
+        Compares many-to-many links by the natural keys of both sides, like a LinkSetWriter
+        would write them.
+
+        :param relation: The many-to-many descriptor, e.g. Animal.records.
+        :param source_key: The natural key field of the rows the relation is declared on.
+        :param target_key: The natural key field of the related rows.
+        :param desired: Dict of source key to the set of target keys.
+        :param replaced: The source keys whose other links would be deleted.
+        """
+        through = relation.through
+        source = f"{relation.field.m2m_field_name()}__{source_key}"
+        target = f"{relation.field.m2m_reverse_field_name()}__{target_key}"
+        changeset = self.changeset(through._meta.label)
+
+        replaced = set(replaced) & set(desired)
+        existing = defaultdict(set)
+
+        for chunk in chunked(list(desired), self.batch_size):
+            replaced_chunk = [left for left in chunk if left in replaced]
+            added_chunk = [left for left in chunk if left not in replaced]
+            condition = Q(**{f"{source}__in": replaced_chunk})
+            if added_chunk:
+                condition |= Q(**{
+                    f"{source}__in": added_chunk,
+                    f"{target}__in": list({right for left in added_chunk for right in desired[left]}),
+                })
+            for left, right in through.objects.filter(condition).values_list(source, target):
+                existing[left].add(right)
+
+        for left, rights in desired.items():
+            for right in rights:
+                if right is not None:
+                    changeset.add(UNCHANGED if right in existing[left] else INSERT, [left, right])
+        for left in replaced:
+            for right in existing[left] - desired[left]:
+                changeset.add(DELETE, [left, right])
+
+        return changeset
+
+    def as_dict(self):
+        return {label: changeset.as_dict() for label, changeset in self.changesets.items()}
+
+    def summary(self):
+        """
+        One line per model with changes, as +inserted ~updated =unchanged -deleted.
+        """
+        lines = [str(changeset) for changeset in self.changesets.values() if changeset]
+        return "; ".join(lines) if lines else "no changes"
+
+    def __str__(self):
+        return self.summary()
+
+
+class AnimalDryRun(DryRun):
+    """
+    Compares animal payloads with the stored rows the way AnimalIngest would store them,
+    sections whose fingerprint did not change are skipped as the ingest skips them.
+
+    New parentages are counted as inserts, the ingest creates a Parentage whenever the
+    parentage section of an animal changed. The interned unit values and weight
+    summaries are compared through the relations of the states and characteristics.
+    """
+
+    def __init__(self, farm_id, detail=False, batch_size=None, fingerprints=None):
+        super().__init__(detail=detail, batch_size=batch_size)
+        self.farm_id = farm_id
+        self.ingest = AnimalIngest(farm_id, batch_size=batch_size, fingerprints=fingerprints)
+        self.keys = set()
+
+    def diff(self, animals):
+        """
+        Adds the changes of a chunk of animal payloads.
+        """
+        animals = list(animals)
+        if not animals:
+            return self
+
+        ingest = self.ingest
+        keys, _, _, changes = ingest.changed_sections(animals)
+        self.keys.update(keys)
+
+        def changed(section):
+            return [animal for animal, sections in zip(animals, changes) if section in sections]
+
+        def animal_key(model, animal):
+            return ingest.animal_key(model, animal)
+
+        # identities and their tags
+        identities = changed(IDENTITY)
+        self.compare(AnimalIdentity, 'animal_id', {
+            animal_key(AnimalIdentity, animal): identity_defaults(animal.get('identity', {}))
+            for animal in identities
+        })
+        tag_rows, tag_links = ingest.tag_rows(identities)
+        self.compare(AnimalTag, 'agri_id', tag_rows)
+
+        desired_tags = {animal_key(AnimalIdentity, animal): set() for animal in identities}
+        for identity_key, tag_key in tag_links:
+            desired_tags[identity_key].add(tag_key)
+        self.links(AnimalIdentity.tags, 'animal_id', 'agri_id', desired_tags, replaced=desired_tags)
+
+        # characteristics with their birth date confidence
+        self.compare(AnimalCharacteristics, 'animal_id', {
+            animal_key(AnimalCharacteristics, animal): {
+                **characteristics_defaults(animal.get('characteristics', {})),
+                **related('birth_date_confidence', date_confidence_lookup(
+                    animal.get('characteristics', {}).get('birthDateConfidence', {})
+                )),
+            }
+            for animal in changed(CHARACTERISTICS)
+        })
+
+        # parents, a new parentage is created for every changed parentage section
+        parent_animals = changed(PARENTAGE)
+        identity_rows, genetic_rows, surrogate_rows, roles = ingest.parent_rows(parent_animals)
+        self.compare(ParentAnimalIdentity, 'parent_animal_id', identity_rows)
+        for model, rows in ((GeneticParent, genetic_rows), (Surrogate, surrogate_rows)):
+            self.compare(model, 'parent_animal_id', {
+                key: {**values, 'parent_animal_identity__parent_animal_id': key}
+                for key, values in rows.items()
+            })
+        parentages = self.changeset(Parentage._meta.label)
+        for animal in parent_animals:
+            parentages.add(INSERT, animal_key(Animal, animal))
+
+        # states with their scores and units
+        self.compare(AnimalState, 'animal_id', {
+            animal_key(AnimalState, animal): {
+                **state_defaults(animal.get('state', {})),
+                **related('body_condition_score', mapping.CONDITION_SCORE(
+                    animal.get('state', {}).get('bodyConditionScore')
+                )),
+                **related('animal_units', mapping.ANIMAL_UNIT(animal.get('state', {}).get('animalUnits'))),
+                **related('weights', weights_lookup(animal.get('state', {}).get('weights'))),
+            }
+            for animal in changed(STATE)
+        })
+
+        # enterprises, management groups and the animals
+        animal_section = changed(ANIMAL)
+        enterprise_rows = ingest.enterprise_rows(animal_section)
+        self.compare(Enterprise, 'enterprise_id', enterprise_rows)
+
+        group_rows = ingest.group_rows(animal_section, {key: key for key in enterprise_rows})
+        for values in group_rows.values():
+            values['enterprise__enterprise_id'] = values.pop('enterprise')
+        self.compare(ManagementGroup, 'management_group_id', group_rows, update=False)
+
+        animal_rows = {}
+        for animal, sections in zip(animals, changes):
+            values = {}
+            if ANIMAL in sections:
+                values.update(animal_defaults(animal, self.farm_id))
+                values['management_group__management_group_id'] = ingest.group_key(animal)
+                values['enterprise__enterprise_id'] = ingest.enterprise_key(animal)
+            animal_rows.setdefault(animal_key(Animal, animal), {}).update(values)
+        self.compare(Animal, 'animal_id', animal_rows)
+
+        # records, only payloads fetched with records replace the current ones
+        record_animals = changed(RECORDS)
+        record_rows, record_links = ingest.record_rows(record_animals)
+        self.compare(AnimalRecord, 'record_id', record_rows, update=False)
+
+        replaced = {animal_key(Animal, animal) for animal in record_animals if 'records' in animal}
+        desired_records = {key: set() for key in replaced}
+        for animal_id, record_key in record_links:
+            desired_records.setdefault(animal_id, set()).add(record_key)
+        self.links(Animal.records, 'animal_id', 'record_id', desired_records, replaced=replaced)
+
+        return self
+
+    def diff_all(self, animals, chunk_size=None, complete=False):
+        """
+        Adds the changes of an iterable of animal payloads a chunk at a time.
+
+        :param complete: The payloads are the whole herd of the farm, the stored animals of
+                         the farm that are missing from them count as deleted.
+        """
+        chunk_size = chunk_size or getattr(settings, 'AGRIWEBB_INGEST_CHUNK_SIZE', 500)
+        for chunk in chunked(animals, chunk_size):
+            self.diff(chunk)
+
+        if complete:
+            self.delete(Animal, 'animal_id', Animal.objects.filter(farm_id=self.farm_id), self.keys)
+        return self
+
+
+class FarmDryRun(DryRun):
+    """
+    Compares farm payloads with the stored farms, map features and fields the way
+    tasks.fetch_and_store_farm_data would store them.
+
+    The addresses, points, alerts and capacities are compared through the relations of
+    the rows that use them, the geometries by their content hash. External identifiers
+    are not compared.
+    """
+
+    def diff(self, farms):
+        farms = list(farms)
+
+        farm_rows = {}
+        map_feature_rows = {}
+        field_rows = {}
+        map_feature_links = {}
+        field_links = {}
+
+        for farm in farms:
+            address = farm.get('address')
+            values = mapping.FARM(farm)
+            if address:
+                values.update(related('address', mapping.ADDRESS(address)))
+                values.update(related('address__location', mapping.GEO_POINT(address.get('location'))))
+            farm_rows[farm['id']] = values
+
+            map_feature_links[farm['id']] = set()
+            for map_feature in farm.get('mapFeatures', []):
+                key = mapping.to_uuid(map_feature.get('id'))
+                map_feature_rows[key] = {
+                    **mapping.MAP_FEATURE(map_feature),
+                    **related('alert', mapping.CAPACITY_ALERT(map_feature.get('alert'))),
+                    **related('capacity', mapping.CAPACITY(map_feature.get('capacity'))),
+                    **geometry_lookup(map_feature.get('geometry')),
+                }
+                map_feature_links[farm['id']].add(key)
+
+            field_links[farm['id']] = set()
+            for field in farm.get('fields', []):
+                field_rows[field.get('agriId')] = {
+                    **field_defaults(field),
+                    **related('location', mapping.GEO_POINT(field.get('location'))),
+                    **geometry_lookup(field.get('geometry')),
+                }
+                field_links[farm['id']].add(field.get('agriId'))
+
+        self.compare(Farm, 'agri_id', farm_rows)
+        self.compare(MapFeature, 'uu_id', map_feature_rows)
+        self.compare(Field, 'agri_id', field_rows)
+        self.links(Farm.map_features, 'agri_id', 'uu_id', map_feature_links, replaced=map_feature_links)
+        self.links(Farm.fields, 'agri_id', 'agri_id', field_links, replaced=field_links)
+
+        return self
+
+
+def diff_animals(animals, farm_id, detail=False, complete=False, chunk_size=None):
+    """
+    Computes what storing the given animal payloads would change, see AnimalDryRun.
+    """
+    return AnimalDryRun(farm_id, detail=detail).diff_all(animals, chunk_size=chunk_size, complete=complete)
+
+
+def diff_farms(farms, detail=False):
+    """
+    Computes what storing the given farm payloads would change, see FarmDryRun.
+    """
+    return FarmDryRun(detail=detail).diff(farms)
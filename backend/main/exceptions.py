@@ -0,0 +1,29 @@
+class AgriWebbError(Exception):
+    """
+    Base class of the errors raised by the AgriWebb clients.
+    """
+
+
+class AgriWebbHTTPError(AgriWebbError):
+    def __init__(self, message, status_code=None, response=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = response
+
+
+class AgriWebbRateLimitError(AgriWebbHTTPError):
+    def __init__(self, message, status_code=429, response=None, retry_after=None):
+        super().__init__(message, status_code=status_code, response=response)
+        self.retry_after = retry_after
+
+
+class AgriWebbGraphQLError(AgriWebbError):
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+class AnimalSyncInProgressError(Exception):
+    """
+    Raised when a farm is synced while another sync of the same farm is running.
+    """
@@ -0,0 +1,269 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from . import interning, mapping
+from .geometry import simplify_features
+from .helpers import field_defaults
+from .ingest import BulkIngest, count_queries
+from .links import LinkSetWriter
+from .models import Farm, MapFeature, Field
+from .tiles import forget_farms, invalidate_tiles
+
+
+class FarmIngest(BulkIngest):
+    """
+    Stores farm payloads with their map features, fields and identifiers with set-based
+    queries.
+
+    Farms, map features and fields are upserted by their AgriWebb IDs. The points,
+    addresses, geometries, alerts, capacities and identifiers they use are value objects
+    shared by a content hash, see interning.HashedValueInterner, so none of them is looked
+    up by its float or geometry columns. The many-to-many links are written with a
+    LinkSetWriter each, so the number of queries does not grow with the number of map
+    features and fields. New and modified geometries are simplified for every map zoom
+    level, see geometry.simplify_features. The cached vector tiles of the map features and
+    fields whose geometry or shown columns changed, or which a farm no longer links, are
+    dropped once the ingest commits, see tiles.invalidate_tiles.
+    """
+
+    # the columns of the rows a vector tile shows, see tiles.render_tile
+    RENDERED_FIELDS = {
+        MapFeature: ('name', 'type'),
+        Field: ('name', 'land_use', 'total_area', 'unit'),
+    }
+
+    def __init__(self, batch_size=None):
+        super().__init__(batch_size=batch_size)
+        self.stats = {'farms': 0, 'map_features': 0, 'fields': 0, 'simplified': 0, 'queries': 0}
+        # the geometry and shown columns of every map feature and field before it was stored, by model
+        self.previous_rows = {}
+
+    def intern(self, interner, values):
+        """
+        Interns a list of value dicts, None stays None.
+
+        :return: The shared instance of every value, in the order of the values.
+        """
+        present = [index for index, value in enumerate(values) if value is not None]
+        instances = interner.intern_many([values[index] for index in present], batch_size=self.batch_size)
+
+        interned = [None] * len(values)
+        for index, instance in zip(present, instances):
+            interned[index] = instance
+        return interned
+
+    def identifiers(self, identifiers_data):
+        """
+        Interns the external identifiers of every payload.
+
+        :param identifiers_data: A list with the list of identifier payloads of every row.
+        :return: A list with the list of ExternalIdentifiers of every row.
+        """
+        flat = [mapping.EXTERNAL_IDENTIFIER(identifier) for identifiers in identifiers_data for identifier in identifiers]
+        interned = iter(self.intern(interning.external_identifiers, flat))
+        return [[next(interned) for _ in identifiers] for identifiers in identifiers_data]
+
+    def ingest(self, farms):
+        """
+        Stores a list of farm payloads. Every farm payload lists all of its map features,
+        fields and identifiers, their other links are removed.
+
+        :return: The stored Farm of every payload, in the order of the payloads.
+        """
+        farms = list(farms)
+        if not farms:
+            return []
+
+        with count_queries() as counter, transaction.atomic():
+            stored = self.store_farms(farms)
+            map_features = self.store_map_features(farms)
+            fields = self.store_fields(farms)
+
+            map_feature_links = LinkSetWriter(Farm.map_features, self.batch_size)
+            field_links = LinkSetWriter(Farm.fields, self.batch_size)
+            identifier_links = LinkSetWriter(Farm.identifiers, self.batch_size)
+
+            # the links the farms had before, the rows they drop leave the tiles too
+            linked = {
+                MapFeature: self.linked_geometries(Farm.map_features, stored.values()),
+                Field: self.linked_geometries(Farm.fields, stored.values()),
+            }
+
+            farm_identifiers = self.identifiers([farm.get('identifiers') or [] for farm in farms])
+            for farm, identifiers in zip(farms, farm_identifiers):
+                farm_obj = stored[farm['id']]
+                map_feature_links.set(farm_obj, [map_features[key] for key in self.map_feature_keys(farm)])
+                field_links.set(farm_obj, [fields[key] for key in self.field_keys(farm)])
+                identifier_links.set(farm_obj, identifiers)
+
+            for links in (map_feature_links, field_links, identifier_links):
+                links.write()
+
+            # only new geometries and the ones of modified fields are simplified again
+            simplified = simplify_features([
+                obj.geometry_id for obj in (*map_features.values(), *fields.values()) if obj.geometry_id
+            ])
+
+            changed = {}
+            for farm in farms:
+                farm_pk = stored[farm['id']].pk
+                features = set()
+                for model, rows, keys in (
+                        (MapFeature, map_features, self.map_feature_keys(farm)),
+                        (Field, fields, self.field_keys(farm)),
+                ):
+                    features |= self.changed_geometries(model, rows, keys)
+                    features |= self.unlinked_geometries(linked[model][farm_pk], [rows[key] for key in keys])
+                changed[farm['id']] = features
+            transaction.on_commit(lambda: self.invalidate_tiles(changed))
+
+        self.stats['farms'] += len(farms)
+        self.stats['map_features'] += len(map_features)
+        self.stats['fields'] += len(fields)
+        self.stats['simplified'] += simplified
+        self.stats['queries'] += counter['queries']
+
+        return [stored[farm['id']] for farm in farms]
+
+    def previous(self, model, field, keys):
+        """
+        Remembers the current geometries and shown columns of the rows about to be stored.
+        """
+        rows = (
+            model.objects.filter(**{f"{field}__in": [key for key in keys if key is not None]})
+            .values_list(field, 'geometry_id', *self.RENDERED_FIELDS[model])
+        )
+        self.previous_rows[model] = {key: tuple(values) for key, *values in rows}
+
+    def changed_geometries(self, model, stored, keys):
+        """
+        :return: The old and the new geometry of every given row whose geometry or shown
+                 columns changed.
+        """
+        previous = self.previous_rows.get(model, {})
+        changed = set()
+        for key in keys:
+            obj = stored[key]
+            current = (obj.geometry_id, *(getattr(obj, name) for name in self.RENDERED_FIELDS[model]))
+            old = previous.get(key)
+            if old != current:
+                changed.update(pk for pk in (old[0] if old else None, obj.geometry_id) if pk is not None)
+        return changed
+
+    def linked_geometries(self, relation, farms):
+        """
+        :return: Dict of farm primary key to a dict of the primary key of every row it links
+                 through the relation to the geometry of the row.
+        """
+        source = relation.field.m2m_field_name()
+        target = relation.field.m2m_reverse_field_name()
+
+        linked = defaultdict(dict)
+        rows = relation.through.objects.filter(
+            **{f"{source}_id__in": [farm.pk for farm in farms]}
+        ).values_list(f"{source}_id", f"{target}_id", f"{target}__geometry_id")
+        for farm_pk, pk, geometry_id in rows:
+            linked[farm_pk][pk] = geometry_id
+        return linked
+
+    def unlinked_geometries(self, linked, rows):
+        """
+        :return: The geometries of the linked rows that are not among the given rows.
+        """
+        kept = {obj.pk for obj in rows}
+        return {geometry_id for pk, geometry_id in linked.items() if pk not in kept and geometry_id is not None}
+
+    def invalidate_tiles(self, changed):
+        forget_farms()
+        for farm_id, features in changed.items():
+            if features:
+                invalidate_tiles(farm_id, features)
+
+    def map_feature_keys(self, farm):
+        return [self.key(MapFeature, 'uu_id', map_feature.get('id')) for map_feature in farm.get('mapFeatures') or []]
+
+    def field_keys(self, farm):
+        return [field.get('agriId') for field in farm.get('fields') or []]
+
+    def store_farms(self, farms):
+        addresses_data = [farm.get('address') for farm in farms]
+        points = self.intern(interning.geo_points, [
+            mapping.GEO_POINT(address['location']) if address and address.get('location') else None
+            for address in addresses_data
+        ])
+        addresses = self.intern(interning.addresses, [
+            mapping.ADDRESS(address, location_id=point.pk if point else None) if address else None
+            for address, point in zip(addresses_data, points)
+        ])
+
+        rows = {}
+        for farm, address in zip(farms, addresses):
+            rows[farm['id']] = mapping.FARM(farm, address=address)
+        return self.upsert(Farm, 'agri_id', rows)
+
+    def store_map_features(self, farms):
+        map_features_data = [map_feature for farm in farms for map_feature in farm.get('mapFeatures') or []]
+
+        geometries = self.intern(interning.geo_features, [
+            mapping.geo_feature(map_feature['geometry']) if map_feature.get('geometry') else None
+            for map_feature in map_features_data
+        ])
+        alerts = self.intern(interning.capacity_alerts, [
+            mapping.CAPACITY_ALERT(map_feature['alert']) if map_feature.get('alert') else None
+            for map_feature in map_features_data
+        ])
+        capacities = self.intern(interning.capacities, [
+            mapping.CAPACITY(map_feature['capacity']) if map_feature.get('capacity') else None
+            for map_feature in map_features_data
+        ])
+
+        rows = {}
+        for map_feature, geometry, alert, capacity in zip(map_features_data, geometries, alerts, capacities):
+            rows[self.key(MapFeature, 'uu_id', map_feature.get('id'))] = mapping.MAP_FEATURE(
+                map_feature,
+                geometry=geometry,
+                alert=alert,
+                capacity=capacity,
+            )
+        self.previous(MapFeature, 'uu_id', rows)
+        return self.upsert(MapFeature, 'uu_id', rows)
+
+    def store_fields(self, farms):
+        fields_data = [field for farm in farms for field in farm.get('fields') or []]
+
+        locations = self.intern(interning.geo_points, [
+            mapping.GEO_POINT(field['location']) if field.get('location') else None
+            for field in fields_data
+        ])
+        geometries = self.intern(interning.geo_features, [
+            mapping.geo_feature(field['geometry']) if field.get('geometry') else None
+            for field in fields_data
+        ])
+
+        rows = {}
+        for field, location, geometry in zip(fields_data, locations, geometries):
+            rows[field.get('agriId')] = {
+                **field_defaults(field),
+                'location': location,
+                'geometry': geometry,
+            }
+        self.previous(Field, 'agri_id', rows)
+        stored = self.upsert(Field, 'agri_id', rows)
+
+        identifier_links = LinkSetWriter(Field.identifiers, self.batch_size)
+        field_identifiers = self.identifiers([field.get('identifiers') or [] for field in fields_data])
+        for field, identifiers in zip(fields_data, field_identifiers):
+            identifier_links.set(stored[field.get('agriId')], identifiers)
+        identifier_links.write()
+
+        return stored
+
+
+def populate_farms(farms, batch_size=None):
+    """
+    Stores a list of farm payloads with set-based queries, see FarmIngest.
+
+    :return: The stored Farm of every payload, in the order of the payloads.
+    """
+    return FarmIngest(batch_size=batch_size).ingest(farms)
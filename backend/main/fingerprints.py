@@ -0,0 +1,56 @@
+import hashlib
+import json
+
+IDENTITY = 'identity'
+CHARACTERISTICS = 'characteristics'
+PARENTAGE = 'parentage'
+STATE = 'state'
+RECORDS = 'records'
+ANIMAL = 'animal'
+
+# payload keys stored by each section, the animal section holds every other key
+SECTIONS = (IDENTITY, CHARACTERISTICS, PARENTAGE, STATE, RECORDS, ANIMAL)
+SECTION_KEYS = {
+    IDENTITY: 'identity',
+    CHARACTERISTICS: 'characteristics',
+    PARENTAGE: 'parentage',
+    STATE: 'state',
+    RECORDS: 'records',
+}
+
+
+def normalize(value):
+    """
+    Normalizes a payload so equal content always serializes the same: keys are sorted on
+    serialization and lists, which are stored as unordered relations, are sorted here.
+    """
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        items = [normalize(item) for item in value]
+        return sorted(items, key=lambda item: json.dumps(item, sort_keys=True, default=str))
+    return value
+
+
+def digest(value):
+    serialized = json.dumps(normalize(value), sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(serialized.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def fingerprint(animal, farm_id):
+    """
+    Hashes every section of an animal payload.
+
+    :param animal: The animal payload.
+    :param farm_id: The ID of the farm, it is stored on the animal so it is part of the animal section.
+    :return: A dict of section name to hash.
+    """
+    hashes = {
+        section: digest(animal.get(key))
+        for section, key in SECTION_KEYS.items()
+    }
+
+    rest = {key: value for key, value in animal.items() if key not in SECTION_KEYS.values()}
+    hashes[ANIMAL] = digest({'farm_id': farm_id, **rest})
+
+    return hashes
@@ -0,0 +1,182 @@
+import json
+import math
+
+from django.conf import settings
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q
+
+from .ingest import chunked
+from .models import GeoFeature, GeoFeatureSimplification
+
+
+def zoom_levels():
+    """
+    The web map zoom levels geometries are simplified for, from coarse to fine.
+    """
+    return sorted(getattr(settings, 'AGRIWEBB_GEOMETRY_ZOOM_LEVELS', (8, 11, 14, 17)))
+
+
+def tolerance(level):
+    """
+    Degrees per pixel of a 256 pixel web map tile at a zoom level.
+    """
+    return 360 / (256 * 2 ** level)
+
+
+def precision(level):
+    """
+    Decimal digits of a coordinate that still tell the pixels of a zoom level apart.
+    """
+    return max(0, math.ceil(-math.log10(tolerance(level))))
+
+
+def level_for(zoom=None, resolution=None):
+    """
+    Picks the coarsest stored level that is at least as detailed as a map zoom level or
+    a resolution in degrees per pixel.
+
+    :return: The level, or None when only the full resolution geometry is detailed enough
+             or nothing was requested.
+    """
+    if resolution is None:
+        if zoom is None:
+            return None
+        resolution = tolerance(zoom)
+
+    for level in zoom_levels():
+        if tolerance(level) <= resolution:
+            return level
+    return None
+
+
+def simplify(geometry, level):
+    """
+    Simplifies a geometry for a zoom level, keeping polygons valid.
+
+    :return: The simplified geometry, or None when nothing is left of it at that level.
+    """
+    if geometry is None:
+        return None
+    simplified = geometry.simplify(tolerance(level), preserve_topology=True)
+    return None if simplified.empty else simplified
+
+
+def stale_features(features=None):
+    """
+    Returns the geometries that miss a level, or that a field uses whose last modified
+    date is newer than the date its simplifications were made from.
+
+    :param features: Limit the check to these GeoFeatures or primary keys (optional).
+    """
+    levels = zoom_levels()
+    queryset = GeoFeature.objects.filter(coordinates__isnull=False)
+    if features is not None:
+        queryset = queryset.filter(pk__in=features)
+
+    return queryset.annotate(
+        levels=Count('simplifications', filter=Q(simplifications__level__in=levels), distinct=True),
+        simplified_from=Min('simplifications__source_modified'),
+        modified=Max('field__last_modified_date'),
+    ).filter(
+        Q(levels__lt=len(levels))
+        | Q(modified__gt=F('simplified_from'))
+        | Q(modified__isnull=False, simplified_from__isnull=True)
+    )
+
+
+def simplify_features(features=None, batch_size=None):
+    """
+    Regenerates the simplifications of the stale geometries, see stale_features. A
+    geometry is simplified once for every level, each batch replaces the rows of its
+    geometries in one transaction.
+
+    :return: The number of simplified geometries.
+    """
+    batch_size = batch_size or getattr(settings, 'AGRIWEBB_INGEST_BULK_SIZE', 1000)
+    levels = zoom_levels()
+    stale = list(stale_features(features).order_by('pk').values_list('pk', flat=True))
+
+    for chunk in chunked(stale, batch_size):
+        rows = []
+        for feature in GeoFeature.objects.filter(pk__in=chunk).annotate(modified=Max('field__last_modified_date')):
+            for level in levels:
+                geometry = simplify(feature.coordinates, level)
+                rows.append(GeoFeatureSimplification(
+                    feature=feature,
+                    level=level,
+                    tolerance=tolerance(level),
+                    geometry=geometry,
+                    vertices=geometry.num_coords if geometry else 0,
+                    source_modified=feature.modified,
+                ))
+
+        with transaction.atomic():
+            GeoFeatureSimplification.objects.filter(feature__in=chunk).delete()
+            GeoFeatureSimplification.objects.bulk_create(rows, batch_size=batch_size)
+
+    return len(stale)
+
+
+def geometries(features, level=None):
+    """
+    Loads the GeoJSON geometries of the given GeoFeatures at a level, the coordinates
+    rounded to its precision. Geometries not simplified yet fall back to full resolution.
+
+    :param features: Primary keys of GeoFeatures.
+    :param level: A zoom level, see level_for, None for full resolution.
+    :return: Dict of GeoFeature primary key to GeoJSON geometry dict or None.
+    """
+    features = {pk for pk in features if pk is not None}
+    loaded = {}
+
+    if level is not None:
+        rows = (
+            GeoFeatureSimplification.objects
+            .filter(level=level, feature_id__in=features)
+            .annotate(geojson=AsGeoJSON('geometry', precision=precision(level)))
+            .values_list('feature_id', 'geojson')
+        )
+        loaded.update(rows)
+
+    missing = features - set(loaded)
+    if missing:
+        rows = (
+            GeoFeature.objects
+            .filter(pk__in=missing)
+            .annotate(geojson=AsGeoJSON('coordinates'))
+            .values_list('pk', 'geojson')
+        )
+        loaded.update(rows)
+
+    return {pk: json.loads(geojson) if geojson else None for pk, geojson in loaded.items()}
+
+
+def farm_feature_collection(farm, level=None):
+    """
+    Returns the fields and map features of a farm as a GeoJSON FeatureCollection.
+
+    :param farm: A Farm.
+    :param level: A zoom level, see level_for, None for full resolution.
+    """
+    fields = list(farm.fields.values('agri_id', 'name', 'land_use', 'geometry_id'))
+    map_features = list(farm.map_features.values('uu_id', 'name', 'type', 'geometry_id'))
+    loaded = geometries([row['geometry_id'] for row in fields + map_features], level)
+
+    features = []
+    for row in fields:
+        features.append({
+            'type': 'Feature',
+            'id': row['agri_id'],
+            'geometry': loaded.get(row['geometry_id']),
+            'properties': {'kind': 'field', 'name': row['name'], 'land_use': row['land_use']},
+        })
+    for row in map_features:
+        features.append({
+            'type': 'Feature',
+            'id': str(row['uu_id']),
+            'geometry': loaded.get(row['geometry_id']),
+            'properties': {'kind': 'map_feature', 'name': row['name'], 'type': row['type']},
+        })
+
+    return {'type': 'FeatureCollection', 'level': level, 'features': features}
@@ -1,12 +1,129 @@
+from django.db import transaction
+
+from . import interning, mapping, units
 from .models import Animal, AnimalIdentity, AnimalCharacteristics, Parentage, AnimalState, \
-    AnimalRecord, ManagementGroup, Enterprise, AnimalTag, DateConfidence, AnimalWeightSummary, \
-    WeightGain, Weight, ConditionScore, AnimalUnit, GeneticParent, ParentAnimalIdentity, Surrogate, \
-    AnimalParent
+    AnimalRecord, ManagementGroup, Enterprise, AnimalTag, GeneticParent, ParentAnimalIdentity, \
+    Surrogate, AnimalParent, AnimalFingerprint, Field
+from .links import LinkSetWriter
+from .pedigree import PedigreeStore, parent_edges
+
+WEIGHT_GAIN_KEYS = ('liveAverageDailyGain', 'overallAverageDailyGain', 'assumedAverageDailyGain')
+WEIGHT_KEYS = ('liveWeight', 'estimatedWeight')
+
+
+def identity_defaults(animal_identity):
+    return mapping.ANIMAL_IDENTITY(animal_identity)
+
+
+def tag_defaults(tag):
+    return mapping.ANIMAL_TAG(tag)
 
 
+def date_confidence_lookup(birth_date_confidence_data):
+    return mapping.DATE_CONFIDENCE(birth_date_confidence_data)
+
+
+def characteristics_defaults(animal_characteristics):
+    """
+    The AnimalCharacteristics defaults, without the birth date confidence relation.
+    """
+    return mapping.ANIMAL_CHARACTERISTICS(animal_characteristics)
+
+
+def parent_identity_defaults(parent):
+    return mapping.PARENT_ANIMAL_IDENTITY(parent.get('parentAnimalIdentity'))
+
+
+def unit_value(data, spec=mapping.WEIGHT):
+    """
+    The unit and value of a unit value payload, coerced by the mapping of its model.
+    """
+    return spec(data)
+
+
+def weight_summary_lookup(weight_gains, weights, weights_data):
+    """
+    The AnimalWeightSummary fields of the interned weight gains and weights.
+    """
+    return {
+        'live_average_daily_gain_id': weight_gains['liveAverageDailyGain'].pk,
+        'overall_average_daily_gain_id': weight_gains['overallAverageDailyGain'].pk,
+        'assumed_average_daily_gain_id': weight_gains['assumedAverageDailyGain'].pk,
+        'live_weight_date': mapping.from_timestamp(weights_data.get('liveWeightDate')),
+        'live_weight_id': weights['liveWeight'].pk,
+        'estimated_weight_id': weights['estimatedWeight'].pk,
+    }
+
+
+def state_defaults(animal_state):
+    """
+    The AnimalState defaults, without the weights, condition score and animal units relations.
+    """
+    return mapping.ANIMAL_STATE(animal_state)
+
+
+def enterprise_defaults(animal_enterprise, farm_id):
+    values = mapping.ENTERPRISE(animal_enterprise)
+    if 'farmId' not in animal_enterprise:
+        values['farm_id'] = farm_id
+    return values
+
+
+def management_group_defaults(animal_management_group):
+    """
+    The ManagementGroup defaults, without the enterprise relation.
+    """
+    return mapping.MANAGEMENT_GROUP(animal_management_group)
+
+
+def animal_defaults(animal, farm_id):
+    """
+    The Animal defaults, without the relations to the other sections.
+    """
+    return mapping.ANIMAL(animal, farm_id=farm_id)
+
+
+def record_defaults(record):
+    return mapping.ANIMAL_RECORD(record)
+
+
+def field_defaults(field):
+    """
+    The Field defaults, without the location and geometry relations. A field without a
+    unit is measured in hectares, its areas are also kept in hectares for rollups.
+    """
+    values = mapping.FIELD(field)
+    values['unit'] = values['unit'] or Field.UnitChoices.HECTARE
+    values['total_area_hectares'] = units.to_hectares(values['total_area'], values['unit'])
+    values['grazable_area_hectares'] = units.to_hectares(values['grazable_area'], values['unit'])
+    return values
+
+
+def populate_parent(model, parent, default_type):
+    parent_animal_id = parent.get('parentAnimalId')
+    parent_animal_identity_obj, _ = ParentAnimalIdentity.objects.update_or_create(
+        parent_animal_id=parent_animal_id,
+        defaults=parent_identity_defaults(parent)
+    )
+
+    parent_obj, _ = model.objects.update_or_create(
+        parent_animal_id=parent_animal_id,
+        defaults={
+            'parent_animal_identity': parent_animal_identity_obj,
+            'parent_type': parent.get('parentType', default_type),
+        }
+    )
+    return parent_obj
+
+
+@transaction.atomic
 def populate_animal(animal, farm_id):
     """
     Populates the Animal model from the given animal data.
+
+    This writes one animal at a time, ingest.populate_animals stores a page of animals with
+    set-based queries and gives the same result. The rows are committed together so the
+    compaction never sees the new parentage before the animal references it.
     """
 
     animal_id = animal.get('animalId', '')
@@ -14,299 +131,126 @@ def populate_animal(animal, farm_id):
     tags_data = animal_identity.get('tags', [])
     identity, _ = AnimalIdentity.objects.update_or_create(
         animal_id=animal_id,
-        defaults={
-            'name': animal_identity.get('name', ''),
-            'eid': animal_identity.get('eid', ''),
-            'vid': animal_identity.get('vid', ''),
-            'management_tag': animal_identity.get('managementTag', ''),
-            'brand': animal_identity.get('brand', ''),
-            'tattoo': animal_identity.get('tattoo', ''),
-            'tag_color_catalogue_id': animal_identity.get(
-                'tagColorCatalogueId',
-                ''
-            ),
-        }
+        defaults=identity_defaults(animal_identity)
     )
+    tag_objs = []
     for tag in tags_data:
         tag_obj, _ = AnimalTag.objects.update_or_create(
             agri_id=tag.get('id'),
-            defaults={
-                "eid": tag.get('eid', ''),
-                "vid": tag.get('vid', ''),
-                "management_tag": tag.get('managementTag', ''),
-                "uhf_eid": tag.get('uhfEid', ''),
-                "dna_id": tag.get('dnaId', ''),
-                "registration_number": tag.get('registrationNumber', ''),
-                "breed_society_id": tag.get('breedSocietyId', ''),
-                "health_id": tag.get('healthId', ''),
-                "tag_id": tag.get('tagId', ''),
-                "tag_color_catalogue_id": tag.get('tagColorCatalogueId', ''),
-                "type": tag.get('type', ''),
-                "state": tag.get('state', ''),
-                "removal_date": tag.get('removalDate', ''),
-                "replacement_date": tag.get('replacementDate', ''),
-            }
+            defaults=tag_defaults(tag)
         )
-        identity.tags.add(tag_obj)
+        tag_objs.append(tag_obj)
+    LinkSetWriter(AnimalIdentity.tags).set(identity, tag_objs).write()
 
     animal_characteristics = animal.get('characteristics', {})
     birth_date_confidence_data = animal_characteristics.get('birthDateConfidence', {})
 
-    birth_date_confidence_obj, _ = DateConfidence.objects.get_or_create(
-        year=birth_date_confidence_data.get('year', ''),
-        month=birth_date_confidence_data.get('month', ''),
-        day=birth_date_confidence_data.get('day', ''),
+    birth_date_confidence_obj = interning.date_confidences.intern(
+        **date_confidence_lookup(birth_date_confidence_data)
     )
 
     characteristics, _ = AnimalCharacteristics.objects.update_or_create(
         animal_id=animal_id,
         defaults={
-            'age_class': animal_characteristics.get('ageClass', ''),
-            'birth_date': animal_characteristics.get('birthDate'),
+            **characteristics_defaults(animal_characteristics),
             'birth_date_confidence': birth_date_confidence_obj,
-            'birth_date_accuracy': animal_characteristics.get(
-                'birthDateAccuracy',
-                ''
-            ),
-            'birth_location_id': animal_characteristics.get('birthLocationId', ''),
-            'birth_year': animal_characteristics.get('birthYear', ''),
-            'breed_assessed': animal_characteristics.get('breedAssessed', ''),
-            'visual_color': animal_characteristics.get('visualColor', ''),
-            'sex': animal_characteristics.get('sex', ''),
-            'species_common_name': animal_characteristics.get(
-                'speciesCommonName',
-                ''
-            ),
-
         }
     )
 
     animal_parentage = animal.get('parentage', {})
     sires_data = animal_parentage.get('sires', [])
     dams_data = animal_parentage.get('dams', [])
-    parentage = Parentage()
-
-    for dam in dams_data:
-        parent_animal_identity_data = dam.get('parentAnimalIdentity', {})
-        parent_animal_id = dam.get('parentAnimalId')
-        parent_animal_identity_obj, _ = ParentAnimalIdentity.objects.update_or_create(
-            parent_animal_id=parent_animal_id,
-            defaults={
-                'eid': parent_animal_identity_data.get('eid', ''),
-                'vid': parent_animal_identity_data.get('vid', ''),
-                'name': parent_animal_identity_data.get('name', ''),
-            }
-        )
 
-        dam_obj, _ = GeneticParent.objects.update_or_create(
-            parent_animal_id=parent_animal_id,
-            defaults={
-                'parent_animal_identity': parent_animal_identity_obj,
-                'parent_type': dam.get('parentType', AnimalParent.AnimalParentType.DAM),
-            }
-        )
-        parentage.dams.add(dam_obj)
-
-    for sire in sires_data:
-        parent_animal_identity_data = sire.get('parentAnimalIdentity', {})
-        parent_animal_id = sire.get('parentAnimalId')
-        parent_animal_identity_obj, _ = ParentAnimalIdentity.objects.update_or_create(
-            parent_animal_id=parent_animal_id,
-            defaults={
-                'eid': parent_animal_identity_data.get('eid', ''),
-                'vid': parent_animal_identity_data.get('vid', ''),
-                'name': parent_animal_identity_data.get('name', ''),
-            }
-        )
+    # the parentage needs a primary key before its dams and sires can be added
+    parentage = Parentage.objects.create()
 
-        sire_obj, _ = GeneticParent.objects.update_or_create(
-            parent_animal_id=parent_animal_id,
-            defaults={
-                'parent_animal_identity': parent_animal_identity_obj,
-                'parent_type': sire.get('parentType', AnimalParent.AnimalParentType.SIRE),
-            }
-        )
-        parentage.sires.add(sire_obj)
+    LinkSetWriter(Parentage.dams).add(parentage, *(
+        populate_parent(GeneticParent, dam, AnimalParent.AnimalParentType.DAM) for dam in dams_data
+    )).write()
+    LinkSetWriter(Parentage.sires).add(parentage, *(
+        populate_parent(GeneticParent, sire, AnimalParent.AnimalParentType.SIRE) for sire in sires_data
+    )).write()
 
     surrogate_data = animal_parentage.get('surrogate', {})
     if surrogate_data:
-        parent_animal_identity_data = surrogate_data.get('parentAnimalIdentity', {})
-        parent_animal_id = surrogate_data.get('parentAnimalId')
-
-        parent_animal_identity_obj, _ = ParentAnimalIdentity.objects.update_or_create(
-            parent_animal_id=parent_animal_id,
-            defaults={
-                'eid': parent_animal_identity_data.get('eid', ''),
-                'vid': parent_animal_identity_data.get('vid', ''),
-                'name': parent_animal_identity_data.get('name', ''),
-            }
-        )
-
-        surrogate_obj, _ = Surrogate.objects.update_or_create(
-            parent_animal_id=parent_animal_id,
-            defaults={
-                'parent_animal_identity': parent_animal_identity_obj,
-                'parent_type': surrogate_data.get('parentType', AnimalParent.AnimalParentType.UNKNOWN),
-            }
-        )
-        parentage.surrogate = surrogate_obj
-
-    parentage.save()
+        parentage.surrogate = populate_parent(Surrogate, surrogate_data, AnimalParent.AnimalParentType.UNKNOWN)
+        parentage.save(update_fields=['surrogate'])
 
     animal_state = animal.get('state', {})
     weights_data = animal_state.get('weights', {})
-    weights_live_average_daily_gain_data = weights_data.get('liveAverageDailyGain', {})
-
-    weights_live_average_daily_gain_obj = WeightGain.objects.create(
-        unit=weights_live_average_daily_gain_data.get('unit', ''),
-        value=weights_live_average_daily_gain_data.get('value', ''),
-    )
 
-    weights_overall_average_daily_gain = weights_data.get('overallAverageDailyGain', {})
-
-    weights_overall_average_daily_gain_obj = WeightGain.objects.create(
-        unit=weights_overall_average_daily_gain.get('unit', ''),
-        value=weights_overall_average_daily_gain.get('value', ''),
-    )
-
-    weights_assumed_average_daily_gain_gain = weights_data.get(
-        'assumedAverageDailyGain',
-        {}
-    )
-
-    weights_assumed_average_daily_gain_gain_obj = WeightGain.objects.create(
-        unit=weights_assumed_average_daily_gain_gain.get('unit', ''),
-        value=weights_assumed_average_daily_gain_gain.get('value', ''),
-    )
-
-    weights_live_weight = weights_data.get('liveWeight', {})
-
-    weights_live_weight_obj = Weight.objects.create(
-        unit=weights_live_weight.get('unit', ''),
-        value=weights_live_weight.get('value', ''),
-    )
-
-    weights_estimated_weight = weights_data.get('estimatedWeight', {})
-
-    weights_estimated_weight_obj = Weight.objects.create(
-        unit=weights_estimated_weight.get('unit', ''),
-        value=weights_estimated_weight.get('value', ''),
+    weight_gains = {
+        key: interning.weight_gains.intern(**unit_value(weights_data.get(key), mapping.WEIGHT_GAIN))
+        for key in WEIGHT_GAIN_KEYS
+    }
+    weights = {
+        key: interning.weights.intern(**unit_value(weights_data.get(key), mapping.WEIGHT))
+        for key in WEIGHT_KEYS
+    }
+
+    weights_obj = interning.weight_summaries.intern(
+        **weight_summary_lookup(weight_gains, weights, weights_data)
     )
 
-    weights_obj, create = AnimalWeightSummary.objects.update_or_create(
-        live_average_daily_gain=weights_live_average_daily_gain_obj,
-        overall_average_daily_gain=weights_overall_average_daily_gain_obj,
-        assumed_average_daily_gain=weights_assumed_average_daily_gain_gain_obj,
-        live_weight_date=weights_data.get('liveWeightDate', ''),
-        live_weight=weights_live_weight_obj,
-        estimated_weight=weights_estimated_weight_obj,
+    body_condition_score_obj = interning.condition_scores.intern(
+        **unit_value(animal_state.get('bodyConditionScore'), mapping.CONDITION_SCORE)
     )
 
-    body_condition_score_data = animal_state.get('bodyConditionScore', {})
-
-    body_condition_score_obj = ConditionScore.objects.create(
-        unit=body_condition_score_data.get('unit', ''),
-        value=body_condition_score_data.get('value', ''),
-    )
-
-    animal_units_data = animal_state.get('animalUnits', {})
-
-    animal_units_obj = AnimalUnit.objects.create(
-        unit=animal_units_data.get('unit', ''),
-        value=animal_units_data.get('value', ''),
+    animal_units_obj = interning.animal_units.intern(
+        **unit_value(animal_state.get('animalUnits'), mapping.ANIMAL_UNIT)
     )
 
     state, _ = AnimalState.objects.update_or_create(
         animal_id=animal_id,
         defaults={
-            'current_location_id': animal_state.get('currentLocationId', ''),
-            'on_farm': animal_state.get('onFarm', ''),
-            'on_farm_date': animal_state.get('onFarmDate', ''),
-            'Last_seen': animal_state.get('LastSeen', ''),
-            'days_reared': animal_state.get('daysReared', ''),
-            'off_farm_date': animal_state.get('offFarmDate', ''),
-            'disposal_method': animal_state.get('disposalMethod', ''),
-            'fate': animal_state.get('fate', ''),
-            'fertility_status': animal_state.get('fertilityStatus', ''),
-            'rearing_rank': animal_state.get('rearingRank', ''),
-            'reproductive_status': animal_state.get('reproductiveStatus', ''),
-            'status_date': animal_state.get('statusDate', ''),
-            'withholding_date_meat': animal_state.get('withholdingDateMeat', ''),
-            'withholding_date_export': animal_state.get(
-                'withholdingDateExport',
-                ''
-            ),
-            'withholding_date_organic': animal_state.get(
-                'withholdingDateOrganic',
-                ''
-            ),
-            'weaned': animal_state.get('weaned', ''),
-            'offspring_count': animal_state.get('offspringCount', ''),
+            **state_defaults(animal_state),
             'weights': weights_obj,
             'body_condition_score': body_condition_score_obj,
-            'body_condition_score_date': animal_state.get(
-                'bodyConditionScoreDate',
-                ''
-            ),
             'animal_units': animal_units_obj,
-            'has_had_offspring': animal_state.get('hasHadOffspring', ''),
         }
     )
 
-    animal_enterprise = animal.get('enterprise')
+    animal_enterprise = animal.get('enterprise') or {}
     enterprise, _ = Enterprise.objects.update_or_create(
         enterprise_id=animal_enterprise.get('enterpriseId'),
-        defaults={
-            'name': animal_enterprise.get('name', ''),
-            'farm_id': animal_enterprise.get('farmId', farm_id),
-        }
+        defaults=enterprise_defaults(animal_enterprise, farm_id)
     )
 
     animal_management_group = animal['managementGroup']
     management_group, _ = ManagementGroup.objects.get_or_create(
         management_group_id=animal_management_group.get('managementGroupId', ''),
         defaults={
-            'enterprise_id': animal_management_group.get('enterpriseId', ''),
-            'farm_id': animal_management_group.get('farmId', ''),
-            'name': animal_management_group.get('name', ''),
-            'species': animal_management_group.get('species', ''),
-            'type': animal_management_group.get('type', ''),
-            'enterprise': enterprise.id,
+            **management_group_defaults(animal_management_group),
+            'enterprise': enterprise,
         }
     )
 
     animal_obj, created = Animal.objects.update_or_create(
         animal_id=animal['animalId'],
         defaults={
+            **animal_defaults(animal, farm_id),
             'identity': identity,
-            'age_class': animal.get('ageClass', ''),
             'characteristics': characteristics,
             'parentage': parentage,
             'management_group': management_group,
             'enterprise': enterprise,
-            'farm_id': farm_id,
             'state': state,
-            'purchased_from': animal.get('purchasedFrom', ''),
-            'purchase_location_id': animal.get('purchaseLocationId', ''),
-            'creation_record_group_id': animal.get('creationRecordGroupId', ''),
-            'creation_record_id': animal.get('creationRecordId', ''),
-            'birthing_record_id': animal.get('birthingRecordId', ''),
-            'purchase_record_id': animal.get('purchaseRecordId', ''),
-            'sale_record_id': animal.get('saleRecordId', ''),
-            'observation_date': animal.get('_observationDate', ''),
         }
     )
 
     if 'records' in animal:
+        record_objs = []
         for record in animal['records']:
             record_obj, _ = AnimalRecord.objects.get_or_create(
                 record_id=record['recordId'],
-                defaults={
-                    'record_type': record.get('recordType', ''),
-                    'observation_date': record.get('observationDate', ''),
-                    'session_id': record.get('sessionId', ''),
-                }
+                defaults=record_defaults(record)
             )
-            animal_obj.records.add(record_obj)
+            record_objs.append(record_obj)
+        LinkSetWriter(Animal.records).set(animal_obj, record_objs).write()
+
+    PedigreeStore().record({animal_obj.animal_id: parent_edges(animal)})
+
+    # the stored hashes no longer describe what this path wrote
+    AnimalFingerprint.objects.filter(animal=animal_obj).delete()
 
     return animal_obj
@@ -0,0 +1,681 @@
+from collections import Counter
+from contextlib import contextmanager
+from itertools import islice
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Q
+
+from . import interning, mapping
+from .fingerprints import ANIMAL, CHARACTERISTICS, IDENTITY, PARENTAGE, RECORDS, SECTIONS, STATE, \
+    fingerprint
+from .helpers import WEIGHT_GAIN_KEYS, WEIGHT_KEYS, animal_defaults, characteristics_defaults, \
+    date_confidence_lookup, enterprise_defaults, identity_defaults, management_group_defaults, \
+    parent_identity_defaults, record_defaults, state_defaults, tag_defaults, unit_value, \
+    weight_summary_lookup
+from .models import Animal, AnimalIdentity, AnimalCharacteristics, Parentage, AnimalState, \
+    AnimalRecord, ManagementGroup, Enterprise, AnimalTag, GeneticParent, ParentAnimalIdentity, \
+    Surrogate, AnimalParent, AnimalFingerprint
+from .links import LinkSetWriter
+from .pedigree import PedigreeStore, parent_edges
+
+
+def chunked(iterable, size):
+    """
+    Splits an iterable, e.g. a page iterator, into lists of at most `size` items.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@contextmanager
+def count_queries(using=DEFAULT_DB_ALIAS):
+    """
+    Counts the queries run on a database connection inside the block.
+
+    :return: A dict whose `queries` entry holds the count.
+    """
+    counter = {'queries': 0}
+
+    def wrapper(execute, sql, params, many, context):
+        counter['queries'] += 1
+        return execute(sql, params, many, context)
+
+    with connections[using].execute_wrapper(wrapper):
+        yield counter
+
+
+class IngestStats:
+    def __init__(self):
+        self.pages = 0
+        self.animals = 0
+        self.written = 0
+        self.skipped = 0
+        self.sections_skipped = 0
+        self.queries = 0
+
+    @property
+    def queries_per_animal(self):
+        return self.queries / self.animals if self.animals else 0.0
+
+    def as_dict(self):
+        return {
+            'pages': self.pages,
+            'animals': self.animals,
+            'written': self.written,
+            'skipped': self.skipped,
+            'sections_skipped': self.sections_skipped,
+            'queries': self.queries,
+            'queries_per_animal': round(self.queries_per_animal, 2),
+        }
+
+    def __str__(self):
+        return (
+            f"{self.animals} animals ({self.written} written, {self.skipped} unchanged) "
+            f"in {self.queries} queries ({self.queries_per_animal:.2f} per animal)"
+        )
+
+
+class BulkIngest:
+    """
+    Stores rows by natural key with set-based queries, one select of the existing rows
+    followed by one bulk insert and one bulk update per model.
+    """
+
+    def __init__(self, batch_size=None):
+        """
+        :param batch_size: Rows per bulk insert or update, defaults to AGRIWEBB_INGEST_BULK_SIZE.
+        """
+        self.batch_size = batch_size or getattr(settings, 'AGRIWEBB_INGEST_BULK_SIZE', 1000)
+        # natural key to primary key of the rows stored up front, by model label
+        self.shared = {}
+
+    def key(self, model, field, value):
+        """
+        Converts a payload value to the Python type of the model field, so payload keys and
+        stored keys compare equal.
+        """
+        if value is None:
+            return None
+        return model._meta.get_field(field).to_python(value)
+
+    def existing(self, model, field, keys):
+        values = [key for key in keys if key is not None]
+        condition = Q(**{f"{field}__in": values})
+        if None in keys:
+            condition |= Q(**{f"{field}__isnull": True})
+
+        rows = {}
+        for obj in model.objects.filter(condition).order_by('pk'):
+            rows.setdefault(getattr(obj, field), obj)
+        return rows
+
+    def upsert(self, model, field, rows, update=True):
+        """
+        Stores rows by a natural key, like update_or_create (or get_or_create without
+        `update`) called for every row.
+
+        :param model: The model to store.
+        :param field: Name of the natural key field.
+        :param rows: Dict of natural key to defaults.
+        :param update: Update existing rows with the defaults.
+        :return: Dict of natural key to the stored instance.
+        """
+        if not rows:
+            return {}
+
+        resolved = self.shared.get(model._meta.label)
+        if resolved is not None and all(key in resolved for key in rows):
+            return {key: model(pk=resolved[key], **{field: key}) for key in rows}
+
+        instances = self.existing(model, field, list(rows))
+        created = []
+        updated = []
+        fields = set()
+
+        for key, defaults in rows.items():
+            obj = instances.get(key)
+            if obj is None:
+                obj = model(**{field: key}, **defaults)
+                instances[key] = obj
+                created.append(obj)
+            elif update and defaults:
+                for name, value in defaults.items():
+                    setattr(obj, name, value)
+                fields.update(defaults)
+                updated.append(obj)
+
+        if created:
+            model.objects.bulk_create(created, batch_size=self.batch_size)
+        if updated:
+            model.objects.bulk_update(updated, sorted(fields), batch_size=self.batch_size)
+
+        return instances
+
+    def create(self, model, objects):
+        if objects:
+            model.objects.bulk_create(objects, batch_size=self.batch_size)
+        return objects
+
+
+class AnimalIngest(BulkIngest):
+    """
+    Stores pages of animal payloads with set-based queries.
+
+    Every model of a page is written with one select of the existing rows followed by one
+    bulk insert and one bulk update, and the many-to-many links with a LinkSetWriter each,
+    so the number of queries depends on the number of models and not on the page size.
+    The rows end up the same as storing the animals one by one with
+    helpers.populate_animal: a later payload of the same key wins for the updated models
+    and the first one for the models that are only created.
+
+    The section hashes of every stored payload are kept as an AnimalFingerprint, sections
+    whose hash did not change are not written again. The dams and sires of every written
+    parentage are kept in the pedigree closure, see pedigree.PedigreeStore.
+    """
+
+    def __init__(self, farm_id, batch_size=None, fingerprints=None, shared=None):
+        """
+        :param farm_id: The ID of the farm the animals belong to.
+        :param batch_size: Rows per bulk insert or update, defaults to AGRIWEBB_INGEST_BULK_SIZE.
+        :param fingerprints: Skip the unchanged sections of known animals, defaults to AGRIWEBB_INGEST_FINGERPRINTS.
+        :param shared: The shared rows stored up front by resolve_shared (optional), they are
+                       read instead of written and the pedigree is left alone.
+        """
+        super().__init__(batch_size=batch_size)
+        self.farm_id = farm_id
+        if fingerprints is None:
+            fingerprints = getattr(settings, 'AGRIWEBB_INGEST_FINGERPRINTS', True)
+        self.fingerprints = fingerprints
+        self.pedigree = PedigreeStore(batch_size=self.batch_size)
+        self.record_pedigree = shared is None
+        self.shared = {
+            label: {key: pk for key, pk in pairs}
+            for label, pairs in (shared or {}).items()
+        }
+        self.stats = IngestStats()
+
+    def ingest(self, animals):
+        """
+        Stores a page of animal payloads.
+
+        With fingerprints every section of an animal whose payload hash did not change
+        since the last ingest is left alone, and animals without any change are not
+        written at all.
+
+        :param animals: A list of animal payloads.
+        :return: The stored Animal of every payload, in the order of the payloads.
+        """
+        animals = list(animals)
+        if not animals:
+            return []
+
+        with count_queries() as counter, transaction.atomic():
+            keys, hashes, known, changes = self.changed_sections(animals)
+
+            written = [index for index, changed in enumerate(changes) if changed]
+            stored = dict(zip(
+                written,
+                self.store([animals[index] for index in written], [changes[index] for index in written])
+            ))
+
+            if self.fingerprints:
+                self.store_fingerprints(
+                    [(stored[index], hashes[index], known.get(keys[index])) for index in written]
+                )
+
+        self.stats.pages += 1
+        self.stats.animals += len(animals)
+        self.stats.written += len(written)
+        self.stats.skipped += len(animals) - len(written)
+        self.stats.sections_skipped += sum(len(SECTIONS) - len(changed) for changed in changes)
+        self.stats.queries += counter['queries']
+
+        return [
+            stored[index] if index in stored else known[key].animal
+            for index, key in enumerate(keys)
+        ]
+
+    def changed_sections(self, animals):
+        """
+        Compares the section hashes of the given payloads with their stored fingerprints.
+
+        :return: A tuple of the animal keys, the section hashes, the stored fingerprints by
+                 animal key and the set of changed sections of every payload.
+        """
+        keys = [self.animal_key(Animal, animal) for animal in animals]
+        hashes = [fingerprint(animal, self.farm_id) for animal in animals]
+        known = self.known_fingerprints(keys)
+        occurrences = Counter(keys)
+
+        changes = []
+        for key, animal_hashes in zip(keys, hashes):
+            stored_fingerprint = known.get(key)
+            # repeated payloads are written in full so the last one wins, as it would one by one
+            if stored_fingerprint is None or occurrences[key] > 1:
+                changes.append(set(SECTIONS))
+            else:
+                changes.append(stored_fingerprint.changed(animal_hashes))
+
+        return keys, hashes, known, changes
+
+    def known_fingerprints(self, keys):
+        """
+        Loads the stored fingerprints, with their animals, of the given animal IDs.
+        """
+        if not self.fingerprints:
+            return {}
+
+        known = {}
+        queryset = AnimalFingerprint.objects.filter(
+            animal__animal_id__in=[key for key in keys if key is not None]
+        ).select_related('animal')
+        for stored_fingerprint in queryset:
+            known[stored_fingerprint.animal.animal_id] = stored_fingerprint
+        return known
+
+    def store_fingerprints(self, rows):
+        """
+        Saves the section hashes of the written animals.
+
+        :param rows: A list of (animal, hashes, stored fingerprint or None) tuples.
+        """
+        created = {}
+        updated = {}
+
+        for animal, hashes, stored_fingerprint in rows:
+            values = {f"{section}_hash": value for section, value in hashes.items()}
+            if stored_fingerprint is None:
+                created[animal.pk] = AnimalFingerprint(animal=animal, **values)
+            else:
+                for name, value in values.items():
+                    setattr(stored_fingerprint, name, value)
+                updated[animal.pk] = stored_fingerprint
+
+        if created:
+            # animals stored before fingerprints existed may get a fingerprint from another worker
+            AnimalFingerprint.objects.bulk_create(
+                list(created.values()),
+                batch_size=self.batch_size,
+                ignore_conflicts=True
+            )
+        if updated:
+            AnimalFingerprint.objects.bulk_update(
+                list(updated.values()),
+                [f"{section}_hash" for section in SECTIONS],
+                batch_size=self.batch_size
+            )
+
+    def ingest_iter(self, animals, chunk_size=None):
+        """
+        Stores an iterable of animal payloads, e.g. a page iterator, a chunk at a time.
+
+        :param animals: An iterable of animal payloads.
+        :param chunk_size: Payloads stored together, defaults to AGRIWEBB_INGEST_CHUNK_SIZE.
+        :return: A generator of the stored Animals of every chunk.
+        """
+        chunk_size = chunk_size or getattr(settings, 'AGRIWEBB_INGEST_CHUNK_SIZE', 500)
+        for chunk in chunked(animals, chunk_size):
+            yield self.ingest(chunk)
+
+    def ingest_all(self, animals, chunk_size=None):
+        """
+        Stores an iterable of animal payloads a chunk at a time.
+
+        :return: The IngestStats of the engine.
+        """
+        for _ in self.ingest_iter(animals, chunk_size):
+            pass
+        return self.stats
+
+    def animal_key(self, model, animal):
+        return self.key(model, 'animal_id', animal.get('animalId', ''))
+
+    def store(self, animals, changes):
+        """
+        Writes the changed sections of the given payloads.
+
+        :param animals: A list of animal payloads.
+        :param changes: The set of changed sections of every payload.
+        :return: The stored Animal of every payload, in the order of the payloads.
+        """
+        def changed(section):
+            return [animal for animal, sections in zip(animals, changes) if section in sections]
+
+        # identities and their tags
+        identity_rows = {
+            self.animal_key(AnimalIdentity, animal): identity_defaults(animal.get('identity', {}))
+            for animal in changed(IDENTITY)
+        }
+        tag_rows, tag_links = self.tag_rows(changed(IDENTITY))
+
+        identities = self.upsert(AnimalIdentity, 'animal_id', identity_rows)
+        tags = self.upsert(AnimalTag, 'agri_id', tag_rows)
+
+        tag_writer = LinkSetWriter(AnimalIdentity.tags, self.batch_size)
+        for identity_key in identity_rows:
+            tag_writer.set(identities[identity_key], [])
+        tag_writer.add_pairs((identities[i], tags[t]) for i, t in tag_links).write()
+
+        # characteristics and the shared birth date confidences
+        characteristics_animals = changed(CHARACTERISTICS)
+        confidences = self.birth_date_confidences(characteristics_animals)
+
+        characteristics_rows = {}
+        for animal, confidence in zip(characteristics_animals, confidences):
+            characteristics_rows[self.animal_key(AnimalCharacteristics, animal)] = {
+                **characteristics_defaults(animal.get('characteristics', {})),
+                'birth_date_confidence': confidence,
+            }
+
+        characteristics = self.upsert(AnimalCharacteristics, 'animal_id', characteristics_rows)
+
+        parentages = iter(self.parentages(changed(PARENTAGE)))
+        if self.record_pedigree:
+            self.pedigree.record({
+                self.animal_key(Animal, animal): parent_edges(animal)
+                for animal in changed(PARENTAGE)
+            })
+
+        # weights, scores and states, the unit values are shared rows
+        state_animals = changed(STATE)
+        state_data = [animal.get('state', {}) for animal in state_animals]
+        summaries, scores, units = self.state_values(state_data)
+
+        state_rows = {}
+        for index, (animal, animal_state) in enumerate(zip(state_animals, state_data)):
+            state_rows[self.animal_key(AnimalState, animal)] = {
+                **state_defaults(animal_state),
+                'weights': summaries[index],
+                'body_condition_score': scores[index],
+                'animal_units': units[index],
+            }
+
+        states = self.upsert(AnimalState, 'animal_id', state_rows)
+
+        # enterprises and management groups
+        enterprises = self.upsert(Enterprise, 'enterprise_id', self.enterprise_rows(changed(ANIMAL)))
+        groups = self.upsert(
+            ManagementGroup,
+            'management_group_id',
+            self.group_rows(changed(ANIMAL), enterprises),
+            update=False
+        )
+
+        # the animals, the rows of unchanged sections keep their current relations
+        animal_rows = {}
+        for animal, sections in zip(animals, changes):
+            defaults = {}
+
+            if ANIMAL in sections:
+                defaults.update(animal_defaults(animal, self.farm_id))
+                defaults['management_group'] = groups[self.group_key(animal)]
+                defaults['enterprise'] = enterprises[self.enterprise_key(animal)]
+            if IDENTITY in sections:
+                defaults['identity'] = identities[self.animal_key(AnimalIdentity, animal)]
+            if CHARACTERISTICS in sections:
+                defaults['characteristics'] = characteristics[self.animal_key(AnimalCharacteristics, animal)]
+            if PARENTAGE in sections:
+                defaults['parentage'] = next(parentages)
+            if STATE in sections:
+                defaults['state'] = states[self.animal_key(AnimalState, animal)]
+
+            animal_rows.setdefault(self.animal_key(Animal, animal), {}).update(defaults)
+
+        stored = self.upsert(Animal, 'animal_id', animal_rows)
+
+        # records
+        record_rows, record_links = self.record_rows(changed(RECORDS))
+        records = self.upsert(AnimalRecord, 'record_id', record_rows, update=False)
+
+        # payloads without records were fetched without them and keep their current ones
+        record_writer = LinkSetWriter(Animal.records, self.batch_size)
+        for animal in changed(RECORDS):
+            if 'records' in animal:
+                record_writer.set(stored[self.animal_key(Animal, animal)], [])
+        record_writer.add_pairs((stored[a], records[r]) for a, r in record_links).write()
+
+        return [stored[self.animal_key(Animal, animal)] for animal in animals]
+
+    def resolve_shared(self, animals):
+        """
+        Stores the rows animals share with each other, i.e. tags, enterprises, management
+        groups, parents, records, unit values and the pedigree, for a whole herd at once.
+
+        Ingests of parts of the herd given the result as `shared` read these rows instead
+        of writing them, so concurrent ingests of disjoint animals never wait on each other.
+
+        :return: Dict of model label to a list of (natural key, primary key) pairs, plain
+                 data that can be passed to other processes.
+        """
+        animals = list(animals)
+
+        with transaction.atomic():
+            tag_rows, _ = self.tag_rows(animals)
+            record_rows, _ = self.record_rows(animals)
+            enterprises = self.upsert(Enterprise, 'enterprise_id', self.enterprise_rows(animals))
+
+            resolved = {
+                AnimalTag: self.upsert(AnimalTag, 'agri_id', tag_rows),
+                Enterprise: enterprises,
+                ManagementGroup: self.upsert(
+                    ManagementGroup,
+                    'management_group_id',
+                    self.group_rows(animals, enterprises),
+                    update=False
+                ),
+                AnimalRecord: self.upsert(AnimalRecord, 'record_id', record_rows, update=False),
+            }
+            resolved.update(self.store_parents(animals)[0])
+
+            self.birth_date_confidences(animals)
+            self.state_values([animal.get('state', {}) for animal in animals])
+            self.pedigree.record({self.animal_key(Animal, animal): parent_edges(animal) for animal in animals})
+
+        return {
+            model._meta.label: [[key, obj.pk] for key, obj in instances.items()]
+            for model, instances in resolved.items()
+        }
+
+    def enterprise_key(self, animal):
+        return self.key(Enterprise, 'enterprise_id', (animal.get('enterprise') or {}).get('enterpriseId'))
+
+    def group_key(self, animal):
+        return self.key(
+            ManagementGroup,
+            'management_group_id',
+            animal['managementGroup'].get('managementGroupId', '')
+        )
+
+    def enterprise_rows(self, animals):
+        return {
+            self.enterprise_key(animal): enterprise_defaults(animal.get('enterprise') or {}, self.farm_id)
+            for animal in animals
+        }
+
+    def group_rows(self, animals, enterprises):
+        rows = {}
+        for animal in animals:
+            rows.setdefault(self.group_key(animal), {
+                **management_group_defaults(animal['managementGroup']),
+                'enterprise': enterprises[self.enterprise_key(animal)],
+            })
+        return rows
+
+    def tag_rows(self, animals):
+        """
+        :return: A tuple of the AnimalTag rows and the (identity key, tag key) links.
+        """
+        rows = {}
+        links = []
+        for animal in animals:
+            for tag in animal.get('identity', {}).get('tags', []):
+                tag_key = self.key(AnimalTag, 'agri_id', tag.get('id'))
+                rows[tag_key] = tag_defaults(tag)
+                links.append((self.animal_key(AnimalIdentity, animal), tag_key))
+        return rows, links
+
+    def record_rows(self, animals):
+        """
+        :return: A tuple of the AnimalRecord rows and the (animal key, record key) links.
+        """
+        rows = {}
+        links = []
+        for animal in animals:
+            for record in animal.get('records') or []:
+                record_key = self.key(AnimalRecord, 'record_id', record['recordId'])
+                rows.setdefault(record_key, record_defaults(record))
+                links.append((self.animal_key(Animal, animal), record_key))
+        return rows, links
+
+    def birth_date_confidences(self, animals):
+        """
+        Interns the birth date confidences of the given payloads, in the order of the payloads.
+        """
+        return interning.date_confidences.intern_many(
+            (
+                date_confidence_lookup(animal.get('characteristics', {}).get('birthDateConfidence', {}))
+                for animal in animals
+            ),
+            batch_size=self.batch_size
+        )
+
+    def state_values(self, state_data):
+        """
+        Interns the weight summaries, condition scores and animal units of the given states.
+
+        :return: A tuple of the lists of summaries, scores and units, in the order of the states.
+        """
+        weights_data = [animal_state.get('weights', {}) for animal_state in state_data]
+
+        gains = {
+            key: interning.weight_gains.intern_many(
+                (unit_value(data.get(key), mapping.WEIGHT_GAIN) for data in weights_data),
+                batch_size=self.batch_size
+            )
+            for key in WEIGHT_GAIN_KEYS
+        }
+        values = {
+            key: interning.weights.intern_many(
+                (unit_value(data.get(key), mapping.WEIGHT) for data in weights_data),
+                batch_size=self.batch_size
+            )
+            for key in WEIGHT_KEYS
+        }
+        scores = interning.condition_scores.intern_many(
+            (unit_value(animal_state.get('bodyConditionScore'), mapping.CONDITION_SCORE) for animal_state in state_data),
+            batch_size=self.batch_size
+        )
+        units = interning.animal_units.intern_many(
+            (unit_value(animal_state.get('animalUnits'), mapping.ANIMAL_UNIT) for animal_state in state_data),
+            batch_size=self.batch_size
+        )
+
+        summaries = interning.weight_summaries.intern_many(
+            (
+                weight_summary_lookup(
+                    {key: gains[key][index] for key in WEIGHT_GAIN_KEYS},
+                    {key: values[key][index] for key in WEIGHT_KEYS},
+                    data
+                )
+                for index, data in enumerate(weights_data)
+            ),
+            batch_size=self.batch_size
+        )
+
+        return summaries, scores, units
+
+    def parent_rows(self, animals):
+        """
+        :return: A tuple of the ParentAnimalIdentity, GeneticParent and Surrogate rows and
+                 the (dam keys, sire keys, surrogate key, has surrogate) roles of every payload.
+        """
+        identity_rows = {}
+        genetic_rows = {}
+        surrogate_rows = {}
+        roles = []
+
+        for animal in animals:
+            animal_parentage = animal.get('parentage', {})
+            dams = animal_parentage.get('dams', [])
+            sires = animal_parentage.get('sires', [])
+            surrogate = animal_parentage.get('surrogate', {})
+
+            for parent, default_type, rows in (
+                    *((dam, AnimalParent.AnimalParentType.DAM, genetic_rows) for dam in dams),
+                    *((sire, AnimalParent.AnimalParentType.SIRE, genetic_rows) for sire in sires),
+                    *([(surrogate, AnimalParent.AnimalParentType.UNKNOWN, surrogate_rows)] if surrogate else []),
+            ):
+                parent_key = self.key(ParentAnimalIdentity, 'parent_animal_id', parent.get('parentAnimalId'))
+                identity_rows[parent_key] = parent_identity_defaults(parent)
+                rows[parent_key] = {'parent_type': parent.get('parentType', default_type)}
+
+            roles.append((
+                [self.key(GeneticParent, 'parent_animal_id', dam.get('parentAnimalId')) for dam in dams],
+                [self.key(GeneticParent, 'parent_animal_id', sire.get('parentAnimalId')) for sire in sires],
+                self.key(Surrogate, 'parent_animal_id', surrogate.get('parentAnimalId')) if surrogate else None,
+                bool(surrogate),
+            ))
+
+        return identity_rows, genetic_rows, surrogate_rows, roles
+
+    def store_parents(self, animals):
+        """
+        Stores the parents of every payload.
+
+        :return: A tuple of the stored parents, as a dict of model to a dict of natural key
+                 to instance, and the roles of every payload, see parent_rows.
+        """
+        identity_rows, genetic_rows, surrogate_rows, roles = self.parent_rows(animals)
+
+        identities = self.upsert(ParentAnimalIdentity, 'parent_animal_id', identity_rows)
+        for rows in (genetic_rows, surrogate_rows):
+            for parent_key, defaults in rows.items():
+                defaults['parent_animal_identity'] = identities[parent_key]
+
+        parents = {
+            ParentAnimalIdentity: identities,
+            GeneticParent: self.upsert(GeneticParent, 'parent_animal_id', genetic_rows),
+            Surrogate: self.upsert(Surrogate, 'parent_animal_id', surrogate_rows),
+        }
+        return parents, roles
+
+    def parentages(self, animals):
+        """
+        Stores the parents of every payload and creates a new Parentage for each payload,
+        like helpers.populate_animal does.
+
+        :return: The Parentage of every payload, in the order of the payloads.
+        """
+        parents, roles = self.store_parents(animals)
+        genetic_parents = parents[GeneticParent]
+        surrogates = parents[Surrogate]
+
+        parentages = self.create(Parentage, [
+            Parentage(surrogate=surrogates[surrogate_key] if has_surrogate else None)
+            for _, _, surrogate_key, has_surrogate in roles
+        ])
+
+        dams = LinkSetWriter(Parentage.dams, self.batch_size)
+        sires = LinkSetWriter(Parentage.sires, self.batch_size)
+        for parentage, (dam_keys, sire_keys, _, _) in zip(parentages, roles):
+            dams.add(parentage, *(genetic_parents[key] for key in dam_keys))
+            sires.add(parentage, *(genetic_parents[key] for key in sire_keys))
+
+        dams.write()
+        sires.write()
+
+        return parentages
+
+
+def populate_animals(animals, farm_id, batch_size=None):
+    """
+    Stores a page of animal payloads with set-based queries, see AnimalIngest.
+
+    :return: The stored Animal of every payload, in the order of the payloads.
+    """
+    return AnimalIngest(farm_id, batch_size=batch_size).ingest(animals)
@@ -0,0 +1,343 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.cache import cache as shared_cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, Min, Q
+
+from .models import WeightGain, Weight, ConditionScore, AnimalUnit, DateConfidence, AnimalWeightSummary, GeoPoint, \
+    Address, GeoFeature, CapacityAlert, Capacity, ExternalIdentifier
+
+
+class ValueInterner:
+    """
+    Maps equal value objects, e.g. the (unit, value) of a Weight, to one shared row.
+
+    The primary keys of recently used values are kept in a bounded LRU in front of the
+    database, values missing from it are looked up with one select and the ones not
+    stored yet are inserted with one bulk insert. The unique constraint on the value fields
+    of the value models keeps concurrent workers from storing the same value twice.
+
+    Compaction deletes the values no row references any more, it moves the shared
+    generation of the interner so every worker drops the primary keys it cached.
+    """
+
+    def __init__(self, model, fields, maxsize=None):
+        """
+        :param model: The value model, its rows are never updated once stored.
+        :param fields: Names of the fields that make up the value.
+        :param maxsize: Values kept in memory, defaults to AGRIWEBB_INTERN_CACHE_SIZE.
+        """
+        self.model = model
+        self.fields = tuple(fields)
+        self._maxsize = maxsize
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.cache)
+
+    @property
+    def maxsize(self):
+        if self._maxsize is not None:
+            return self._maxsize
+        return getattr(settings, 'AGRIWEBB_INTERN_CACHE_SIZE', 10000)
+
+    def key(self, values):
+        """
+        Converts a dict of field values to the Python types of the model fields, so
+        payload values and stored values compare equal.
+        """
+        key = []
+        for name in self.fields:
+            field = self.model._meta.get_field(name)
+            key.append(field.get_prep_value(field.to_python(values[name])))
+        return tuple(key)
+
+    def instance(self, key, pk):
+        return self.model(pk=pk, **dict(zip(self.fields, key)))
+
+    def new(self, key, values):
+        """
+        Builds the unsaved row of a value that is not stored yet.
+        """
+        return self.model(**dict(zip(self.fields, key)))
+
+    @property
+    def generation_key(self):
+        return f"interning:{self.model._meta.label_lower}:generation"
+
+    def cached(self, keys):
+        generation = shared_cache.get(self.generation_key, 0)
+        if generation != self.generation:
+            self.clear()
+            self.generation = generation
+
+        found = {}
+        with self.lock:
+            for key in keys:
+                pk = self.cache.get(key)
+                if pk is not None:
+                    self.cache.move_to_end(key)
+                    found[key] = pk
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def remember(self, pks):
+        with self.lock:
+            for key, pk in pks.items():
+                self.cache[key] = pk
+                self.cache.move_to_end(key)
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def forget(self):
+        """
+        Drops the cached primary keys of every worker, after stored values were deleted.
+        """
+        # the generation must outlive the cached primary keys
+        if not shared_cache.add(self.generation_key, 1, timeout=None):
+            shared_cache.incr(self.generation_key)
+        self.clear()
+
+    def lookup(self, keys):
+        condition = Q()
+        for key in keys:
+            condition |= Q(**dict(zip(self.fields, key)))
+
+        pks = {}
+        for row in self.model.objects.filter(condition).order_by('pk').values_list('pk', *self.fields):
+            pks.setdefault(self.key(dict(zip(self.fields, row[1:]))), row[0])
+        return pks
+
+    def intern_many(self, values, batch_size=None):
+        """
+        Gets or creates the rows of the given values.
+
+        :param values: An iterable of dicts of field values.
+        :param batch_size: Rows per bulk insert.
+        :return: An instance with the shared primary key of every value, in the order
+                 of the values.
+        """
+        keys = []
+        rows = {}
+        for value in values:
+            key = self.key(value)
+            keys.append(key)
+            rows.setdefault(key, value)
+        if not keys:
+            return []
+
+        unique = list(dict.fromkeys(keys))
+        pks = self.cached(unique)
+
+        missing = [key for key in unique if key not in pks]
+        if missing:
+            stored = self.lookup(missing)
+
+            created = [key for key in missing if key not in stored]
+            if created:
+                # another worker may store the same values meanwhile, the select below sees them
+                self.model.objects.bulk_create(
+                    [self.new(key, rows[key]) for key in created],
+                    batch_size=batch_size,
+                    ignore_conflicts=True
+                )
+                stored.update(self.lookup(created))
+
+            pks.update(stored)
+            # rows inserted in a transaction that rolls back must not stay in the cache
+            transaction.on_commit(lambda: self.remember(stored), using=DEFAULT_DB_ALIAS)
+
+        return [self.instance(key, pks[key]) for key in keys]
+
+    def intern(self, **values):
+        """
+        Gets or creates the row of one value.
+        """
+        return self.intern_many([values])[0]
+
+    def deduplicate(self):
+        """
+        Merges the rows that hold the same value into the oldest one, repointing the
+        foreign keys to the removed rows. Needed once before the unique constraint on
+        the value fields can be added to a database filled by earlier versions.
+
+        :return: The number of removed rows.
+        """
+        removed = 0
+        groups = (
+            self.model.objects
+            .values(*self.fields)
+            .annotate(keep=Min('pk'), rows=Count('pk'))
+            .filter(rows__gt=1)
+            .order_by()
+        )
+
+        for group in list(groups):
+            with transaction.atomic():
+                duplicates = self.model.objects.filter(
+                    **{name: group[name] for name in self.fields}
+                ).exclude(pk=group['keep'])
+
+                removed += self.merge(group['keep'], list(duplicates.values_list('pk', flat=True)))
+
+        self.clear()
+        return removed
+
+    def merge(self, keep, duplicates):
+        """
+        Repoints the foreign keys and many-to-many links to the duplicate rows of a value
+        to the kept row and deletes the duplicates.
+
+        :return: The number of removed rows.
+        """
+        removed = 0
+        for duplicate in duplicates:
+            for relation in self.model._meta.related_objects:
+                if relation.many_to_many:
+                    through = relation.through
+                    source = relation.field.m2m_field_name()
+                    target = relation.field.m2m_reverse_field_name()
+                    # rows linked to both keep their link to the kept row
+                    through.objects.filter(
+                        **{target: duplicate, f"{source}__in": through.objects.filter(**{target: keep}).values(source)}
+                    ).delete()
+                    through.objects.filter(**{target: duplicate}).update(**{f"{target}_id": keep})
+                else:
+                    relation.related_model.objects.filter(
+                        **{relation.field.name: duplicate}
+                    ).update(**{relation.field.attname: keep})
+
+            removed += self.model.objects.filter(pk=duplicate).delete()[1].get(self.model._meta.label, 0)
+        return removed
+
+
+class HashedValueInterner(ValueInterner):
+    """
+    Maps equal value objects to one shared row by a hash of their content.
+
+    For values whose fields cannot be looked up through an index, e.g. float coordinates,
+    geometries and arrays, the row stores a hash of its value fields in a unique
+    `content_hash` column and is looked up by it.
+    """
+
+    def __init__(self, model, fields, maxsize=None):
+        """
+        :param model: The value model, with a unique `content_hash` field.
+        :param fields: Names of the fields that make up the value.
+        :param maxsize: Values kept in memory, defaults to AGRIWEBB_INTERN_CACHE_SIZE.
+        """
+        super().__init__(model, ('content_hash',), maxsize=maxsize)
+        self.value_fields = tuple(fields)
+
+    def prepared(self, values):
+        prepared = {}
+        for name in self.value_fields:
+            field = self.model._meta.get_field(name)
+            value = values.get(name)
+            prepared[name] = None if value is None else field.to_python(value)
+        return prepared
+
+    def content_hash(self, values):
+        canonical = []
+        for value in self.prepared(values).values():
+            if isinstance(value, GEOSGeometry):
+                value = value.hexewkb.decode('ascii')
+            canonical.append(value)
+        serialized = json.dumps(canonical, separators=(',', ':'), default=str)
+        return hashlib.blake2b(serialized.encode('utf-8'), digest_size=16).hexdigest()
+
+    def key(self, values):
+        if 'content_hash' in values:
+            return (values['content_hash'],)
+        return (self.content_hash(values),)
+
+    def lookup(self, keys):
+        rows = self.model.objects.filter(content_hash__in=[key[0] for key in keys]).values_list('content_hash', 'pk')
+        return {(content_hash,): pk for content_hash, pk in rows}
+
+    def new(self, key, values):
+        return self.model(content_hash=key[0], **self.prepared(values))
+
+    def deduplicate(self, batch_size=1000):
+        """
+        Hashes the rows stored before the content hash existed, merging the ones that
+        hold the same value into the oldest one.
+
+        :return: The number of removed rows.
+        """
+        removed = 0
+        rows = self.model.objects.filter(content_hash__isnull=True).order_by('pk')
+
+        while True:
+            chunk = list(rows[:batch_size])
+            if not chunk:
+                break
+
+            hashes = {
+                obj.pk: self.content_hash({name: getattr(obj, name) for name in self.value_fields})
+                for obj in chunk
+            }
+            stored = dict(
+                self.model.objects
+                .filter(content_hash__in=set(hashes.values()))
+                .values_list('content_hash', 'pk')
+            )
+
+            with transaction.atomic():
+                hashed = []
+                for obj in chunk:
+                    keep = stored.get(hashes[obj.pk])
+                    if keep is None:
+                        obj.content_hash = hashes[obj.pk]
+                        stored[obj.content_hash] = obj.pk
+                        hashed.append(obj)
+                    else:
+                        removed += self.merge(keep, [obj.pk])
+                self.model.objects.bulk_update(hashed, ['content_hash'], batch_size=batch_size)
+
+        self.clear()
+        return removed
+
+
+weight_gains = ValueInterner(WeightGain, ('unit', 'value'))
+weights = ValueInterner(Weight, ('unit', 'value'))
+condition_scores = ValueInterner(ConditionScore, ('unit', 'value'))
+animal_units = ValueInterner(AnimalUnit, ('unit', 'value'))
+date_confidences = ValueInterner(DateConfidence, ('year', 'month', 'day'))
+# summaries of equal interned weights are equal values too
+weight_summaries = ValueInterner(AnimalWeightSummary, (
+    'live_average_daily_gain_id',
+    'overall_average_daily_gain_id',
+    'assumed_average_daily_gain_id',
+    'live_weight_date',
+    'live_weight_id',
+    'estimated_weight_id',
+))
+
+# in dependency order, summaries point to the weights and weight gains
+INTERNERS = (weight_gains, weights, condition_scores, animal_units, date_confidences, weight_summaries)
+
+# the value objects of farms, map features and fields
+geo_points = HashedValueInterner(GeoPoint, ('lat', 'long'))
+addresses = HashedValueInterner(Address, ('address1', 'address2', 'country', 'postcode', 'town', 'state', 'location_id'))
+geo_features = HashedValueInterner(GeoFeature, ('type', 'coordinates'))
+capacity_alerts = HashedValueInterner(CapacityAlert, ('critical', 'warning'))
+capacities = HashedValueInterner(Capacity, ('mode', 'value', 'unit'))
+external_identifiers = HashedValueInterner(ExternalIdentifier, ('type', 'value'))
+
+# in dependency order, addresses point to the points
+FARM_INTERNERS = (geo_points, addresses, geo_features, capacity_alerts, capacities, external_identifiers)
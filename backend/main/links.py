@@ -0,0 +1,109 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+
+class LinkSetWriter:
+    """
+    Writes the links of a many-to-many relation for a batch of rows at once.
+
+    The desired (left, right) pairs are collected first, then compared with the rows of
+    the through table in one query, and the missing links are inserted and the unwanted
+    ones deleted with one query each, instead of one `add` per link.
+
+    Links are collected two ways: `set` gives the complete links of a left row, its other
+    links are deleted, `add` only adds a link and leaves the other links of its left row
+    alone, like the `add` of a related manager.
+    """
+
+    def __init__(self, relation, batch_size=None):
+        """
+        :param relation: The many-to-many descriptor, e.g. Animal.records.
+        :param batch_size: Rows per bulk insert, defaults to AGRIWEBB_INGEST_BULK_SIZE.
+        """
+        self.through = relation.through
+        self.source_field = f"{relation.field.m2m_field_name()}_id"
+        self.target_field = f"{relation.field.m2m_reverse_field_name()}_id"
+        self.batch_size = batch_size or getattr(settings, 'AGRIWEBB_INGEST_BULK_SIZE', 1000)
+        self.desired = defaultdict(set)
+        self.replaced = set()
+
+    def __len__(self):
+        return sum(len(rights) for rights in self.desired.values())
+
+    @staticmethod
+    def pk(value):
+        return getattr(value, 'pk', value)
+
+    def add(self, left, *rights):
+        """
+        Adds links from a left row to right rows, given as instances or primary keys.
+        """
+        self.desired[self.pk(left)].update(self.pk(right) for right in rights)
+        return self
+
+    def add_pairs(self, pairs):
+        for left, right in pairs:
+            self.add(left, right)
+        return self
+
+    def set(self, left, rights):
+        """
+        Sets the complete links of a left row, an empty `rights` removes all of them.
+        """
+        left = self.pk(left)
+        self.replaced.add(left)
+        self.desired[left].update(self.pk(right) for right in rights)
+        return self
+
+    def write(self):
+        """
+        Applies the collected links and clears them.
+
+        :return: A tuple of the number of inserted and deleted links.
+        """
+        desired = {left: rights for left, rights in self.desired.items() if left is not None}
+        replaced = self.replaced & set(desired)
+        self.desired = defaultdict(set)
+        self.replaced = set()
+
+        if not desired:
+            return 0, 0
+
+        # only the links of replaced rows are read in full, added links are looked up by target
+        added = [left for left in desired if left not in replaced]
+        condition = Q(**{f"{self.source_field}__in": list(replaced)})
+        if added:
+            condition |= Q(**{
+                f"{self.source_field}__in": added,
+                f"{self.target_field}__in": list({right for left in added for right in desired[left]}),
+            })
+
+        existing = defaultdict(dict)
+        rows = self.through.objects.filter(condition).values_list('pk', self.source_field, self.target_field)
+        for pk, left, right in rows:
+            existing[left][right] = pk
+
+        created = [
+            self.through(**{self.source_field: left, self.target_field: right})
+            for left, rights in desired.items()
+            for right in rights
+            if right is not None and right not in existing[left]
+        ]
+        removed = [
+            pk
+            for left in replaced
+            for right, pk in existing[left].items()
+            if right not in desired[left]
+        ]
+
+        with transaction.atomic():
+            if removed:
+                self.through.objects.filter(pk__in=removed).delete()
+            if created:
+                # a concurrent writer may have added the same link meanwhile
+                self.through.objects.bulk_create(created, batch_size=self.batch_size, ignore_conflicts=True)
+
+        return len(created), len(removed)
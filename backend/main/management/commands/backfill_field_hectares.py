@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from main.units import backfill_hectares
+
+
+class Command(BaseCommand):
+    help = "Fills the hectare area columns of the fields stored before they existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Fields updated per query.")
+
+    def handle(self, *args, **options):
+        updated = backfill_hectares(batch_size=options['batch_size'])
+        self.stdout.write(f"{updated} fields backfilled")
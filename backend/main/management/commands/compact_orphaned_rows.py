@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from main.compaction import compact_orphans
+
+
+class Command(BaseCommand):
+    help = "Deletes the per-animal rows, weight summaries and weights no row references any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows deleted per batch.")
+        parser.add_argument('--time-limit', type=int, default=None, help="Seconds after which the run stops.")
+
+    def handle(self, *args, **options):
+        report = compact_orphans(batch_size=options['batch_size'], time_limit=options['time_limit'])
+
+        for label, count in report['reclaimed'].items():
+            size = report['table_sizes'][label]
+            self.stdout.write(f"{label}: {count} rows reclaimed, {size['rows']} rows and {size['bytes']} bytes left")
+        if not report['finished']:
+            self.stdout.write("The time limit was reached before every table was compacted.")
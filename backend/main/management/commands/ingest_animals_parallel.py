@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from main.agriwebb import AgriWebb
+from main.parallel import parallel_ingest
+
+
+class Command(BaseCommand):
+    help = "Fetches every animal of a farm and stores them from a process per hash partition of the herd."
+
+    def add_arguments(self, parser):
+        parser.add_argument('token_id', type=int, help="ID of the AgriWebb token to use.")
+        parser.add_argument('farm_id', help="Farm ID to sync.")
+        parser.add_argument('--partitions', type=int, default=None, help="Number of partitions and processes.")
+        parser.add_argument('--page-size', type=int, default=None, help="Number of animals per page.")
+
+    def handle(self, *args, **options):
+        animals = AgriWebb().iter_animals(
+            options['token_id'],
+            options['farm_id'],
+            page_size=options['page_size'],
+        )
+        stats = parallel_ingest(animals, options['farm_id'], partitions=options['partitions'])
+        self.stdout.write(f"Stored the animals of farm {options['farm_id']}: {stats}")
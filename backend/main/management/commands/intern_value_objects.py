@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from main.interning import FARM_INTERNERS, INTERNERS
+
+
+class Command(BaseCommand):
+    help = (
+        "Merges the weights, weight gains, condition scores, animal units, date confidences and "
+        "weight summaries that hold the same value, run it before adding their unique constraints. "
+        "Hashes the points, addresses, geometries, alerts, capacities and identifiers stored before "
+        "their content hash existed, merging the ones that hold the same value."
+    )
+
+    def handle(self, *args, **options):
+        for interner in INTERNERS + FARM_INTERNERS:
+            removed = interner.deduplicate()
+            self.stdout.write(f"{interner.model._meta.verbose_name_plural}: {removed} duplicate rows removed")
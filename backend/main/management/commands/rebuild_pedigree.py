@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.pedigree import PedigreeStore
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the pedigree edges and closure from the parentages of the stored animals."
+
+    def handle(self, *args, **options):
+        edges, rows = PedigreeStore().rebuild()
+        self.stdout.write(f"{edges} pedigree edges, {rows} closure rows")
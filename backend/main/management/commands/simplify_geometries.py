@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from main.geometry import simplify_features, zoom_levels
+
+
+class Command(BaseCommand):
+    help = "Simplifies the field and map feature geometries that miss a zoom level or whose field was modified."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Geometries simplified per transaction.")
+
+    def handle(self, *args, **options):
+        simplified = simplify_features(batch_size=options['batch_size'])
+        self.stdout.write(f"{simplified} geometries simplified for zoom levels {zoom_levels()}")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from main.tasks import fetch_and_store_organization_animals_data
+
+
+class Command(BaseCommand):
+    help = "Fetches and stores the animals of every farm of an organization, farms and pages are fetched concurrently."
+
+    def add_arguments(self, parser):
+        parser.add_argument('token_id', type=int, help="ID of the AgriWebb token to use.")
+        parser.add_argument(
+            '--farm',
+            dest='farm_ids',
+            action='append',
+            help="Farm ID to sync, can be repeated. Defaults to every farm of the organization.",
+        )
+        parser.add_argument('--page-size', type=int, default=None, help="Number of animals per page.")
+        parser.add_argument('--concurrency', type=int, default=None, help="Maximum number of in-flight requests.")
+
+    def handle(self, *args, **options):
+        result = fetch_and_store_organization_animals_data(
+            options['token_id'],
+            farm_ids=options['farm_ids'],
+            page_size=options['page_size'],
+            concurrency=options['concurrency'],
+        )
+        self.stdout.write(result)
@@ -0,0 +1,403 @@
+import json
+import logging
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.contrib.gis.db import models as gis_models
+from django.contrib.gis.gdal import GDALException
+from django.contrib.gis.geos import GEOSException, GEOSGeometry
+from django.contrib.postgres.fields import ArrayField
+from django.db import models
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Animal, AnimalIdentity, AnimalTag, AnimalCharacteristics, DateConfidence, \
+    ParentAnimalIdentity, AnimalState, Enterprise, ManagementGroup, AnimalRecord, WeightGain, Weight, \
+    ConditionScore, AnimalUnit, Farm, Address, GeoPoint, MapFeature, CapacityAlert, Capacity, Field, GeoFeature, \
+    ExternalIdentifier
+
+logger = logging.getLogger(__name__)
+
+EMPTY = (None, '')
+
+
+def from_timestamp(value):
+    """
+    Parses an AgriWebb date, given as epoch milliseconds or as an ISO 8601 string.
+
+    :return: An aware datetime, or None if the value is empty or not a date.
+    """
+    if value in EMPTY:
+        return None
+
+    if isinstance(value, datetime):
+        return value if timezone.is_aware(value) else timezone.make_aware(value, dt_timezone.utc)
+
+    if isinstance(value, str):
+        try:
+            parsed = parse_datetime(value)
+        except ValueError:
+            parsed = None
+        if parsed is not None:
+            return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, dt_timezone.utc)
+        try:
+            value = float(value)
+        except ValueError:
+            return None
+
+    try:
+        return datetime.fromtimestamp(float(value) / 1000, tz=dt_timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+def to_float(value):
+    if value in EMPTY:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_int(value):
+    if value in EMPTY:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        number = to_float(value)
+        return int(number) if number is not None else None
+
+
+def to_bool(value):
+    if value in EMPTY:
+        return None
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in ('true', '1', 'yes'):
+            return True
+        if lowered in ('false', '0', 'no'):
+            return False
+        return None
+    return bool(value)
+
+
+def to_uuid(value):
+    if value in EMPTY:
+        return None
+    try:
+        return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def to_text(value):
+    if value is None:
+        return ''
+    return value if isinstance(value, str) else str(value)
+
+
+def to_list(value):
+    if value in EMPTY:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def to_geometry(value):
+    """
+    Parses a GeoJSON geometry, given as a dict or a string.
+
+    :return: A GEOS geometry, or None if the value is empty or not a geometry.
+    """
+    if value in EMPTY:
+        return None
+    if isinstance(value, GEOSGeometry):
+        return value
+    try:
+        return GEOSGeometry(value if isinstance(value, str) else json.dumps(value))
+    except (GEOSException, GDALException, TypeError, ValueError):
+        return None
+
+
+# the coercion of every model field type, checked in order so subclasses come first
+COERCIONS = (
+    (gis_models.GeometryField, to_geometry),
+    (ArrayField, to_list),
+    (models.DateTimeField, from_timestamp),
+    (models.BooleanField, to_bool),
+    (models.UUIDField, to_uuid),
+    (models.FloatField, to_float),
+    (models.IntegerField, to_int),
+    (models.CharField, to_text),
+    (models.TextField, to_text),
+)
+
+
+def coercion(field):
+    for field_class, coerce in COERCIONS:
+        if isinstance(field, field_class):
+            return coerce
+    return None
+
+
+def validated(field, coerce):
+    """
+    Wraps a coercion with the validation of the choices of the field, a value outside of
+    them becomes the default of the field.
+    """
+    allowed = frozenset(value for value, _ in field.flatchoices)
+    fallback = field.get_default() if field.has_default() else ('' if coerce is to_text else None)
+    label = f"{field.model._meta.label}.{field.name}"
+
+    def coerce_choice(value):
+        if coerce is not None:
+            value = coerce(value)
+        try:
+            if value in EMPTY:
+                return fallback
+            if value in allowed:
+                return value
+        except TypeError:
+            pass
+        logger.debug("Invalid %s choice %r", label, value)
+        return fallback
+
+    return coerce_choice
+
+
+class Mapping:
+    """
+    Maps a camelCase AgriWebb payload to the field values of a model.
+
+    The spec names the payload key of every model field, the type coercion comes from the
+    model field: epoch milliseconds or ISO strings to aware datetimes, empty values to
+    None for numbers, dates and booleans, None to '' for text, and values outside of the
+    choices of a field to its default. The spec is compiled once into one function that
+    reads every key and builds the dict with no per-field dispatch at call time.
+    """
+
+    def __init__(self, model, spec):
+        """
+        :param model: The model the values are for.
+        :param spec: Dict of model field name to payload key.
+        """
+        self.model = model
+        self.spec = dict(spec)
+        self.extract = self.compile()
+
+    def __call__(self, payload, **extra):
+        """
+        :param payload: The payload dict, None counts as empty.
+        :param extra: Values to add to or override in the result.
+        :return: A dict of model field name to value.
+        """
+        values = self.extract(payload or {})
+        if extra:
+            values.update(extra)
+        return values
+
+    def __repr__(self):
+        return f"<Mapping {self.model._meta.label} ({len(self.spec)} fields)>"
+
+    def compile(self):
+        namespace = {}
+        items = []
+
+        for index, (name, key) in enumerate(self.spec.items()):
+            field = self.model._meta.get_field(name)
+            coerce = coercion(field)
+            if field.choices:
+                coerce = validated(field, coerce)
+
+            if coerce is to_text:
+                items.append(f"{name!r}: '' if (value := get({key!r})) is None else value")
+            elif coerce is None:
+                items.append(f"{name!r}: get({key!r})")
+            else:
+                namespace[f"coerce_{index}"] = coerce
+                items.append(f"{name!r}: coerce_{index}(get({key!r}))")
+
+        source = "def extract(payload):\n    get = payload.get\n    return {\n"
+        source += "".join(f"        {item},\n" for item in items)
+        source += "    }\n"
+
+        exec(compile(source, f"<mapping {self.model._meta.label}>", 'exec'), namespace)
+        return namespace['extract']
+
+
+ANIMAL_IDENTITY = Mapping(AnimalIdentity, {
+    'name': 'name',
+    'eid': 'eid',
+    'vid': 'vid',
+    'management_tag': 'managementTag',
+    'brand': 'brand',
+    'tattoo': 'tattoo',
+    'tag_color_catalogue_id': 'tagColorCatalogueId',
+})
+
+ANIMAL_TAG = Mapping(AnimalTag, {
+    'eid': 'eid',
+    'vid': 'vid',
+    'management_tag': 'managementTag',
+    'uhf_eid': 'uhfEid',
+    'dna_id': 'dnaId',
+    'registration_number': 'registrationNumber',
+    'breed_society_id': 'breedSocietyId',
+    'health_id': 'healthId',
+    'tag_id': 'tagId',
+    'tag_color_catalogue_id': 'tagColorCatalogueId',
+    'type': 'type',
+    'state': 'state',
+    'removal_date': 'removalDate',
+    'replacement_date': 'replacementDate',
+})
+
+DATE_CONFIDENCE = Mapping(DateConfidence, {
+    'year': 'year',
+    'month': 'month',
+    'day': 'day',
+})
+
+ANIMAL_CHARACTERISTICS = Mapping(AnimalCharacteristics, {
+    'age_class': 'ageClass',
+    'birth_date': 'birthDate',
+    'birth_date_accuracy': 'birthDateAccuracy',
+    'birth_location_id': 'birthLocationId',
+    'birth_year': 'birthYear',
+    'breed_assessed': 'breedAssessed',
+    'visual_color': 'visualColor',
+    'sex': 'sex',
+    'species_common_name': 'speciesCommonName',
+})
+
+PARENT_ANIMAL_IDENTITY = Mapping(ParentAnimalIdentity, {
+    'eid': 'eid',
+    'vid': 'vid',
+    'name': 'name',
+})
+
+ANIMAL_STATE = Mapping(AnimalState, {
+    'current_location_id': 'currentLocationId',
+    'on_farm': 'onFarm',
+    'on_farm_date': 'onFarmDate',
+    'Last_seen': 'LastSeen',
+    'days_reared': 'daysReared',
+    'off_farm_date': 'offFarmDate',
+    'disposal_method': 'disposalMethod',
+    'fate': 'fate',
+    'fertility_status': 'fertilityStatus',
+    'rearing_rank': 'rearingRank',
+    'reproductive_status': 'reproductiveStatus',
+    'status_date': 'statusDate',
+    'withholding_date_meat': 'withholdingDateMeat',
+    'withholding_date_export': 'withholdingDateExport',
+    'withholding_date_organic': 'withholdingDateOrganic',
+    'weaned': 'weaned',
+    'offspring_count': 'offspringCount',
+    'body_condition_score_date': 'bodyConditionScoreDate',
+    'has_had_offspring': 'hasHadOffspring',
+})
+
+WEIGHT_GAIN = Mapping(WeightGain, {'unit': 'unit', 'value': 'value'})
+WEIGHT = Mapping(Weight, {'unit': 'unit', 'value': 'value'})
+CONDITION_SCORE = Mapping(ConditionScore, {'unit': 'unit', 'value': 'value'})
+ANIMAL_UNIT = Mapping(AnimalUnit, {'unit': 'unit', 'value': 'value'})
+
+ENTERPRISE = Mapping(Enterprise, {
+    'name': 'name',
+    'farm_id': 'farmId',
+})
+
+MANAGEMENT_GROUP = Mapping(ManagementGroup, {
+    'enterprise_id': 'enterpriseId',
+    'farm_id': 'farmId',
+    'name': 'name',
+    'species': 'species',
+    'type': 'type',
+})
+
+ANIMAL = Mapping(Animal, {
+    'age_class': 'ageClass',
+    'purchased_from': 'purchasedFrom',
+    'purchase_location_id': 'purchaseLocationId',
+    'creation_record_group_id': 'creationRecordGroupId',
+    'creation_record_id': 'creationRecordId',
+    'birthing_record_id': 'birthingRecordId',
+    'purchase_record_id': 'purchaseRecordId',
+    'sale_record_id': 'saleRecordId',
+    'observation_date': '_observationDate',
+})
+
+ANIMAL_RECORD = Mapping(AnimalRecord, {
+    'record_type': 'recordType',
+    'observation_date': 'observationDate',
+    'session_id': 'sessionId',
+})
+
+FARM = Mapping(Farm, {
+    'name': 'name',
+    'time_zone': 'timeZone',
+})
+
+ADDRESS = Mapping(Address, {
+    'country': 'country',
+    'postcode': 'postcode',
+    'town': 'town',
+    'state': 'state',
+    'address1': 'address1',
+    'address2': 'address2',
+})
+
+GEO_POINT = Mapping(GeoPoint, {
+    'lat': 'lat',
+    'long': 'long',
+})
+
+CAPACITY_ALERT = Mapping(CapacityAlert, {
+    'critical': 'critical',
+    'warning': 'warning',
+})
+
+CAPACITY = Mapping(Capacity, {
+    'mode': 'mode',
+    'value': 'value',
+    'unit': 'unit',
+})
+
+MAP_FEATURE = Mapping(MapFeature, {
+    'name': 'name',
+    'description': 'description',
+    'farm_id': 'farmId',
+    'type': 'type',
+    'identifier': 'identifier',
+})
+
+FIELD = Mapping(Field, {
+    'farm_id': 'farmId',
+    'name': 'name',
+    'total_area': 'totalArea',
+    'grazable_area': 'grazableArea',
+    'unit': 'unit',
+    'land_use': 'landUse',
+    'crop_type': 'cropType',
+    'creation_date': 'creationDate',
+    'last_modified_date': 'lastModifiedDate',
+})
+
+# the coordinates of a geo feature are the whole GeoJSON geometry, see geo_feature
+GEO_FEATURE = Mapping(GeoFeature, {
+    'type': 'type',
+})
+
+EXTERNAL_IDENTIFIER = Mapping(ExternalIdentifier, {
+    'type': 'type',
+    'value': 'value',
+})
+
+
+def geo_feature(geometry):
+    """
+    The GeoFeature values of a GeoJSON geometry payload.
+    """
+    return GEO_FEATURE(geometry, coordinates=to_geometry(geometry))
@@ -1,3 +1,5 @@
 from .animal import *
 from .farm import *
-from .auth import *
\ No newline at end of file
+from .auth import *
+from .sync import *
+from .pedigree import *
\ No newline at end of file
@@ -1,4 +1,7 @@
+import datetime
+
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.utils.translation import gettext_lazy as _
 
 from .record import Record
@@ -69,7 +72,8 @@ class Animal(models.Model):
         on_delete=models.SET_NULL,
         help_text=_('Identity on the agriwebb, type of relationship unknown'),
     )
-    age_class = models.IntegerField(
+    age_class = models.CharField(
+        max_length=255,
         verbose_name=_('Age Class'),
         choices=SharedAgeClassChoices.choices,
         blank=True,
@@ -524,6 +528,11 @@ class DateConfidence(models.Model):
         help_text=_('Day Confidence on the agriwebb'),
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['year', 'month', 'day'], name='unique_date_confidence'),
+        ]
+
 
 class ParentAnimalIdentity(models.Model):
     parent_animal_id = models.CharField(
@@ -891,6 +900,11 @@ class ConditionScore(models.Model):
         help_text=_('Condition score Value on the agriwebb'),
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['unit', 'value'], name='unique_condition_score'),
+        ]
+
 
 class AnimalUnit(models.Model):
     class UnitChoices(models.TextChoices):
@@ -915,6 +929,11 @@ class AnimalUnit(models.Model):
         help_text=_('Value on the agriwebb'),
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['unit', 'value'], name='unique_animal_unit'),
+        ]
+
 
 class WeightGain(models.Model):
     class UnitChoices(models.TextChoices):
@@ -938,6 +957,11 @@ class WeightGain(models.Model):
         help_text=_('Weight Gain Value on the agriwebb'),
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['unit', 'value'], name='unique_weight_gain'),
+        ]
+
 
 class Weight(models.Model):
     class UnitChoices(models.TextChoices):
@@ -967,6 +991,11 @@ class Weight(models.Model):
         help_text=_('Weight Value on the agriwebb'),
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['unit', 'value'], name='unique_weight'),
+        ]
+
 
 class AnimalWeightSummary(models.Model):
     live_average_daily_gain = models.ForeignKey(
@@ -1016,6 +1045,20 @@ class AnimalWeightSummary(models.Model):
         help_text=_('Estimated Weight on the agriwebb'),
     )
 
+    class Meta:
+        # NULLs are distinct in a plain unique index, so the nullable fields are coalesced
+        constraints = [
+            models.UniqueConstraint(
+                Coalesce('live_average_daily_gain', 0, output_field=models.BigIntegerField()),
+                Coalesce('overall_average_daily_gain', 0, output_field=models.BigIntegerField()),
+                Coalesce('assumed_average_daily_gain', 0, output_field=models.BigIntegerField()),
+                Coalesce('live_weight_date', datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)),
+                Coalesce('live_weight', 0, output_field=models.BigIntegerField()),
+                Coalesce('estimated_weight', 0, output_field=models.BigIntegerField()),
+                name='unique_animal_weight_summary',
+            ),
+        ]
+
 
 class AnimalCount(models.Model):
     farm_id = models.CharField(
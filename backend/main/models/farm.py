@@ -114,6 +114,15 @@ class Address(models.Model):
             'AgriWebb Location, on the query it wont return array of locations so assumed its 1 single geoPoint per address'
         ),
     )
+    content_hash = models.CharField(
+        verbose_name=_('Content Hash'),
+        max_length=32,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_('Hash of the value fields, rows holding the same value are shared'),
+    )
 
 
 class GeoPoint(models.Model):
@@ -129,6 +138,15 @@ class GeoPoint(models.Model):
         blank=True,
         help_text=_('AgriWebb Longitude on GeoPoint'),
     )
+    content_hash = models.CharField(
+        verbose_name=_('Content Hash'),
+        max_length=32,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_('Hash of the value fields, rows holding the same value are shared'),
+    )
 
 
 class MapFeature(models.Model):
@@ -239,6 +257,64 @@ class GeoFeature(models.Model):
         blank=True,
         help_text=_("Geometry field storing coordinates, maybe need to change the field later"),
     )
+    content_hash = models.CharField(
+        verbose_name=_('Content Hash'),
+        max_length=32,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_('Hash of the value fields, rows holding the same value are shared'),
+    )
+
+
+class GeoFeatureSimplification(models.Model):
+    """
+    A geometry simplified for one zoom level of a map, see geometry.simplify_features.
+    """
+    feature = models.ForeignKey(
+        "GeoFeature",
+        verbose_name=_('Feature'),
+        on_delete=models.CASCADE,
+        related_name='simplifications',
+        help_text=_('The full resolution geometry'),
+    )
+    level = models.PositiveSmallIntegerField(
+        verbose_name=_('Level'),
+        help_text=_('Web map zoom level the geometry is simplified for'),
+    )
+    tolerance = models.FloatField(
+        verbose_name=_('Tolerance'),
+        help_text=_('Simplification tolerance in degrees, about a pixel at the zoom level'),
+    )
+    geometry = gis_models.GeometryField(
+        verbose_name=_('Geometry'),
+        null=True,
+        blank=True,
+        help_text=_('The simplified geometry, empty when the feature is smaller than the tolerance'),
+    )
+    vertices = models.PositiveIntegerField(
+        verbose_name=_('Vertices'),
+        default=0,
+        help_text=_('Number of vertices of the simplified geometry'),
+    )
+    source_modified = models.DateTimeField(
+        verbose_name=_('Source Modified'),
+        null=True,
+        blank=True,
+        help_text=_('Last modified date of the field the geometry was simplified from'),
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Created at"))
+
+    class Meta:
+        verbose_name = _("Geo Feature Simplification")
+        verbose_name_plural = _("Geo Feature Simplifications")
+        constraints = [
+            models.UniqueConstraint(fields=['feature', 'level'], name='unique_geo_feature_simplification'),
+        ]
+
+    def __str__(self):
+        return f"{self.feature_id} at zoom {self.level}"
 
 
 class CapacityAlert(models.Model):
@@ -258,6 +334,15 @@ class CapacityAlert(models.Model):
             "AgriWebb Warning Alert, Percentage of the capacity at which the tank is considered at warning level. Users will be notified when the tank's water level goes below this percentage. max: 500 min: 0"
         )
     )
+    content_hash = models.CharField(
+        verbose_name=_('Content Hash'),
+        max_length=32,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_('Hash of the value fields, rows holding the same value are shared'),
+    )
 
 
 class Capacity(models.Model):
@@ -291,6 +376,15 @@ class Capacity(models.Model):
         null=True,
         help_text=_("AgriWebb Capacity Unit"),
     )
+    content_hash = models.CharField(
+        verbose_name=_('Content Hash'),
+        max_length=32,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_('Hash of the value fields, rows holding the same value are shared'),
+    )
 
 
 class Field(models.Model):
@@ -383,6 +477,18 @@ class Field(models.Model):
         null=True,
         help_text=_("AgriWebb Grazable Area, The grazable area of the field in hectares"),
     )
+    total_area_hectares = models.FloatField(
+        verbose_name=_('Total Area (ha)'),
+        blank=True,
+        null=True,
+        help_text=_("The total area converted from the unit of the field to hectares"),
+    )
+    grazable_area_hectares = models.FloatField(
+        verbose_name=_('Grazable Area (ha)'),
+        blank=True,
+        null=True,
+        help_text=_("The grazable area converted from the unit of the field to hectares"),
+    )
     unit = models.CharField(
         verbose_name=_('Unit'),
         max_length=8,
@@ -433,3 +539,12 @@ class ExternalIdentifier(models.Model):
         default=list,
         help_text=_("List of values")
     )
+    content_hash = models.CharField(
+        verbose_name=_('Content Hash'),
+        max_length=32,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_('Hash of the value fields, rows holding the same value are shared'),
+    )
@@ -0,0 +1,78 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+from .animal import AnimalParent
+
+
+class PedigreeEdge(models.Model):
+    class Role(models.TextChoices):
+        DAM = AnimalParent.AnimalParentType.DAM.value, _("Dam")
+        SIRE = AnimalParent.AnimalParentType.SIRE.value, _("Sire")
+
+    animal_id = models.CharField(
+        max_length=255,
+        verbose_name=_('Animal ID'),
+        help_text=_('Animal ID on the agriwebb'),
+    )
+    parent_animal_id = models.CharField(
+        max_length=255,
+        verbose_name=_('Parent Animal ID'),
+        help_text=_('Parent Animal ID on the agriwebb'),
+    )
+    role = models.CharField(
+        max_length=10,
+        verbose_name=_('Role'),
+        choices=Role.choices,
+        help_text=_('Whether the parent is the dam or the sire of the animal'),
+    )
+
+    class Meta:
+        verbose_name = _("Pedigree Edge")
+        verbose_name_plural = _("Pedigree Edges")
+        constraints = [
+            models.UniqueConstraint(fields=['animal_id', 'parent_animal_id', 'role'], name='unique_pedigree_edge'),
+        ]
+        indexes = [
+            models.Index(fields=['parent_animal_id'], name='pedigree_edge_parent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.parent_animal_id} is the {self.role} of {self.animal_id}"
+
+
+class PedigreeClosure(models.Model):
+    """
+    One row per ancestor, descendant and number of generations between them. An animal
+    reached through several lines of descent has a row for every distinct depth.
+    """
+    ancestor_id = models.CharField(
+        max_length=255,
+        verbose_name=_('Ancestor ID'),
+        help_text=_('Animal ID of the ancestor on the agriwebb'),
+    )
+    descendant_id = models.CharField(
+        max_length=255,
+        verbose_name=_('Descendant ID'),
+        help_text=_('Animal ID of the descendant on the agriwebb'),
+    )
+    depth = models.PositiveIntegerField(
+        verbose_name=_('Depth'),
+        help_text=_('Generations between the ancestor and the descendant, 1 for a parent'),
+    )
+
+    class Meta:
+        verbose_name = _("Pedigree Closure")
+        verbose_name_plural = _("Pedigree Closures")
+        constraints = [
+            models.UniqueConstraint(
+                fields=['descendant_id', 'ancestor_id', 'depth'],
+                name='unique_pedigree_closure'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['ancestor_id', 'depth'], name='pedigree_closure_ancestor_idx'),
+            models.Index(fields=['descendant_id', 'depth'], name='pedigree_closure_descend_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.ancestor_id} is an ancestor of {self.descendant_id} at depth {self.depth}"
@@ -0,0 +1,279 @@
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from .animal import Animal, AnimalCount
+
+
+class AnimalSyncWatermark(models.Model):
+    farm_id = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name=_('Farm ID'),
+        help_text=_('Farm ID on the agriwebb'),
+    )
+    watermark = models.DateTimeField(
+        verbose_name=_('Watermark'),
+        null=True,
+        blank=True,
+        help_text=_('Latest animal observation date stored by a successful sync of the farm'),
+    )
+    last_incremental_sync_at = models.DateTimeField(
+        verbose_name=_('Last Incremental Sync'),
+        null=True,
+        blank=True,
+        help_text=_('When the farm was last synced from its watermark'),
+    )
+    last_full_sync_at = models.DateTimeField(
+        verbose_name=_('Last Full Sync'),
+        null=True,
+        blank=True,
+        help_text=_('When the whole herd of the farm was last reconciled'),
+    )
+    last_synced_count = models.IntegerField(
+        verbose_name=_('Last Synced Count'),
+        default=0,
+        help_text=_('Number of animals stored by the last sync'),
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Created at"))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_("Updated at"))
+
+    class Meta:
+        verbose_name = _("Animal Sync Watermark")
+        verbose_name_plural = _("Animal Sync Watermarks")
+
+    def __str__(self):
+        return f"Animal sync watermark for farm {self.farm_id}"
+
+    def needs_full_sync(self, interval_seconds):
+        """
+        A farm is fully reconciled when it has no watermark yet or its last full sync is
+        older than the interval.
+        """
+        if self.watermark is None or self.last_full_sync_at is None:
+            return True
+        return timezone.now() - self.last_full_sync_at >= timezone.timedelta(seconds=interval_seconds)
+
+
+class AnimalFingerprint(models.Model):
+    animal = models.OneToOneField(
+        Animal,
+        verbose_name=_('Animal'),
+        on_delete=models.CASCADE,
+        related_name='fingerprint',
+        help_text=_('Animal the payload hashes belong to'),
+    )
+    identity_hash = models.CharField(
+        max_length=32,
+        verbose_name=_('Identity Hash'),
+        help_text=_('Hash of the identity section of the last stored payload'),
+    )
+    characteristics_hash = models.CharField(
+        max_length=32,
+        verbose_name=_('Characteristics Hash'),
+        help_text=_('Hash of the characteristics section of the last stored payload'),
+    )
+    parentage_hash = models.CharField(
+        max_length=32,
+        verbose_name=_('Parentage Hash'),
+        help_text=_('Hash of the parentage section of the last stored payload'),
+    )
+    state_hash = models.CharField(
+        max_length=32,
+        verbose_name=_('State Hash'),
+        help_text=_('Hash of the state section of the last stored payload'),
+    )
+    records_hash = models.CharField(
+        max_length=32,
+        verbose_name=_('Records Hash'),
+        help_text=_('Hash of the records section of the last stored payload'),
+    )
+    animal_hash = models.CharField(
+        max_length=32,
+        verbose_name=_('Animal Hash'),
+        help_text=_('Hash of the remaining animal fields, enterprise and management group of the last stored payload'),
+    )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_("Updated at"))
+
+    class Meta:
+        verbose_name = _("Animal Fingerprint")
+        verbose_name_plural = _("Animal Fingerprints")
+
+    def __str__(self):
+        return f"Fingerprint of animal #{self.animal_id}"
+
+    def changed(self, hashes):
+        """
+        Returns the sections whose hash differs from the given section hashes.
+        """
+        return {section for section, value in hashes.items() if getattr(self, f"{section}_hash") != value}
+
+
+class IngestRun(models.Model):
+    class Kind(models.TextChoices):
+        ANIMALS = "animals", _("Animals")
+        ANIMALS_WITH_COUNT = "animals_with_count", _("Animals With Count")
+        PARTITION = "partition", _("Partition")
+
+    class Status(models.TextChoices):
+        RUNNING = "running", _("Running")
+        FAILED = "failed", _("Failed")
+        COMPLETED = "completed", _("Completed")
+
+    farm_id = models.CharField(
+        max_length=255,
+        verbose_name=_('Farm ID'),
+        help_text=_('Farm ID on the agriwebb'),
+    )
+    kind = models.CharField(
+        max_length=32,
+        verbose_name=_('Kind'),
+        choices=Kind.choices,
+        help_text=_('The query the run ingests'),
+    )
+    run_key = models.CharField(
+        max_length=32,
+        verbose_name=_('Run Key'),
+        help_text=_('Hash of the query arguments, a run is resumed by a task with the same arguments'),
+    )
+    status = models.CharField(
+        max_length=16,
+        verbose_name=_('Status'),
+        choices=Status.choices,
+        default=Status.RUNNING,
+    )
+    chunk_size = models.IntegerField(
+        verbose_name=_('Chunk Size'),
+        help_text=_('Animals committed together'),
+    )
+    committed_offset = models.IntegerField(
+        verbose_name=_('Committed Offset'),
+        default=0,
+        help_text=_('Number of animals of the query committed so far, the run resumes after them'),
+    )
+    committed_chunks = models.IntegerField(
+        verbose_name=_('Committed Chunks'),
+        default=0,
+    )
+    quarantined_count = models.IntegerField(
+        verbose_name=_('Quarantined Count'),
+        default=0,
+        help_text=_('Animals that failed to store and were quarantined'),
+    )
+    animal_count = models.ForeignKey(
+        AnimalCount,
+        verbose_name=_('Animal Count'),
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        help_text=_('The AnimalCount an animals with count run adds its animals to'),
+    )
+    last_error = models.TextField(
+        verbose_name=_('Last Error'),
+        blank=True,
+        default='',
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Created at"))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_("Updated at"))
+    completed_at = models.DateTimeField(null=True, blank=True, verbose_name=_("Completed at"))
+
+    class Meta:
+        verbose_name = _("Ingest Run")
+        verbose_name_plural = _("Ingest Runs")
+        indexes = [
+            models.Index(fields=['farm_id', 'kind', 'run_key', 'status'], name='ingest_run_resume_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} run #{self.pk} for farm {self.farm_id} ({self.status})"
+
+
+class QuarantinedAnimal(models.Model):
+    run = models.ForeignKey(
+        IngestRun,
+        verbose_name=_('Run'),
+        on_delete=models.CASCADE,
+        related_name='quarantined',
+    )
+    farm_id = models.CharField(
+        max_length=255,
+        verbose_name=_('Farm ID'),
+        help_text=_('Farm ID on the agriwebb'),
+    )
+    animal_id = models.CharField(
+        max_length=255,
+        verbose_name=_('Animal ID'),
+        blank=True,
+        default='',
+        help_text=_('Animal ID on the agriwebb'),
+    )
+    payload = models.JSONField(
+        verbose_name=_('Payload'),
+        help_text=_('The animal payload that failed to store'),
+    )
+    error = models.TextField(
+        verbose_name=_('Error'),
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Created at"))
+
+    class Meta:
+        verbose_name = _("Quarantined Animal")
+        verbose_name_plural = _("Quarantined Animals")
+
+    def __str__(self):
+        return f"Quarantined animal {self.animal_id} of farm {self.farm_id}"
+
+
+class IngestBatch(models.Model):
+    farm_id = models.CharField(
+        max_length=255,
+        verbose_name=_('Farm ID'),
+        help_text=_('Farm ID on the agriwebb'),
+    )
+    partitions = models.IntegerField(
+        verbose_name=_('Partitions'),
+        help_text=_('Number of hash partitions the herd is split into'),
+    )
+    shared = models.JSONField(
+        verbose_name=_('Shared'),
+        default=dict,
+        help_text=_('The shared rows stored up front, model label to (natural key, primary key) pairs'),
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Created at"))
+
+    class Meta:
+        verbose_name = _("Ingest Batch")
+        verbose_name_plural = _("Ingest Batches")
+
+    def __str__(self):
+        return f"Ingest batch #{self.pk} for farm {self.farm_id}"
+
+
+class IngestPartition(models.Model):
+    batch = models.ForeignKey(
+        IngestBatch,
+        verbose_name=_('Batch'),
+        on_delete=models.CASCADE,
+        related_name='parts',
+    )
+    partition = models.IntegerField(
+        verbose_name=_('Partition'),
+    )
+    sequence = models.IntegerField(
+        verbose_name=_('Sequence'),
+        help_text=_('Order of the chunk within its partition'),
+    )
+    animals = models.JSONField(
+        verbose_name=_('Animals'),
+        help_text=_('A chunk of the animal payloads of the partition'),
+    )
+
+    class Meta:
+        verbose_name = _("Ingest Partition")
+        verbose_name_plural = _("Ingest Partitions")
+        constraints = [
+            models.UniqueConstraint(fields=['batch', 'partition', 'sequence'], name='unique_ingest_partition_chunk'),
+        ]
+
+    def __str__(self):
+        return f"Chunk {self.sequence} of partition {self.partition} of {self.batch}"
@@ -0,0 +1,204 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+
+class AdaptivePageSize:
+    """
+    Tunes the page size of a paged walk from the observed response times, growing it while
+    pages come back quickly and shrinking it when they get slower than the target.
+    """
+
+    def __init__(self, initial=None, minimum=None, maximum=None, target_seconds=None):
+        """
+        :param initial: Page size of the first request.
+        :param minimum: Smallest page size the walk may shrink to.
+        :param maximum: Largest page size the walk may grow to.
+        :param target_seconds: Response time each page should take.
+        """
+        self.minimum = minimum or getattr(settings, 'AGRIWEBB_PAGE_SIZE_MIN', 100)
+        self.maximum = maximum or getattr(settings, 'AGRIWEBB_PAGE_SIZE_MAX', 2000)
+        self.target_seconds = target_seconds or getattr(settings, 'AGRIWEBB_PAGE_TARGET_SECONDS', 2.0)
+
+        initial = initial or getattr(settings, 'AGRIWEBB_PAGE_SIZE', 500)
+        self.size = max(self.minimum, min(self.maximum, initial))
+
+    def observe(self, elapsed):
+        """
+        Records how long the last page took and adjusts the next page size.
+
+        :param elapsed: Seconds the last page request took.
+        :return: The page size to use for the next request.
+        """
+        if elapsed <= 0:
+            return self.size
+
+        if elapsed < self.target_seconds / 2:
+            self.size = min(self.maximum, self.size * 2)
+        elif elapsed > self.target_seconds:
+            self.size = max(self.minimum, int(self.size * self.target_seconds / elapsed))
+
+        return self.size
+
+
+class FixedPageSize:
+    """
+    Page size policy that never changes, used when a caller pins the page size.
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+    def observe(self, elapsed):
+        return self.size
+
+
+class AnimalPageIterator:
+    """
+    Walks a limit/skip paged AgriWebb query and yields animals one at a time.
+
+    The next page is requested in the background while the current one is being consumed,
+    and the walk stops once `nonPagedCount` animals were read or a short page comes back.
+
+    In stream mode every page is a GraphQLStream that is parsed while it is consumed, so
+    only one animal of a page is in memory at a time. A streamed page holds its connection
+    until it was read, so stream mode walks the pages without prefetching.
+    """
+
+    def __init__(
+            self,
+            fetch_page,
+            extract,
+            page_size=None,
+            skip=0,
+            prefetch=True,
+            adaptive=True,
+            stream=False
+    ):
+        """
+        :param fetch_page: Callable taking (limit, skip) and returning the GraphQL data of one page.
+        :param extract: Callable taking the GraphQL data and returning (animals, non_paged_count).
+                        In stream mode it receives the exhausted page stream instead.
+        :param page_size: Page size of the first request, defaults to AGRIWEBB_PAGE_SIZE.
+        :param skip: Number of animals to skip before the first page.
+        :param prefetch: Fetch the next page while the current one is being consumed.
+        :param adaptive: Adapt the page size to the observed response times.
+        :param stream: `fetch_page` returns a GraphQLStream instead of the parsed data.
+        """
+        self.fetch_page = fetch_page
+        self.extract = extract
+        self.skip = skip or 0
+        self.prefetch = prefetch
+        self.stream = stream
+
+        if adaptive:
+            self.page_size = AdaptivePageSize(initial=page_size)
+        else:
+            self.page_size = FixedPageSize(page_size or getattr(settings, 'AGRIWEBB_PAGE_SIZE', 500))
+
+        self.non_paged_count = None
+        self.pages = 0
+        self.fetched = 0
+
+    def _fetch(self, limit, skip):
+        started = time.monotonic()
+        data = self.fetch_page(limit, skip)
+        return data, time.monotonic() - started
+
+    def _is_last_page(self, count, limit, offset):
+        if not count or count < limit:
+            return True
+        if self.non_paged_count is not None and offset >= self.non_paged_count:
+            return True
+        return False
+
+    def __iter__(self):
+        if self.stream:
+            yield from self._iter_streamed()
+            return
+
+        if not self.prefetch:
+            yield from self._iter_sequential()
+            return
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = None
+        try:
+            offset = self.skip
+            limit = self.page_size.size
+            future = executor.submit(self._fetch, limit, offset)
+
+            while future is not None:
+                data, elapsed = future.result()
+                animals, non_paged_count = self.extract(data)
+
+                self.pages += 1
+                self.fetched += len(animals)
+                if non_paged_count is not None:
+                    self.non_paged_count = non_paged_count
+
+                offset += len(animals)
+                future = None
+
+                if not self._is_last_page(len(animals), limit, offset):
+                    limit = self.page_size.observe(elapsed)
+                    future = executor.submit(self._fetch, limit, offset)
+
+                yield from animals
+        finally:
+            if future is not None:
+                future.cancel()
+            # the prefetch thread opened its own database connection for the token lookup
+            executor.submit(connections.close_all)
+            executor.shutdown(wait=True)
+
+    def _iter_sequential(self):
+        offset = self.skip
+        limit = self.page_size.size
+
+        while True:
+            data, elapsed = self._fetch(limit, offset)
+            animals, non_paged_count = self.extract(data)
+
+            self.pages += 1
+            self.fetched += len(animals)
+            if non_paged_count is not None:
+                self.non_paged_count = non_paged_count
+
+            offset += len(animals)
+
+            yield from animals
+
+            if self._is_last_page(len(animals), limit, offset):
+                return
+
+            limit = self.page_size.observe(elapsed)
+
+    def _iter_streamed(self):
+        offset = self.skip
+        limit = self.page_size.size
+
+        while True:
+            # the response time up to the headers, reading the body is paced by the consumer
+            page, elapsed = self._fetch(limit, offset)
+
+            count = 0
+            for animal in page:
+                count += 1
+                yield animal
+
+            _, non_paged_count = self.extract(page)
+
+            self.pages += 1
+            self.fetched += count
+            if non_paged_count is not None:
+                self.non_paged_count = non_paged_count
+
+            offset += count
+
+            if self._is_last_page(count, limit, offset):
+                return
+
+            limit = self.page_size.observe(elapsed)
@@ -0,0 +1,159 @@
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from celery import group
+from django.conf import settings
+from django.db import connections
+
+from .checkpoints import CheckpointedIngest
+from .ingest import AnimalIngest, IngestStats, chunked
+from .models import IngestBatch, IngestPartition, IngestRun
+
+PROCESS = 'process'
+CELERY = 'celery'
+
+
+def partition_of(animal_id, partitions):
+    """
+    Returns the partition of an animal ID. The hash is stable across processes, unlike the
+    built-in hash of a string.
+    """
+    digest = hashlib.blake2b(str(animal_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % partitions
+
+
+def partition(animals, partitions):
+    """
+    Splits animal payloads into hash partitions by animal ID, every payload of an animal
+    lands in the same partition.
+
+    :return: A list of `partitions` lists of payloads, some may be empty.
+    """
+    parts = [[] for _ in range(partitions)]
+    for animal in animals:
+        parts[partition_of(animal.get('animalId', ''), partitions)].append(animal)
+    return parts
+
+
+def stage(animals, farm_id, partitions, chunk_size=None):
+    """
+    Stores a fetched herd a chunk at a time as hash partitions in an IngestBatch, so the
+    partitions are handed to their workers by reference instead of by payload.
+
+    The rows the animals share are stored with every chunk, see AnimalIngest.resolve_shared,
+    the herd is never held in memory at once.
+
+    :return: The IngestBatch and the partitions that have animals.
+    """
+    chunk_size = chunk_size or getattr(settings, 'AGRIWEBB_INGEST_CHUNK_SIZE', 500)
+    batch = IngestBatch.objects.create(farm_id=farm_id, partitions=partitions)
+
+    ingest = AnimalIngest(farm_id)
+    shared = {}
+    staged = set()
+    for sequence, chunk in enumerate(chunked(animals, chunk_size)):
+        for label, pairs in ingest.resolve_shared(chunk).items():
+            shared.setdefault(label, []).extend(pairs)
+
+        rows = []
+        for index, part in enumerate(partition(chunk, partitions)):
+            if part:
+                rows.append(IngestPartition(batch=batch, partition=index, sequence=sequence, animals=part))
+                staged.add(index)
+        IngestPartition.objects.bulk_create(rows)
+
+    batch.shared = shared
+    batch.save(update_fields=['shared'])
+    return batch, sorted(staged)
+
+
+def ingest_partition(batch_id, index, chunk_size=None):
+    """
+    Stores one staged partition of a herd whose shared rows were resolved up front.
+
+    The partition is stored through a CheckpointedIngest, the animals that fail are
+    quarantined and a retried partition resumes after its committed chunks. The staged
+    rows of the partition are dropped once it is stored.
+
+    :return: The ingest stats as a dict.
+    """
+    batch = IngestBatch.objects.get(pk=batch_id)
+    parts = batch.parts.filter(partition=index)
+
+    checkpoint = CheckpointedIngest(
+        batch.farm_id,
+        IngestRun.Kind.PARTITION,
+        {'batch': batch.pk, 'partition': index},
+        chunk_size=chunk_size,
+        ingest=AnimalIngest(batch.farm_id, shared=batch.shared),
+        # the staged chunks are read back in the same order every time
+        ordered=True
+    )
+
+    with checkpoint.running() as run:
+        animals = (
+            animal
+            for animals in parts.order_by('sequence').values_list('animals', flat=True).iterator()
+            for animal in animals
+        )
+        checkpoint.ingest_all(islice(animals, run.committed_offset, None))
+
+    parts.delete()
+    if not batch.parts.exists():
+        IngestBatch.objects.filter(pk=batch.pk).delete()
+
+    return {**checkpoint.stats.as_dict(), 'quarantined': run.quarantined_count}
+
+
+def merge_stats(results):
+    stats = IngestStats()
+    for result in results:
+        for name in ('pages', 'animals', 'written', 'skipped', 'sections_skipped', 'queries'):
+            setattr(stats, name, getattr(stats, name) + result[name])
+    return stats
+
+
+def parallel_ingest(animals, farm_id, partitions=None, mode=PROCESS, chunk_size=None):
+    """
+    Stores a fetched herd from several processes at once.
+
+    The herd is staged in the database as hash partitions by animal ID, see stage, after
+    the rows animals share, e.g. enterprises, management groups and parents, were stored
+    from this process. The rows of the partitions never overlap, so the partitions write
+    concurrently without waiting on each other's locks. Every worker only gets the ID of
+    the batch and its partition.
+
+    :param animals: An iterable of animal payloads.
+    :param farm_id: The ID of the farm.
+    :param partitions: Number of partitions, defaults to AGRIWEBB_INGEST_PARTITIONS.
+    :param mode: PROCESS (default) to write from a local process pool and wait for it, or
+                 CELERY to dispatch a Celery subtask per partition. A Celery worker cannot start
+                 a process pool, tasks use CELERY.
+    :param chunk_size: Payloads stored together by every partition, defaults to AGRIWEBB_INGEST_CHUNK_SIZE.
+    :return: The merged IngestStats with PROCESS, the GroupResult of the subtasks with CELERY.
+    """
+    partitions = partitions or getattr(settings, 'AGRIWEBB_INGEST_PARTITIONS', 4)
+
+    batch, staged = stage(animals, farm_id, partitions, chunk_size)
+
+    if mode == CELERY:
+        from .tasks import ingest_animal_partition
+
+        return group(
+            ingest_animal_partition.s(batch.pk, index, chunk_size)
+            for index in staged
+        ).apply_async()
+
+    if len(staged) <= 1:
+        return merge_stats([ingest_partition(batch.pk, index, chunk_size) for index in staged])
+
+    # forked workers must open their own database connections
+    connections.close_all()
+
+    with ProcessPoolExecutor(max_workers=len(staged)) as executor:
+        futures = [
+            executor.submit(ingest_partition, batch.pk, index, chunk_size)
+            for index in staged
+        ]
+        return merge_stats(future.result() for future in futures)
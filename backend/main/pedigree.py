@@ -0,0 +1,261 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+
+from .models import Animal, PedigreeEdge, PedigreeClosure
+
+DAM = PedigreeEdge.Role.DAM
+SIRE = PedigreeEdge.Role.SIRE
+
+
+def node(value):
+    """
+    Pedigree nodes are AgriWebb animal IDs, stored as text since parents are kept by their
+    parent animal ID.
+    """
+    return str(value)
+
+
+def parent_edges(animal):
+    """
+    Returns the (parent animal ID, role) pairs of the dams and sires of an animal payload.
+    Surrogates raise an animal but are not part of its pedigree.
+    """
+    animal_parentage = animal.get('parentage') or {}
+
+    edges = set()
+    for role, key in ((DAM, 'dams'), (SIRE, 'sires')):
+        for parent in animal_parentage.get(key) or []:
+            parent_animal_id = parent.get('parentAnimalId')
+            if parent_animal_id:
+                edges.add((node(parent_animal_id), role))
+    return edges
+
+
+class PedigreeStore:
+    """
+    Keeps the animal to parent edges and their transitive closure.
+
+    The closure holds a row for every ancestor of every animal, so ancestors, descendants
+    and common ancestors are one indexed query whatever the number of generations. It is
+    updated incrementally: a new edge adds the ancestors of the parent to the animal and
+    all of its descendants. Changing the parents of an animal, which only happens when
+    the pedigree is corrected, rebuilds the ancestry of the animal and its descendants
+    from the edges that lead into them.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or getattr(settings, 'AGRIWEBB_INGEST_BULK_SIZE', 1000)
+
+    def record(self, parents):
+        """
+        Stores the parents of a set of animals.
+
+        :param parents: Dict of animal ID to the set of its (parent animal ID, role) pairs,
+                        see parent_edges. The parents of an animal replace its current ones.
+        :return: A tuple of the number of added and removed edges.
+        """
+        parents = {
+            node(animal_id): {(parent, role) for parent, role in edges if parent != node(animal_id)}
+            for animal_id, edges in parents.items()
+        }
+        if not parents:
+            return 0, 0
+
+        current = defaultdict(set)
+        stored = {}
+        for edge in PedigreeEdge.objects.filter(animal_id__in=list(parents)):
+            current[edge.animal_id].add((edge.parent_animal_id, edge.role))
+            stored[(edge.animal_id, edge.parent_animal_id, edge.role)] = edge.pk
+
+        added = [
+            (animal_id, parent, role)
+            for animal_id, edges in parents.items()
+            for parent, role in sorted(edges - current[animal_id])
+        ]
+        removed = [
+            (animal_id, parent, role)
+            for animal_id, edges in parents.items()
+            for parent, role in sorted(current[animal_id] - edges)
+        ]
+        if not added and not removed:
+            return 0, 0
+
+        with transaction.atomic():
+            if removed:
+                PedigreeEdge.objects.filter(pk__in=[stored[edge] for edge in removed]).delete()
+            if added:
+                PedigreeEdge.objects.bulk_create(
+                    [
+                        PedigreeEdge(animal_id=animal_id, parent_animal_id=parent, role=role)
+                        for animal_id, parent, role in added
+                    ],
+                    batch_size=self.batch_size,
+                    ignore_conflicts=True
+                )
+
+            edges = [(parent, animal_id) for animal_id, parent, _ in added]
+            if removed:
+                edges = self.detach({animal_id for animal_id, _, _ in removed}, edges)
+            self.extend(edges)
+
+        return len(added), len(removed)
+
+    def detach(self, animal_ids, edges):
+        """
+        Removes the ancestry of the given animals and their descendants from the closure.
+
+        :param animal_ids: Animals whose parents changed.
+        :param edges: The new (parent, animal) edges about to be added to the closure.
+        :return: The edges to add to the closure to restore it: the given edges outside the
+                 detached subtrees and every stored edge leading into them, the ones between
+                 two animals of a subtree included.
+        """
+        subtree = set(animal_ids)
+        subtree.update(
+            PedigreeClosure.objects.filter(ancestor_id__in=list(animal_ids)).values_list('descendant_id', flat=True)
+        )
+        subtree = list(subtree)
+
+        # a path between two animals of the subtree may run through a changed edge, so every
+        # row leading into the subtree goes and is rebuilt from the edges
+        PedigreeClosure.objects.filter(descendant_id__in=subtree).delete()
+
+        incoming = PedigreeEdge.objects.filter(animal_id__in=subtree).values_list('parent_animal_id', 'animal_id')
+        inside = set(subtree)
+        return [edge for edge in edges if edge[1] not in inside] + list(incoming)
+
+    def extend(self, edges):
+        """
+        Adds the closure rows of new (parent, animal) edges.
+
+        The ancestors of every parent and the descendants of every animal are loaded once,
+        the rows added by earlier edges of the batch are tracked in memory so chains of new
+        edges, e.g. a calf and its dam synced together, are joined up.
+        """
+        edges = [(parent, child) for parent, child in edges if parent != child]
+        if not edges:
+            return 0
+
+        parents = {parent for parent, _ in edges}
+        children = {child for _, child in edges}
+
+        ancestors = defaultdict(set)
+        for ancestor, descendant, depth in PedigreeClosure.objects.filter(
+                descendant_id__in=list(parents)
+        ).values_list('ancestor_id', 'descendant_id', 'depth'):
+            ancestors[descendant].add((ancestor, depth))
+
+        descendants = defaultdict(set)
+        for ancestor, descendant, depth in PedigreeClosure.objects.filter(
+                ancestor_id__in=list(children)
+        ).values_list('ancestor_id', 'descendant_id', 'depth'):
+            descendants[ancestor].add((descendant, depth))
+
+        rows = set()
+        for parent, child in edges:
+            above = {(parent, 0)} | ancestors[parent]
+            below = {(child, 0)} | descendants[child]
+
+            for ancestor, ancestor_depth in above:
+                for descendant, descendant_depth in below:
+                    depth = ancestor_depth + 1 + descendant_depth
+                    row = (ancestor, descendant, depth)
+                    if row in rows:
+                        continue
+                    rows.add(row)
+                    # later edges of the batch see the rows of the earlier ones
+                    if descendant in parents:
+                        ancestors[descendant].add((ancestor, depth))
+                    if ancestor in children:
+                        descendants[ancestor].add((descendant, depth))
+
+        PedigreeClosure.objects.bulk_create(
+            [
+                PedigreeClosure(ancestor_id=ancestor, descendant_id=descendant, depth=depth)
+                for ancestor, descendant, depth in rows
+            ],
+            batch_size=self.batch_size,
+            ignore_conflicts=True
+        )
+        return len(rows)
+
+    def rebuild(self):
+        """
+        Rebuilds the edges and the closure from the parentages of the stored animals.
+
+        :return: A tuple of the number of edges and closure rows.
+        """
+        parents = defaultdict(set)
+        for role, relation in ((DAM, 'parentage__dams'), (SIRE, 'parentage__sires')):
+            rows = (
+                Animal.objects
+                .filter(**{f"{relation}__parent_animal_id__isnull": False})
+                .values_list('animal_id', f"{relation}__parent_animal_id")
+            )
+            for animal_id, parent_animal_id in rows.iterator(chunk_size=self.batch_size):
+                if parent_animal_id:
+                    parents[node(animal_id)].add((node(parent_animal_id), role))
+
+        with transaction.atomic():
+            PedigreeClosure.objects.all().delete()
+            PedigreeEdge.objects.all().delete()
+            self.record(parents)
+
+        return PedigreeEdge.objects.count(), PedigreeClosure.objects.count()
+
+
+def closest(queryset, field):
+    """
+    Groups closure rows by the animal in `field`, keeping the shortest depth to it.
+    """
+    return (
+        queryset
+        .values(field)
+        .annotate(generations=Min('depth'))
+        .order_by('generations', field)
+    )
+
+
+def ancestors(animal_id, depth=None):
+    """
+    The ancestors of an animal, up to `depth` generations back.
+
+    :return: A queryset of dicts with the `ancestor_id` of every ancestor and its
+             `generations`, the shortest number of generations to it, closest first.
+    """
+    queryset = PedigreeClosure.objects.filter(descendant_id=node(animal_id))
+    if depth is not None:
+        queryset = queryset.filter(depth__lte=depth)
+    return closest(queryset, 'ancestor_id')
+
+
+def descendants(animal_id, depth=None):
+    """
+    The descendants of an animal, up to `depth` generations down.
+
+    :return: A queryset of dicts with the `descendant_id` of every descendant and its
+             `generations`, closest first.
+    """
+    queryset = PedigreeClosure.objects.filter(ancestor_id=node(animal_id))
+    if depth is not None:
+        queryset = queryset.filter(depth__lte=depth)
+    return closest(queryset, 'descendant_id')
+
+
+def common_ancestors(animal_id, other_animal_id, depth=None):
+    """
+    The ancestors two animals share, up to `depth` generations back from either.
+
+    :return: A queryset of dicts with the `ancestor_id` of every common ancestor and its
+             `generations` from the first animal, closest first.
+    """
+    queryset = PedigreeClosure.objects.filter(descendant_id=node(animal_id))
+    others = PedigreeClosure.objects.filter(descendant_id=node(other_animal_id))
+    if depth is not None:
+        queryset = queryset.filter(depth__lte=depth)
+        others = others.filter(depth__lte=depth)
+
+    return closest(queryset.filter(ancestor_id__in=others.values('ancestor_id')), 'ancestor_id')
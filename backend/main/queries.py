@@ -0,0 +1,230 @@
+from functools import lru_cache
+
+from .registry import registry
+from .selections import ANIMAL_PROJECTIONS, FARM_PROJECTIONS, animal_selection, farm_selection
+
+ANIMAL_ARGUMENT_TYPES = {
+    "farmId": "String!",
+    "filter": "AnimalFilter",
+    "sort": "[AnimalSort!]",
+    "limit": "Int",
+    "skip": "Int",
+    "observationDate": "Timestamp",
+    "_capabilities": "[String]",
+}
+
+ANIMALS_QUERY_TEMPLATE = """
+query animals(
+  $farmId: String!
+  $filter: AnimalFilter
+  $sort: [AnimalSort!]
+  $limit: Int
+  $skip: Int
+  $observationDate: Timestamp
+  $_capabilities: [String]
+) {
+  animals(
+    farmId: $farmId
+    filter: $filter
+    sort: $sort
+    limit: $limit
+    skip: $skip
+    observationDate: $observationDate
+    _capabilities: $_capabilities
+  ) {
+%(selection)s
+  }
+}
+"""
+
+FARMS_QUERY_TEMPLATE = """
+query farms(
+  $farmIds: [String]
+) {
+  farms(
+    farmIds: $farmIds
+  ) {
+%(selection)s
+  }
+}
+"""
+
+ANIMALS_WITH_COUNT_QUERY_TEMPLATE = """
+query animalsWithCount(
+  $farmId: String!
+  $filter: AnimalFilter
+  $sort: [AnimalSort!]
+  $limit: Int
+  $skip: Int
+  $observationDate: Timestamp
+  $_capabilities: [String]
+) {
+  animalsWithCount(
+    farmId: $farmId
+    filter: $filter
+    sort: $sort
+    limit: $limit
+    skip: $skip
+    observationDate: $observationDate
+    _capabilities: $_capabilities
+  ) {
+    animals {
+%(selection)s
+    }
+    count
+    nonPagedCount
+  }
+}
+"""
+
+ANIMALS_QUERIES = {
+    projection: ANIMALS_QUERY_TEMPLATE % {'selection': animal_selection(projection, indent=2)}
+    for projection in ANIMAL_PROJECTIONS
+}
+
+FARMS_QUERIES = {
+    projection: FARMS_QUERY_TEMPLATE % {'selection': farm_selection(projection, indent=2)}
+    for projection in FARM_PROJECTIONS
+}
+
+ANIMALS_WITH_COUNT_QUERIES = {
+    projection: ANIMALS_WITH_COUNT_QUERY_TEMPLATE % {'selection': animal_selection(projection, indent=3)}
+    for projection in ANIMAL_PROJECTIONS
+}
+
+ANIMALS_QUERY = ANIMALS_QUERIES['full']
+FARMS_QUERY = FARMS_QUERIES['full']
+ANIMALS_WITH_COUNT_QUERY = ANIMALS_WITH_COUNT_QUERIES['full']
+
+for _queries in (ANIMALS_QUERIES, FARMS_QUERIES, ANIMALS_WITH_COUNT_QUERIES):
+    for _document in _queries.values():
+        registry.register(_document)
+
+
+def get_query(queries, projection):
+    try:
+        return queries[projection or 'full']
+    except KeyError:
+        raise ValueError(f"Unknown projection '{projection}'")
+
+
+def animal_variables(
+        farm_id,
+        filter=None,
+        sort=None,
+        limit=None,
+        skip=None,
+        observation_date=None,
+        capabilities=None
+):
+    """
+    Builds the variables shared by the `animals` and `animalsWithCount` queries.
+    """
+    return {
+        "farmId": farm_id,
+        "filter": filter,
+        "sort": sort,
+        "limit": limit,
+        "skip": skip,
+        "observationDate": observation_date,
+        "_capabilities": capabilities
+    }
+
+
+def build_animals(farm_id, projection=None, **kwargs):
+    """
+    Builds the `animals` query and its variables.
+
+    :param farm_id: The ID of the farm.
+    :param projection: Named selection set, see selections.ANIMAL_PROJECTIONS (optional).
+    :param kwargs: filter, sort, limit, skip, observation_date and capabilities (optional).
+    :return: A (query, variables) tuple.
+    """
+    return get_query(ANIMALS_QUERIES, projection), animal_variables(farm_id, **kwargs)
+
+
+def build_farms(farm_ids=None, projection=None):
+    """
+    Builds the `farms` query and its variables.
+
+    :param farm_ids: A list of farm IDs to filter by (optional).
+    :param projection: Named selection set, see selections.FARM_PROJECTIONS (optional).
+    :return: A (query, variables) tuple.
+    """
+    return get_query(FARMS_QUERIES, projection), {"farmIds": farm_ids}
+
+
+def build_animals_with_count(farm_id, projection=None, **kwargs):
+    """
+    Builds the `animalsWithCount` query and its variables.
+
+    :param farm_id: The ID of the farm.
+    :param projection: Named selection set, see selections.ANIMAL_PROJECTIONS (optional).
+    :param kwargs: filter, sort, limit, skip, observation_date and capabilities (optional).
+    :return: A (query, variables) tuple.
+    """
+    return get_query(ANIMALS_WITH_COUNT_QUERIES, projection), animal_variables(farm_id, **kwargs)
+
+
+def batch_variable(name, index):
+    return f"{name.lstrip('_')}_{index}"
+
+
+@lru_cache(maxsize=None)
+def build_animals_batch_document(size, projection=None):
+    """
+    Builds the document of `size` aliased `animals` queries, the same document is reused for
+    every batch of that size.
+
+    :return: A (query, aliases) tuple.
+    """
+    selection = animal_selection(projection, indent=2)
+    definitions = []
+    selections = []
+    aliases = []
+
+    for index in range(size):
+        alias = f"a{index}"
+        aliases.append(alias)
+
+        arguments = []
+        for name, argument_type in ANIMAL_ARGUMENT_TYPES.items():
+            variable = batch_variable(name, index)
+            definitions.append(f"  ${variable}: {argument_type}")
+            arguments.append(f"    {name}: ${variable}")
+
+        selections.append(
+            f"  {alias}: animals(\n" + "\n".join(arguments) + "\n  ) {\n" + selection + "\n  }"
+        )
+
+    query = (
+        "\nquery animalsBatch(\n" + "\n".join(definitions) + "\n) {\n"
+        + "\n".join(selections)
+        + "\n}\n"
+    )
+    registry.register(query)
+
+    return query, tuple(aliases)
+
+
+def build_animals_batch(requests, projection=None):
+    """
+    Merges several `animals` queries into one document, each under its own alias with its
+    own set of variables.
+
+    :param requests: A list of dicts with a `farm_id` and optionally filter, sort, limit,
+                     skip, observation_date and capabilities.
+    :param projection: Named selection set, see selections.ANIMAL_PROJECTIONS (optional).
+    :return: A (query, variables, aliases) tuple, aliases are in the order of the requests.
+    """
+    query, aliases = build_animals_batch_document(len(requests), projection)
+    variables = {}
+
+    for index, request in enumerate(requests):
+        options = {key: value for key, value in request.items() if key != 'farm_id'}
+        request_variables = animal_variables(request['farm_id'], **options)
+
+        for name, value in request_variables.items():
+            variables[batch_variable(name, index)] = value
+
+    return query, variables, list(aliases)
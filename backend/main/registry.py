@@ -0,0 +1,140 @@
+import hashlib
+import re
+import threading
+
+from django.conf import settings
+
+PERSISTED_QUERY_NOT_FOUND = 'PERSISTED_QUERY_NOT_FOUND'
+PERSISTED_QUERY_NOT_SUPPORTED = 'PERSISTED_QUERY_NOT_SUPPORTED'
+
+PERSISTED_QUERY_MESSAGES = {
+    'PersistedQueryNotFound': PERSISTED_QUERY_NOT_FOUND,
+    'PersistedQueryNotSupported': PERSISTED_QUERY_NOT_SUPPORTED,
+}
+
+OPERATION_NAME_PATTERN = re.compile(r'^\s*(?:query|mutation|subscription)\s+(\w+)')
+
+
+class PersistedQuery:
+    """
+    A GraphQL document registered under the sha256 hash of its text.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.sha256 = hashlib.sha256(document.encode('utf-8')).hexdigest()
+
+        match = OPERATION_NAME_PATTERN.match(document)
+        self.name = match.group(1) if match else self.sha256[:12]
+
+    def __repr__(self):
+        return f"<PersistedQuery {self.name} {self.sha256[:12]}>"
+
+    def payload(self, variables=None, include_document=True, persisted=False):
+        """
+        Builds the request payload of the query.
+
+        :param variables: The variables for the query, if any.
+        :param include_document: Send the full query text, otherwise only its hash.
+        :param persisted: Add the persisted-query extension so the server stores the query.
+        """
+        payload = {"variables": variables or {}}
+
+        if include_document:
+            payload["query"] = self.document
+        if persisted or not include_document:
+            payload["extensions"] = {
+                "persistedQuery": {
+                    "version": 1,
+                    "sha256Hash": self.sha256,
+                }
+            }
+
+        return payload
+
+
+class QueryRegistry:
+    """
+    Keeps every GraphQL document the AgriWebb clients send, once, under a stable hash.
+
+    With AGRIWEBB_PERSISTED_QUERIES enabled a query goes out with its text the first time
+    so the server stores it, and as its hash only afterwards. A server that lost the query
+    or does not support persisted queries gets the full text again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = {}
+        self.documents = {}
+        self.registered = set()
+        self.unsupported = set()
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __iter__(self):
+        return iter(list(self.queries.values()))
+
+    def register(self, document):
+        """
+        Returns the PersistedQuery of a document, registering it on first use.
+        """
+        query = self.documents.get(document)
+        if query is not None:
+            return query
+
+        with self.lock:
+            query = self.documents.get(document)
+            if query is None:
+                query = PersistedQuery(document)
+                self.queries[query.sha256] = query
+                self.documents[document] = query
+
+        return query
+
+    def get(self, sha256):
+        return self.queries.get(sha256)
+
+    def enabled(self, api_url):
+        """
+        Whether persisted queries are turned on and not refused by the server at `api_url`.
+        """
+        return getattr(settings, 'AGRIWEBB_PERSISTED_QUERIES', False) and api_url not in self.unsupported
+
+    def uses_hash(self, query, api_url):
+        """
+        Whether the query may be sent as its hash only, because the server stored it before.
+        """
+        return self.enabled(api_url) and (api_url, query.sha256) in self.registered
+
+    def stored(self, query, api_url):
+        self.registered.add((api_url, query.sha256))
+
+    def forget(self, query, api_url):
+        self.registered.discard((api_url, query.sha256))
+
+    def refuse(self, api_url):
+        self.unsupported.add(api_url)
+
+
+def persisted_query_error(data):
+    """
+    Returns PERSISTED_QUERY_NOT_FOUND or PERSISTED_QUERY_NOT_SUPPORTED if a GraphQL response
+    rejected a hash-only request, None otherwise.
+    """
+    if not isinstance(data, dict):
+        return None
+
+    for error in data.get('errors') or []:
+        code = (error.get('extensions') or {}).get('code')
+        if code in (PERSISTED_QUERY_NOT_FOUND, PERSISTED_QUERY_NOT_SUPPORTED):
+            return code
+
+        code = PERSISTED_QUERY_MESSAGES.get(error.get('message'))
+        if code:
+            return code
+
+    return None
+
+
+registry = QueryRegistry()
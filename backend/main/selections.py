@@ -0,0 +1,226 @@
+"""
+GraphQL selection sets of the AgriWebb queries.
+
+The trees below are built from the `mapping.Mapping` specs the ingest stores payloads
+with, plus the few keys it reads directly, e.g. the natural keys of the rows, so the
+queries request exactly the keys that are persisted. A key maps to None for a scalar or
+to a nested tree for an object. Keys of the form "alias: field" query `field` but return
+it under the key the ingest code reads. Projections prune a tree down to a few dotted
+paths so lightweight syncs only transfer what they store.
+"""
+
+from . import mapping
+
+# payload keys the ingest reads under another name than the API field
+ALIASES = {
+    'LastSeen': 'lastSeen',
+    'agriId': 'id',
+}
+
+
+def selection_key(key):
+    """
+    Returns the selection of a payload key, aliased when the API field is named otherwise.
+    """
+    return f"{key}: {ALIASES[key]}" if key in ALIASES else key
+
+
+def tree(*mappings, keys=(), **nested):
+    """
+    Builds a selection tree.
+
+    :param mappings: Mappings whose payload keys are selected as scalars.
+    :param keys: Other scalar payload keys the ingest reads.
+    :param nested: Payload key to the selection tree of a nested object.
+    """
+    selection = {}
+    for key in keys:
+        selection[selection_key(key)] = None
+    for spec in mappings:
+        for key in spec.spec.values():
+            selection[selection_key(key)] = None
+    for key, subtree in nested.items():
+        selection[selection_key(key)] = subtree
+    return selection
+
+
+PARENT = tree(
+    keys=('parentAnimalId', 'parentType'),
+    parentAnimalIdentity=tree(mapping.PARENT_ANIMAL_IDENTITY),
+)
+
+ANIMAL_TREE = tree(
+    mapping.ANIMAL,
+    keys=('animalId',),
+    identity=tree(
+        mapping.ANIMAL_IDENTITY,
+        tags=tree(mapping.ANIMAL_TAG, keys=('id',)),
+    ),
+    characteristics=tree(
+        mapping.ANIMAL_CHARACTERISTICS,
+        birthDateConfidence=tree(mapping.DATE_CONFIDENCE),
+    ),
+    parentage={
+        'sires': PARENT,
+        'dams': PARENT,
+        'surrogate': PARENT,
+    },
+    state=tree(
+        mapping.ANIMAL_STATE,
+        weights=tree(
+            keys=('liveWeightDate',),
+            liveAverageDailyGain=tree(mapping.WEIGHT_GAIN),
+            overallAverageDailyGain=tree(mapping.WEIGHT_GAIN),
+            assumedAverageDailyGain=tree(mapping.WEIGHT_GAIN),
+            liveWeight=tree(mapping.WEIGHT),
+            estimatedWeight=tree(mapping.WEIGHT),
+        ),
+        bodyConditionScore=tree(mapping.CONDITION_SCORE),
+        animalUnits=tree(mapping.ANIMAL_UNIT),
+    ),
+    enterprise=tree(mapping.ENTERPRISE, keys=('enterpriseId',)),
+    managementGroup=tree(mapping.MANAGEMENT_GROUP, keys=('managementGroupId',)),
+    records=tree(mapping.ANIMAL_RECORD, keys=('recordId',)),
+)
+
+GEO_POINT = tree(mapping.GEO_POINT)
+
+# the coordinates are read as a whole by mapping.to_geometry
+GEOMETRY = tree(mapping.GEO_FEATURE, keys=('coordinates',))
+
+IDENTIFIER = tree(mapping.EXTERNAL_IDENTIFIER)
+
+FARM_TREE = tree(
+    mapping.FARM,
+    keys=('id',),
+    address=tree(mapping.ADDRESS, location=GEO_POINT),
+    mapFeatures=tree(
+        mapping.MAP_FEATURE,
+        keys=('id',),
+        geometry=GEOMETRY,
+        alert=tree(mapping.CAPACITY_ALERT),
+        capacity=tree(mapping.CAPACITY),
+    ),
+    fields=tree(
+        mapping.FIELD,
+        keys=('agriId',),
+        location=GEO_POINT,
+        geometry=GEOMETRY,
+        identifiers=IDENTIFIER,
+    ),
+    identifiers=IDENTIFIER,
+)
+
+ANIMAL_PROJECTIONS = {
+    'full': None,
+    'identity': (
+        'animalId',
+        'identity',
+    ),
+    'state_weights': (
+        'animalId',
+        '_observationDate',
+        'state.onFarm',
+        'state.currentLocationId',
+        'state.weights',
+        'state.bodyConditionScore',
+        'state.bodyConditionScoreDate',
+        'state.animalUnits',
+    ),
+}
+
+FARM_PROJECTIONS = {
+    'full': None,
+    'identity': (
+        'id',
+        'name',
+        'timeZone',
+    ),
+    'fields': (
+        'id',
+        'fields',
+    ),
+}
+
+
+def response_key(key):
+    """
+    Returns the key a selection comes back under, the alias if it has one.
+    """
+    return key.split(':', 1)[0].strip()
+
+
+def project(tree, paths):
+    """
+    Prunes a selection tree down to the given dotted paths, a path to an object keeps the
+    whole object.
+
+    :param tree: Selection tree.
+    :param paths: Iterable of dotted response keys, None keeps the whole tree.
+    :return: The pruned selection tree.
+    """
+    if paths is None:
+        return tree
+
+    nested = {}
+    for path in paths:
+        head, _, rest = path.partition('.')
+        nested.setdefault(head, []).append(rest or None)
+
+    projected = {}
+    for key, subtree in tree.items():
+        name = response_key(key)
+        if name not in nested:
+            continue
+
+        rests = nested[name]
+        if subtree is None or None in rests:
+            projected[key] = subtree
+        else:
+            projected[key] = project(subtree, rests)
+
+    unknown = set(nested) - {response_key(key) for key in tree}
+    if unknown:
+        raise ValueError(f"Unknown selection path(s): {', '.join(sorted(unknown))}")
+
+    return projected
+
+
+def render(tree, indent=0):
+    """
+    Renders a selection tree as the body of a GraphQL selection set.
+    """
+    padding = '  ' * indent
+    lines = []
+
+    for key, subtree in tree.items():
+        if subtree is None:
+            lines.append(f"{padding}{key}")
+        else:
+            lines.append(f"{padding}{key} {{")
+            lines.append(render(subtree, indent + 1))
+            lines.append(f"{padding}}}")
+
+    return '\n'.join(lines)
+
+
+def animal_selection(projection=None, indent=0):
+    """
+    Renders the animal selection set of a named projection (full, identity, state_weights).
+    """
+    try:
+        paths = ANIMAL_PROJECTIONS[projection or 'full']
+    except KeyError:
+        raise ValueError(f"Unknown animal projection '{projection}'")
+    return render(project(ANIMAL_TREE, paths), indent)
+
+
+def farm_selection(projection=None, indent=0):
+    """
+    Renders the farm selection set of a named projection (full, identity, fields).
+    """
+    try:
+        paths = FARM_PROJECTIONS[projection or 'full']
+    except KeyError:
+        raise ValueError(f"Unknown farm projection '{projection}'")
+    return render(project(FARM_TREE, paths), indent)
@@ -0,0 +1,168 @@
+import numpy
+import shapely
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .ingest import chunked
+from .models import Farm, Field, GeoFeature
+
+DATABASE = 'database'
+MEMORY = 'memory'
+
+
+def gis_enabled(using=DEFAULT_DB_ALIAS):
+    """
+    Whether the database is spatial, e.g. PostGIS, and can use the spatial index of
+    GeoFeature.coordinates.
+    """
+    return getattr(connections[using].features, 'gis_enabled', False)
+
+
+def split(points):
+    """
+    Splits (lat, long) points into numpy arrays of latitudes and longitudes.
+    """
+    coordinates = numpy.asarray(points, dtype=float).reshape(-1, 2)
+    return coordinates[:, 0], coordinates[:, 1]
+
+
+class FieldResolver:
+    """
+    Resolves GPS points to the fields that contain them.
+
+    On a spatial database a batch of points is resolved with one query that unnests the
+    points and joins them to the field geometries through their GiST index. Otherwise the
+    field geometries are loaded once into an in-memory STR-tree, which a batch of points
+    queries in one vectorized call. A point on several overlapping fields resolves to the
+    smallest one, a point on none of them to None.
+    """
+
+    def __init__(self, farm_id=None, backend=None, batch_size=None, using=DEFAULT_DB_ALIAS):
+        """
+        :param farm_id: Only resolve to the fields of this farm, by its AgriWebb ID (optional).
+        :param backend: DATABASE or MEMORY, defaults to AGRIWEBB_SPATIAL_BACKEND and to
+                        DATABASE when the database is spatial.
+        :param batch_size: Points per query, defaults to AGRIWEBB_SPATIAL_BATCH_SIZE.
+        :param using: The database alias.
+        """
+        self.farm_id = farm_id
+        self.using = using
+        self.batch_size = batch_size or getattr(settings, 'AGRIWEBB_SPATIAL_BATCH_SIZE', 10000)
+        backend = backend or getattr(settings, 'AGRIWEBB_SPATIAL_BACKEND', None)
+        if not backend:
+            backend = DATABASE if gis_enabled(using) else MEMORY
+        self.backend = backend
+        self.tree = None
+        self.field_ids = None
+        self.areas = None
+
+    def resolve(self, points):
+        """
+        :param points: An iterable of (lat, long) pairs in WGS 84.
+        :return: The AgriWebb ID of the field containing every point or None, in the order
+                 of the points.
+        """
+        resolved = []
+        for chunk in chunked(points, self.batch_size):
+            if self.backend == DATABASE:
+                resolved.extend(self.resolve_in_database(chunk))
+            else:
+                resolved.extend(self.resolve_in_memory(chunk))
+        return resolved
+
+    def fields(self):
+        queryset = Field.objects.using(self.using).filter(geometry__coordinates__isnull=False)
+        if self.farm_id is not None:
+            queryset = queryset.filter(farm__agri_id=self.farm_id)
+        return queryset
+
+    def resolve_in_database(self, points):
+        lats, longs = split(points)
+        connection = connections[self.using]
+        quote = connection.ops.quote_name
+
+        field_table = quote(Field._meta.db_table)
+        feature_table = quote(GeoFeature._meta.db_table)
+        agri_id = quote(Field._meta.get_field('agri_id').column)
+        geometry = quote(Field._meta.get_field('geometry').column)
+        coordinates = quote(GeoFeature._meta.get_field('coordinates').column)
+        params = [lats.tolist(), longs.tolist()]
+
+        farm_join = ''
+        if self.farm_id is not None:
+            through = Farm.fields.through
+            farm_join = (
+                f"JOIN {quote(through._meta.db_table)} farm_fields "
+                f"ON farm_fields.{quote(Farm.fields.field.m2m_reverse_name())} = fields.{quote(Field._meta.pk.column)} "
+                f"JOIN {quote(Farm._meta.db_table)} farms "
+                f"ON farms.{quote(Farm._meta.pk.column)} = farm_fields.{quote(Farm.fields.field.m2m_column_name())} "
+                f"AND farms.{quote(Farm._meta.get_field('agri_id').column)} = %s"
+            )
+            params.append(self.farm_id)
+
+        # ST_Covers filters through the index with && before testing the polygons
+        sql = (
+            f"SELECT DISTINCT ON (points.ordinality) points.ordinality, fields.{agri_id} "
+            f"FROM unnest(%s::double precision[], %s::double precision[]) WITH ORDINALITY "
+            f"AS points(lat, long, ordinality) "
+            f"JOIN {feature_table} features ON ST_Covers("
+            f"features.{coordinates}, ST_SetSRID(ST_MakePoint(points.long, points.lat), 4326)) "
+            f"JOIN {field_table} fields ON fields.{geometry} = features.{quote(GeoFeature._meta.pk.column)} "
+            f"{farm_join} "
+            f"ORDER BY points.ordinality, ST_Area(features.{coordinates})"
+        )
+
+        resolved = [None] * len(points)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            for ordinality, field_id in cursor.fetchall():
+                resolved[ordinality - 1] = field_id
+        return resolved
+
+    def build(self):
+        """
+        Loads the field geometries into the in-memory STR-tree, see refresh.
+        """
+        field_ids = []
+        geometries = []
+        for field_id, coordinates in self.fields().values_list('agri_id', 'geometry__coordinates').iterator():
+            field_ids.append(field_id)
+            geometries.append(bytes(coordinates.wkb))
+
+        geometries = shapely.from_wkb(geometries) if geometries else numpy.empty(0, dtype=object)
+        self.field_ids = numpy.asarray(field_ids, dtype=object)
+        self.areas = shapely.area(geometries)
+        self.tree = shapely.STRtree(geometries)
+
+    def refresh(self):
+        """
+        Drops the in-memory STR-tree, the next batch loads the current field geometries.
+        """
+        self.tree = None
+
+    def resolve_in_memory(self, points):
+        if self.tree is None:
+            self.build()
+
+        lats, longs = split(points)
+        resolved = numpy.full(len(lats), None, dtype=object)
+        if not len(self.field_ids):
+            return resolved.tolist()
+
+        point_index, field_index = self.tree.query(shapely.points(longs, lats), predicate='covered_by')
+        if len(point_index):
+            # the smallest field of every point comes first
+            order = numpy.lexsort((self.areas[field_index], point_index))
+            point_index, field_index = point_index[order], field_index[order]
+            first = numpy.unique(point_index, return_index=True)[1]
+            resolved[point_index[first]] = self.field_ids[field_index[first]]
+
+        return resolved.tolist()
+
+
+def resolve_points(points, farm_id=None, backend=None):
+    """
+    Resolves (lat, long) points to the AgriWebb IDs of the fields containing them, see
+    FieldResolver.
+    """
+    return FieldResolver(farm_id=farm_id, backend=backend).resolve(points)
@@ -0,0 +1,64 @@
+import ijson
+
+from .exceptions import AgriWebbGraphQLError
+
+
+class GraphQLStream:
+    """
+    Incrementally parses a (possibly gzip or brotli compressed) GraphQL response and yields
+    the objects of one list, e.g. `animals` or `animalsWithCount.animals`, one at a time.
+
+    Only the object being parsed is held in memory. Scalars found next to the list, such as
+    `animalsWithCount.nonPagedCount`, are collected in `values` keyed by their path under
+    `data`, and GraphQL errors are raised once the body was read.
+    """
+
+    def __init__(self, response, items_path):
+        """
+        :param response: A requests response opened with `stream=True`.
+        :param items_path: Dotted path of the list under `data`, e.g. "animals".
+        """
+        self.response = response
+        self.items_path = items_path
+        self.item_prefix = f"data.{items_path}.item"
+        self.values = {}
+        self.errors = []
+        self.count = 0
+
+    def __iter__(self):
+        raw = self.response.raw
+        raw.decode_content = True
+
+        item = None
+        error = None
+
+        try:
+            for prefix, event, value in ijson.parse(raw, use_float=True):
+                if item is not None:
+                    item.event(event, value)
+                    if prefix == self.item_prefix and event == 'end_map':
+                        self.count += 1
+                        yield item.value
+                        item = None
+                    continue
+
+                if error is not None:
+                    error.event(event, value)
+                    if prefix == 'errors' and event == 'end_array':
+                        self.errors = error.value
+                        error = None
+                    continue
+
+                if prefix == self.item_prefix and event == 'start_map':
+                    item = ijson.ObjectBuilder()
+                    item.event(event, value)
+                elif prefix == 'errors' and event == 'start_array':
+                    error = ijson.ObjectBuilder()
+                    error.event(event, value)
+                elif prefix.startswith('data.') and event in ('number', 'string', 'boolean', 'null'):
+                    self.values[prefix[len('data.'):]] = value
+        finally:
+            self.response.close()
+
+        if self.errors:
+            raise AgriWebbGraphQLError(f"GraphQL Error: {self.errors}", errors=self.errors)
@@ -0,0 +1,222 @@
+import logging
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from .checkpoints import CheckpointedIngest
+from .exceptions import AnimalSyncInProgressError
+from .fingerprints import digest
+from .mapping import from_timestamp
+from .models import Animal, AnimalSyncWatermark, IngestRun
+
+logger = logging.getLogger(__name__)
+
+FULL = 'full'
+INCREMENTAL = 'incremental'
+
+
+def to_timestamp(value):
+    """
+    Converts a datetime to the UTC unix epoch in milliseconds the AgriWebb API uses.
+    """
+    return int(value.timestamp() * 1000)
+
+
+def incremental_filter(watermark, filter=None):
+    """
+    Extends an animal filter to the animals observed since the watermark.
+
+    The window reaches back AGRIWEBB_INCREMENTAL_OVERLAP seconds before the watermark so
+    observations written late or with a skewed clock are not missed, re-storing a few
+    animals twice is harmless.
+    """
+    field = getattr(settings, 'AGRIWEBB_INCREMENTAL_FILTER_FIELD', '_observationDate')
+    overlap = getattr(settings, 'AGRIWEBB_INCREMENTAL_OVERLAP', 300)
+
+    since = watermark - timezone.timedelta(seconds=overlap)
+
+    return {**(filter or {}), field: {'_gte': to_timestamp(since)}}
+
+
+def lock_key(farm_id):
+    """
+    The key of the advisory lock of a farm, a signed 64 bit integer.
+    """
+    key = int(digest(['animal_sync', farm_id])[:16], 16)
+    return key - 2 ** 64 if key >= 2 ** 63 else key
+
+
+@contextmanager
+def farm_lock(farm_id, using=DEFAULT_DB_ALIAS):
+    """
+    Holds the PostgreSQL session advisory lock of a farm, so two syncs of the same farm do
+    not interleave without keeping a transaction open while the herd is fetched.
+
+    :raises AnimalSyncInProgressError: When another sync of the farm holds the lock.
+    """
+    connection = connections[using]
+    key = lock_key(farm_id)
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [key])
+        if not cursor.fetchone()[0]:
+            raise AnimalSyncInProgressError(f"The animals of farm {farm_id} are already being synced")
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [key])
+
+
+def deletion_skip_reason(farm_id, seen, non_paged_count):
+    """
+    Checks that a full walk saw the whole herd before the animals it did not see are
+    deleted. An empty or short walk, e.g. a token without access to the herd or a walk
+    that ended early, would otherwise delete every animal it missed.
+
+    :param seen: The IDs of the animals the walk returned.
+    :param non_paged_count: The number of animals AgriWebb reported for the query, None if unknown.
+    :return: Why the deletion is skipped, None when it is safe.
+    """
+    if not seen:
+        return "the full sync returned no animals"
+    if non_paged_count is not None and len(seen) < non_paged_count:
+        return f"the full sync returned {len(seen)} of {non_paged_count} animals"
+
+    stored = Animal.objects.filter(farm_id=farm_id)
+    total = stored.count()
+    missing = stored.exclude(animal_id__in=seen).count()
+    max_fraction = getattr(settings, 'AGRIWEBB_FULL_SYNC_MAX_DELETE_FRACTION', 0.2)
+    if total and missing / total > max_fraction:
+        return f"the full sync would delete {missing} of {total} animals, more than {max_fraction:.0%}"
+
+    return None
+
+
+def sync_farm_animals(agriwebb, token_id, farm_id, full=None, filter=None, page_size=None, stream=None):
+    """
+    Syncs the animals of a farm from its watermark.
+
+    An incremental sync only fetches the animals observed since the last stored
+    observation. A full sync walks the whole herd and removes the animals AgriWebb no
+    longer returns, it runs when the farm has no watermark yet, when its last full sync is
+    older than AGRIWEBB_FULL_SYNC_INTERVAL seconds or when `full` is set. The animals are
+    only removed when the walk returned the `nonPagedCount` AgriWebb reports and would not
+    remove more than AGRIWEBB_FULL_SYNC_MAX_DELETE_FRACTION of the stored herd, otherwise
+    the removal is skipped and logged, and the next sync is a full one again.
+
+    The animals are committed a chunk at a time and the ones that fail to store are
+    quarantined, see checkpoints.CheckpointedIngest. The watermark does not move past a
+    quarantined animal, so the next incremental sync fetches it again. Syncs of the same farm are
+    serialized by an advisory lock, see farm_lock.
+
+    :param agriwebb: AgriWebb client.
+    :param token_id: ID of the token stored in the database.
+    :param farm_id: The ID of the farm.
+    :param full: Force (True) or skip (False) the full reconciliation, defaults to the schedule.
+    :param filter: Additional filter criteria (optional). A filtered sync only sees part of the
+                   herd, so it neither removes animals nor moves the watermark.
+    :param page_size: Size of the first page, defaults to AGRIWEBB_PAGE_SIZE (optional).
+    :param stream: Parse the responses one animal at a time, defaults to AGRIWEBB_STREAM_RESPONSES.
+    :return: A dict with the sync mode, the number of fetched and deleted animals, why the
+             removal was skipped, the new watermark, the number of quarantined animals
+             and the ingest stats.
+    """
+    if stream is None:
+        stream = getattr(settings, 'AGRIWEBB_STREAM_RESPONSES', False)
+
+    interval = getattr(settings, 'AGRIWEBB_FULL_SYNC_INTERVAL', 24 * 60 * 60)
+
+    with farm_lock(farm_id):
+        state, _ = AnimalSyncWatermark.objects.get_or_create(farm_id=farm_id)
+
+        if full is None:
+            full = state.needs_full_sync(interval)
+        elif not full and state.watermark is None:
+            full = True
+
+        mode = FULL if full else INCREMENTAL
+        query_filter = filter if full else incremental_filter(state.watermark, filter)
+
+        # the full walk reads the count of the herd along with the animals
+        iter_animals = agriwebb.iter_animals_with_count if full else agriwebb.iter_animals
+        animals = iter_animals(
+            token_id,
+            farm_id,
+            filter=query_filter,
+            page_size=page_size,
+            stream=stream
+        )
+
+        seen = set()
+        watermark = state.watermark
+        observations = {}
+        held_back = None
+
+        def observe(animals):
+            for animal in animals:
+                # quarantined animals are still in the herd, they are not removed
+                seen.add(animal['animalId'])
+
+                observed = from_timestamp(animal.get('_observationDate'))
+                if observed is not None:
+                    observations[str(animal['animalId'])] = observed
+                yield animal
+
+        def advance(stored):
+            # only stored animals move the watermark, and never past a quarantined
+            # animal so the next incremental sync fetches it again
+            nonlocal watermark, held_back
+            for animal in stored:
+                observed = observations.pop(str(animal.animal_id), None)
+                if observed is not None and (watermark is None or observed > watermark):
+                    watermark = observed
+            for observed in observations.values():
+                if held_back is None or observed < held_back:
+                    held_back = observed
+            observations.clear()
+
+        # a failed sync is not resumed, the watermark only moves once the walk is complete
+        # so the next sync fetches the same window again
+        checkpoint = CheckpointedIngest(
+            farm_id,
+            IngestRun.Kind.ANIMALS_WITH_COUNT if full else IngestRun.Kind.ANIMALS,
+            {'sync': mode, 'filter': query_filter},
+            resume=False
+        )
+        with checkpoint.running() as run:
+            checkpoint.ingest_all(observe(animals), on_chunk=advance)
+
+        if held_back is not None and watermark is not None and held_back < watermark:
+            watermark = held_back
+
+        deleted = 0
+        skipped = None
+        if filter is None:
+            if full:
+                skipped = deletion_skip_reason(farm_id, seen, animals.non_paged_count)
+                if skipped:
+                    logger.warning("Not removing the missing animals of farm %s: %s", farm_id, skipped)
+                else:
+                    _, deleted_by_model = Animal.objects.filter(farm_id=farm_id).exclude(animal_id__in=seen).delete()
+                    deleted = deleted_by_model.get(Animal._meta.label, 0)
+
+            now = timezone.now()
+            state.watermark = watermark
+            state.last_synced_count = len(seen)
+            state.last_incremental_sync_at = now
+            if full and not skipped:
+                state.last_full_sync_at = now
+            state.save()
+
+    return {
+        'mode': mode,
+        'fetched': len(seen),
+        'deleted': deleted,
+        'deletion_skipped': skipped,
+        'watermark': watermark,
+        'quarantined': run.quarantined_count,
+        'ingest': checkpoint.stats.as_dict(),
+    }
@@ -3,14 +3,44 @@ import os
 from datetime import datetime
 
 from django.conf import settings
-from django.db import transaction
+from django.core.serializers.json import DjangoJSONEncoder
 from celery import shared_task
 
-from .helpers import populate_animal
-from .models import Farm, Address, GeoPoint, MapFeature, GeoFeature, CapacityAlert, Capacity, Field, \
-    ExternalIdentifier, AnimalCount
+from .checkpoints import CheckpointedIngest
+from .compaction import compact_orphans
+from .dryrun import diff_animals, diff_farms
+from .farms import FarmIngest
+from .ingest import AnimalIngest
+from .links import LinkSetWriter
+from .parallel import CELERY, ingest_partition, parallel_ingest
+from .models import AnimalCount, IngestRun
 
 from .agriwebb import AgriWebb
+from .agriwebb_async import fetch_organization_animals
+from .batching import AnimalQueryBatcher
+from .sync import sync_farm_animals
+
+
+def dry_run_detail(changes, name):
+    """
+    Writes the changed rows of a detailed dry run to a JSON file next to the fetched data.
+
+    :return: A note with the path of the file, or an empty string without detail.
+    """
+    if not changes.detail:
+        return ""
+
+    filename = f"dry_run_{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    folder_path = os.path.join(settings.BASE_DIR, "agriwebb", "data")
+
+    os.makedirs(folder_path, exist_ok=True)
+
+    path = os.path.join(folder_path, filename)
+
+    with open(path, 'w') as json_file:
+        json.dump(changes.as_dict(), json_file, indent=4, cls=DjangoJSONEncoder)
+
+    return f" (rows in {path})"
 
 
 @shared_task
@@ -68,31 +98,189 @@ def fetch_and_store_animals_data(
         limit=None,
         skip=None,
         observation_date=None,
-        capabilities=None
+        capabilities=None,
+        page_size=None,
+        stream=None,
+        resume=True,
+        dry_run=False,
+        detail=False
 ):
     """
     Fetches the animal data from AgriWebb API and stores it in the Django model.
+
+    Without an explicit `limit` every page is walked and the animals are stored as they
+    arrive, `page_size` sets the size of the first page. With `stream` (defaults to
+    AGRIWEBB_STREAM_RESPONSES) the responses are parsed one animal at a time.
+
+    The animals are committed in chunks of AGRIWEBB_INGEST_CHUNK_SIZE, a failed or killed
+    task called again with the same arguments resumes after the last committed chunk
+    unless `resume` is off. Resuming needs a `sort` so the animals come back in the same
+    order, without one the task starts over. Animals that fail to store are quarantined.
+
+    With `dry_run` nothing is written, the task returns what storing the animals would
+    change per model, see dryrun.AnimalDryRun, and with `detail` it also writes the
+    changed rows to a JSON file.
     """
     try:
         agriwebb = AgriWebb()
 
-        animals_data = agriwebb.animals(
+        if stream is None:
+            stream = getattr(settings, 'AGRIWEBB_STREAM_RESPONSES', False)
+
+        if dry_run:
+            animals = agriwebb.iter_animals(
+                token_id,
+                farm_id,
+                filter=filter,
+                sort=sort,
+                skip=skip,
+                observation_date=observation_date,
+                capabilities=capabilities,
+                page_size=page_size,
+                stream=stream
+            ) if limit is None else agriwebb.animals(
+                token_id,
+                farm_id,
+                filter=filter,
+                sort=sort,
+                limit=limit,
+                skip=skip,
+                observation_date=observation_date,
+                capabilities=capabilities
+            )['animals']
+
+            # only an unfiltered walk of every page sees the animals that were removed
+            complete = limit is None and not filter and not skip and not observation_date
+            changes = diff_animals(animals, farm_id, detail=detail, complete=complete)
+            return f"Dry run of animal data for farm {farm_id}: {changes}{dry_run_detail(changes, farm_id)}"
+
+        checkpoint = CheckpointedIngest(
+            farm_id,
+            IngestRun.Kind.ANIMALS,
+            {
+                'filter': filter,
+                'sort': sort,
+                'limit': limit,
+                'skip': skip,
+                'observation_date': observation_date,
+                'capabilities': capabilities,
+            },
+            resume=resume
+        )
+
+        with checkpoint.running() as run:
+            skip = (skip or 0) + run.committed_offset
+
+            if limit is None:
+                animals = agriwebb.iter_animals(
+                    token_id,
+                    farm_id,
+                    filter=filter,
+                    sort=sort,
+                    skip=skip,
+                    observation_date=observation_date,
+                    capabilities=capabilities,
+                    page_size=page_size,
+                    stream=stream
+                )
+            elif limit > run.committed_offset:
+                animals = agriwebb.animals(
+                    token_id,
+                    farm_id,
+                    filter=filter,
+                    sort=sort,
+                    limit=limit - run.committed_offset,
+                    skip=skip,
+                    observation_date=observation_date,
+                    capabilities=capabilities,
+                    stream=stream
+                )
+                if not stream:
+                    animals = animals['animals']
+            else:
+                animals = []
+
+            checkpoint.ingest_all(animals)
+
+        return (
+            f"Successfully fetched and stored animal data for farm {farm_id}: {checkpoint.stats}, "
+            f"{run.quarantined_count} quarantined"
+        )
+    except Exception as e:
+        return f"An error occurred while fetching and storing animals data: {e}"
+
+
+@shared_task
+def fetch_and_store_animals_data_parallel(
+        token_id,
+        farm_id,
+        filter=None,
+        sort=None,
+        observation_date=None,
+        capabilities=None,
+        page_size=None,
+        stream=None,
+        partitions=None
+):
+    """
+    Fetches every animal of a farm from AgriWebb API and stores them from a Celery subtask
+    per hash partition of the herd, see parallel.parallel_ingest.
+    """
+    try:
+        agriwebb = AgriWebb()
+
+        if stream is None:
+            stream = getattr(settings, 'AGRIWEBB_STREAM_RESPONSES', False)
+
+        animals = agriwebb.iter_animals(
             token_id,
             farm_id,
             filter=filter,
             sort=sort,
-            limit=limit,
-            skip=skip,
             observation_date=observation_date,
-            capabilities=capabilities
+            capabilities=capabilities,
+            page_size=page_size,
+            stream=stream
         )
-        with transaction.atomic():
-            for animal in animals_data['animals']:
-                populate_animal(animal, farm_id)
 
-            return f"Successfully fetched and stored animal data for farm {farm_id}"
+        result = parallel_ingest(animals, farm_id, partitions=partitions, mode=CELERY)
+
+        return f"Successfully fetched animal data for farm {farm_id}, storing it in group {result.id}"
     except Exception as e:
-        return f"An error occurred while fetching and storing animals data: {e}"
+        return f"An error occurred while fetching and storing animals data in parallel: {e}"
+
+
+@shared_task
+def ingest_animal_partition(batch_id, index, chunk_size=None):
+    """
+    Stores one staged hash partition of a herd, see parallel.parallel_ingest.
+    """
+    return ingest_partition(batch_id, index, chunk_size)
+
+
+@shared_task
+def sync_animals_data(token_id, farm_id, full=None, page_size=None, stream=None):
+    """
+    Syncs the animal data of a farm from its watermark, only fetching the animals observed
+    since the last sync and periodically reconciling the whole herd to drop deleted animals.
+    """
+    try:
+        stats = sync_farm_animals(
+            AgriWebb(),
+            token_id,
+            farm_id,
+            full=full,
+            page_size=page_size,
+            stream=stream
+        )
+
+        skipped = f" (removal skipped: {stats['deletion_skipped']})" if stats['deletion_skipped'] else ""
+        return (
+            f"Successfully synced animal data for farm {farm_id} ({stats['mode']}): "
+            f"{stats['fetched']} stored, {stats['quarantined']} quarantined, {stats['deleted']} removed{skipped}"
+        )
+    except Exception as e:
+        return f"An error occurred while syncing animals data: {e}"
 
 
 @shared_task
@@ -124,140 +312,32 @@ def fetch_and_store_farm_data_to_json(token_id, farm_ids=None):
 
 
 @shared_task
-def fetch_and_store_farm_data(token_id, farm_ids=None):
+def fetch_and_store_farm_data(token_id, farm_ids=None, dry_run=False, detail=False):
     """
     Fetches farm data from the AgriWebb API and stores it in the Django models.
+
+    With `dry_run` nothing is written, the task returns what storing the farms would
+    change per model, see dryrun.FarmDryRun, and with `detail` it also writes the changed
+    rows to a JSON file.
     """
     try:
         agriwebb = AgriWebb()
 
         farms_data = agriwebb.farms(token_id, farm_ids=farm_ids)
 
-        with transaction.atomic():
-            for farm in farms_data['farms']:
-                if farm.get('address'):
-                    address_data = farm['address']
-                    geo_point = address_data.get('location', {})
-                    geo_point_obj, _ = GeoPoint.objects.update_or_create(
-                        lat=geo_point.get('lat', None),
-                        long=geo_point.get('long', None)
-                    )
-
-                    address_obj, _ = Address.objects.update_or_create(
-                        country=address_data.get('country', ''),
-                        postcode=address_data.get('postcode', ''),
-                        town=address_data.get('town', ''),
-                        state=address_data.get('state', ''),
-                        address1=address_data.get('address1', ''),
-                        address2=address_data.get('address2', ''),
-                        location=geo_point_obj,
-                    )
-                else:
-                    address_obj = None
-
-                farm_obj, created = Farm.objects.update_or_create(
-                    agri_id=farm['id'],
-                    defaults={
-                        'name': farm.get('name', ''),
-                        'time_zone': farm.get('timeZone', ''),
-                        'address': address_obj,
-                        'fields': farm.get('fields', []),
-                    }
-                )
+        if dry_run:
+            changes = diff_farms(farms_data['farms'], detail=detail)
+            return f"Dry run of farm data for farm(s) {farm_ids}: {changes}{dry_run_detail(changes, 'farms')}"
+
+        ingest = FarmIngest()
+        ingest.ingest(farms_data['farms'])
+        stats = ingest.stats
 
-                map_features_data = farm.get('mapFeatures', [])
-                for map_feature in map_features_data:
-                    geometry_data = map_feature.get('geometry', {})
-
-                    geometry_obj, _ = GeoFeature.objects.update_or_create(
-                        type=geometry_data.get('type', ''),
-                        coordinates=geometry_data.get('coordinates', ''),
-                    )
-
-                    alert_data = map_feature.get('alert', {})
-
-                    alert_obj, _ = CapacityAlert.objects.update_or_create(
-                        critical=alert_data.get('critical', ''),
-                        warning=alert_data.get('warning', ''),
-                    )
-
-                    capacity_data = map_feature.get('capacity', {})
-
-                    capacity_obj, _ = Capacity.objects.update_or_create(
-                        mode=capacity_data.get('mode', ''),
-                        value=capacity_data.get('value', ''),
-                        unit=capacity_data.get('unit', ''),
-                    )
-
-                    map_feature_obj, _ = MapFeature.objects.update_or_create(
-                        uu_id=map_feature.get('id', ''),
-                        defaults={
-                            "name": map_feature.get('name', ''),
-                            "description": map_feature.get('description', ''),
-                            "farm_id": map_feature.get('farmId', ''),
-                            "type": map_feature.get('type', ''),
-                            "identifier": map_feature.get('identifier', ''),
-                            "geometry": geometry_obj,
-                            "alert": alert_obj,
-                            "capacity": capacity_obj,
-                        }
-                    )
-                    farm_obj.map_features.add(map_feature_obj)
-
-                fields_data = farm.get('fields', [])
-
-                for field in fields_data:
-                    location_data = field.get('location', {})
-                    location_obj, _ = GeoPoint.objects.update_or_create(
-                        lat=location_data.get('lat', ''),
-                        long=location_data.get('long', ''),
-                    )
-
-                    geometry_data = field.get('geometry', {})
-
-                    geometry_obj, _ = GeoFeature.objects.update_or_create(
-                        type=geometry_data.get('type', ''),
-                        coordinates=geometry_data.get('coordinates', ''),
-                    )
-
-                    field_obj, _ = Field.objects.update_or_create(
-                        agri_id=field.get('agriId'),
-                        defaults={
-                            'farm_id': field.get('farmId', ''),
-                            'name': field.get('name', ''),
-                            'total_area': field.get('totalArea', 0),
-                            'grazable_area': field.get('grazableArea', 0),
-                            'unit': field.get('unit', 'hectare'),
-                            'land_use': field.get('landUse', ''),
-                            'crop_type': field.get('cropType', ''),
-                            'creation_date': field.get('creationDate', ''),
-                            'last_modified_date': field.get('lastModifiedDate', ''),
-                            'location': location_obj,
-                            'geometry': geometry_obj,
-                        }
-                    )
-
-                    identifiers_data = field.get('identifiers', [])
-
-                    for identifier in identifiers_data:
-                        identifier_obj, _ = ExternalIdentifier.objects.update_or_create(
-                            type=identifier.get('type', ''),
-                            value=identifier.get('value', []),
-                        )
-                        field_obj.identifiers.add(identifier_obj)
-
-                    farm_obj.fields.add(field_obj)
-
-                identifier_data = farm.get('identifiers', [])
-
-                for identifier in identifier_data:
-                    external_identifier_obj, _ = ExternalIdentifier.objects.update_or_create(
-                        type=identifier.get('type', ''),
-                        value=identifier.get('value', []),
-                    )
-                    farm_obj.identifiers.add(external_identifier_obj)
-
-        return f"Successfully fetched and stored farm data for farm(s): {farm_ids}"
+        return (
+            f"Successfully fetched and stored farm data for farm(s): {farm_ids}: "
+            f"{stats['farms']} farms, {stats['map_features']} map features and {stats['fields']} fields "
+            f"in {stats['queries']} queries"
+        )
 
     except Exception as e:
         return f"An error occurred while fetching and storing farm data: {e}"
@@ -272,40 +352,180 @@ def fetch_and_store_animals_with_count_data(
         limit=None,
         skip=None,
         observation_date=None,
-        capabilities=None
+        capabilities=None,
+        page_size=None,
+        stream=None,
+        resume=True
 ):
     """
     Fetches the animal data with count from AgriWebb API and stores it in the Django model.
+
+    Without an explicit `limit` every page is walked until `nonPagedCount` animals were
+    stored, `page_size` sets the size of the first page. With `stream` (defaults to
+    AGRIWEBB_STREAM_RESPONSES) the responses are parsed one animal at a time.
+
+    The animals are committed in chunks of AGRIWEBB_INGEST_CHUNK_SIZE, a failed or killed
+    task called again with the same arguments resumes after the last committed chunk, and
+    adds to the same AnimalCount, unless `resume` is off. Resuming needs a `sort` so the
+    animals come back in the same order, without one the task starts over. Animals that
+    fail to store are quarantined.
     """
     try:
         agriwebb = AgriWebb()
 
-        animals_data = agriwebb.animals_with_count(
-            token_id,
+        if stream is None:
+            stream = getattr(settings, 'AGRIWEBB_STREAM_RESPONSES', False)
+
+        checkpoint = CheckpointedIngest(
             farm_id,
-            filter=filter,
-            sort=sort,
-            limit=limit,
-            skip=skip,
-            observation_date=observation_date,
-            capabilities=capabilities
+            IngestRun.Kind.ANIMALS_WITH_COUNT,
+            {
+                'filter': filter,
+                'sort': sort,
+                'limit': limit,
+                'skip': skip,
+                'observation_date': observation_date,
+                'capabilities': capabilities,
+            },
+            resume=resume
         )
-        with transaction.atomic():
 
-            animals_with_count = animals_data['animalsWithCount']
-            animals_list = animals_with_count['animals']
-            non_paged_count = animals_with_count.get('nonPagedCount', 0)
+        with checkpoint.running() as run:
+            if run.animal_count is None:
+                run.animal_count = AnimalCount.objects.create(farm_id=farm_id)
+                run.save(update_fields=['animal_count', 'updated_at'])
+
+            animal_count = run.animal_count
+            skip = (skip or 0) + run.committed_offset
+            non_paged_count = animal_count.non_paged_count
+
+            def add_to_count(animal_objs):
+                LinkSetWriter(AnimalCount.animals).add(animal_count, *animal_objs).write()
+
+            if limit is None:
+                animals = agriwebb.iter_animals_with_count(
+                    token_id,
+                    farm_id,
+                    filter=filter,
+                    sort=sort,
+                    skip=skip,
+                    observation_date=observation_date,
+                    capabilities=capabilities,
+                    page_size=page_size,
+                    stream=stream
+                )
+
+                checkpoint.ingest_all(animals, on_chunk=add_to_count)
+
+                non_paged_count = animals.non_paged_count or non_paged_count or 0
+            elif limit <= run.committed_offset:
+                pass
+            elif stream:
+                animals = agriwebb.animals_with_count(
+                    token_id,
+                    farm_id,
+                    filter=filter,
+                    sort=sort,
+                    limit=limit - run.committed_offset,
+                    skip=skip,
+                    observation_date=observation_date,
+                    capabilities=capabilities,
+                    stream=True
+                )
+
+                checkpoint.ingest_all(animals, on_chunk=add_to_count)
+
+                non_paged_count = animals.values.get('animalsWithCount.nonPagedCount') or 0
+            else:
+                animals_data = agriwebb.animals_with_count(
+                    token_id,
+                    farm_id,
+                    filter=filter,
+                    sort=sort,
+                    limit=limit - run.committed_offset,
+                    skip=skip,
+                    observation_date=observation_date,
+                    capabilities=capabilities
+                )
+
+                animals_with_count = animals_data['animalsWithCount']
+                non_paged_count = animals_with_count.get('nonPagedCount', 0)
 
-            animal_count = AnimalCount.objects.create(
-                farm_id=farm_id,
-                non_paged_count=non_paged_count,
-            )
+                checkpoint.ingest_all(animals_with_count['animals'], on_chunk=add_to_count)
 
-            for animal_data in animals_list:
-                animal_obj = populate_animal(animal_data, farm_id)
-                animal_count.animals.add(animal_obj)
+            animal_count.non_paged_count = non_paged_count
+            animal_count.save(update_fields=['non_paged_count'])
 
-        return f"Successfully fetched and stored animals with count data for farm {farm_id} in the AnimalCount model."
+        return (
+            f"Successfully fetched and stored animals with count data for farm {farm_id} in the AnimalCount model: "
+            f"{checkpoint.stats}, {run.quarantined_count} quarantined"
+        )
 
     except Exception as e:
         return f"An error occurred while fetching and storing animals with count data: {e}"
+
+
+@shared_task
+def fetch_and_store_organization_animals_data(
+        token_id,
+        farm_ids=None,
+        page_size=None,
+        concurrency=None
+):
+    """
+    Fetches the animal data of every farm of the organization concurrently from AgriWebb API
+    and stores it in the Django model.
+    """
+    try:
+        animals_by_farm = fetch_organization_animals(
+            token_id,
+            farm_ids=farm_ids,
+            page_size=page_size,
+            concurrency=concurrency
+        )
+
+        # every chunk commits on its own, a failing farm keeps the farms stored before it
+        for farm_id, animals in animals_by_farm.items():
+            AnimalIngest(farm_id).ingest_all(animals)
+
+        return f"Successfully fetched and stored animal data for farm(s): {list(animals_by_farm)}"
+
+    except Exception as e:
+        return f"An error occurred while fetching and storing organization animals data: {e}"
+
+
+@shared_task
+def fetch_and_store_batched_animals_data(token_id, farm_ids, page_size=None):
+    """
+    Fetches the animal data of several farms from AgriWebb API, merging the page requests of
+    the farms into batched queries, and stores it in the Django model.
+    """
+    try:
+        batcher = AnimalQueryBatcher(AgriWebb())
+
+        # every page commits on its own, a failing page keeps the pages stored before it
+        for farm_id, animals in batcher.walk(token_id, farm_ids, page_size=page_size):
+            AnimalIngest(farm_id).ingest(animals)
+
+        return f"Successfully fetched and stored animal data for farm(s): {farm_ids}"
+
+    except Exception as e:
+        return f"An error occurred while fetching and storing batched animals data: {e}"
+
+
+@shared_task
+def compact_orphaned_rows(batch_size=None, time_limit=None):
+    """
+    Deletes the parentages, identities, characteristics, states, weight summaries and
+    weights no row references any more, in small throttled batches, see compaction.Compactor.
+    """
+    try:
+        report = compact_orphans(batch_size=batch_size, time_limit=time_limit)
+
+        reclaimed = ", ".join(f"{label}: {count}" for label, count in report['reclaimed'].items())
+        return (
+            f"Successfully compacted orphaned rows in {report['elapsed']}s "
+            f"({'finished' if report['finished'] else 'time limit reached'}): {reclaimed}"
+        )
+    except Exception as e:
+        return f"An error occurred while compacting orphaned rows: {e}"
@@ -1,3 +1,452 @@
-from django.test import TestCase
+import math
+from collections import defaultdict
+from unittest import mock
 
-# Create your tests here.
+from django.db import transaction
+from django.db.models import DateTimeField
+from django.test import SimpleTestCase, TestCase
+
+from . import interning, mapping, selections
+from .farms import FarmIngest
+from .helpers import populate_animal
+from .ingest import AnimalIngest
+from .links import LinkSetWriter
+from .models import Animal, AnimalIdentity, AnimalTag, Field, PedigreeClosure, PedigreeEdge
+from .parallel import partition, partition_of
+from .pedigree import DAM, SIRE, PedigreeStore
+from .tiles import tile_of, tiles_of
+from .units import to_hectares, to_hectares_many
+
+FARM_ID = 'farm-1'
+
+
+def parent_payload(parent_animal_id, parent_type):
+    return {
+        'parentAnimalId': parent_animal_id,
+        'parentType': parent_type,
+        'parentAnimalIdentity': {'eid': f"eid-{parent_animal_id}", 'vid': parent_animal_id, 'name': None},
+    }
+
+
+def animal_payload(animal_id, dam=None, sire=None, weight=300, location='paddock-1', records=(1,)):
+    """
+    An animal payload with every section filled in.
+    """
+    return {
+        'animalId': animal_id,
+        'ageClass': 'cow',
+        '_observationDate': 1700000000000,
+        'identity': {
+            'name': f"Animal {animal_id}",
+            'eid': f"eid-{animal_id}",
+            'vid': animal_id,
+            'managementTag': 'M1',
+            'tags': [
+                {'id': f"tag-{animal_id}", 'eid': f"eid-{animal_id}", 'type': 'nlis', 'state': 'active'},
+            ],
+        },
+        'characteristics': {
+            'ageClass': 'cow',
+            'birthDate': 1600000000000,
+            'birthDateConfidence': {'year': 'Accurate', 'month': 'Accurate', 'day': 'Estimate'},
+            'birthYear': 2020,
+            'breedAssessed': 'Angus',
+            'sex': 'female',
+            'speciesCommonName': 'cattle',
+        },
+        'parentage': {
+            'dams': [parent_payload(dam, 'dam')] if dam else [],
+            'sires': [parent_payload(sire, 'sire')] if sire else [],
+            'surrogate': None,
+        },
+        'state': {
+            'currentLocationId': location,
+            'onFarm': True,
+            'weights': {
+                'liveWeight': {'unit': 'kg', 'value': weight},
+                'liveWeightDate': 1690000000000,
+                'estimatedWeight': {'unit': 'kg', 'value': weight + 10},
+                'liveAverageDailyGain': {'unit': 'kgPerDay', 'value': 0.8},
+            },
+            'bodyConditionScore': {'unit': 'bcs5', 'value': 3},
+            'animalUnits': {'unit': 'dse', 'value': 10},
+        },
+        'enterprise': {'enterpriseId': 'enterprise-1', 'name': 'Beef', 'farmId': FARM_ID},
+        'managementGroup': {
+            'managementGroupId': 'group-1',
+            'enterpriseId': 'enterprise-1',
+            'farmId': FARM_ID,
+            'name': 'Cows',
+            'species': 'cattle',
+        },
+        'records': [
+            {'recordId': record_id, 'recordType': 'weigh', 'observationDate': 1690000000000, 'sessionId': 's1'}
+            for record_id in records
+        ],
+    }
+
+
+def describe(obj):
+    """
+    The field values of a row and of the rows it references, without primary keys and
+    timestamps, so rows written by different paths compare equal.
+    """
+    if obj is None:
+        return None
+
+    values = {}
+    for field in obj._meta.concrete_fields:
+        if field.primary_key or getattr(field, 'remote_field', None) and field.remote_field.parent_link:
+            continue
+        if isinstance(field, DateTimeField) and (field.auto_now or field.auto_now_add):
+            continue
+        value = getattr(obj, field.name)
+        values[field.name] = describe(value) if field.is_relation else value
+    for field in obj._meta.many_to_many:
+        values[field.name] = sorted((describe(related) for related in getattr(obj, field.name).all()), key=repr)
+    return values
+
+
+def snapshot():
+    return {animal.animal_id: describe(animal) for animal in Animal.objects.all()}
+
+
+def stored_closure():
+    return set(PedigreeClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+
+def expected_closure():
+    """
+    The closure of the stored edges, walked one generation at a time.
+    """
+    parents = defaultdict(set)
+    for animal_id, parent_animal_id in PedigreeEdge.objects.values_list('animal_id', 'parent_animal_id'):
+        parents[animal_id].add(parent_animal_id)
+
+    rows = set()
+    for animal_id in list(parents):
+        generation = {animal_id}
+        depth = 0
+        while generation:
+            depth += 1
+            generation = {parent for child in generation for parent in parents[child]}
+            rows.update((ancestor, animal_id, depth) for ancestor in generation)
+    return rows
+
+
+class AnimalIngestTests(TestCase):
+    def setUp(self):
+        for interner in interning.INTERNERS:
+            interner.clear()
+
+    def populated(self, *pages):
+        """
+        The state the per-animal path leaves after storing the pages, rolled back afterwards.
+        """
+        with transaction.atomic():
+            for page in pages:
+                for animal in page:
+                    populate_animal(animal, FARM_ID)
+            state = snapshot()
+            transaction.set_rollback(True)
+        return state
+
+    def ingested(self, *pages):
+        ingest = AnimalIngest(FARM_ID)
+        for page in pages:
+            ingest.ingest(page)
+        return snapshot()
+
+    def test_same_state_as_populate_animal(self):
+        page = [
+            animal_payload('1001', dam='2001', sire='3001'),
+            animal_payload('1002', dam='2001', weight=250),
+            animal_payload('2001'),
+        ]
+
+        expected = self.populated(page)
+
+        self.assertEqual(len(expected), 3)
+        self.assertEqual(self.ingested(page), expected)
+
+    def test_same_state_as_populate_animal_after_changes(self):
+        first = [animal_payload('1001', dam='2001'), animal_payload('1002')]
+        second = [
+            animal_payload('1001', dam='2002', weight=320, location='paddock-2', records=(1, 2)),
+            animal_payload('1002', records=()),
+        ]
+
+        expected = self.populated(first, second)
+
+        self.assertEqual(self.ingested(first, second), expected)
+
+    def test_unchanged_animals_are_skipped(self):
+        page = [animal_payload('1001', dam='2001'), animal_payload('1002')]
+
+        ingest = AnimalIngest(FARM_ID, fingerprints=True)
+        ingest.ingest(page)
+        state = snapshot()
+        ingest.ingest(page)
+
+        self.assertEqual(ingest.stats.written, 2)
+        self.assertEqual(ingest.stats.skipped, 2)
+        self.assertEqual(snapshot(), state)
+
+    def test_changed_animal_is_written(self):
+        ingest = AnimalIngest(FARM_ID, fingerprints=True)
+        ingest.ingest([animal_payload('1001'), animal_payload('1002')])
+        ingest.ingest([animal_payload('1001', weight=320), animal_payload('1002')])
+
+        self.assertEqual(ingest.stats.written, 3)
+        self.assertEqual(ingest.stats.skipped, 1)
+        self.assertEqual(Animal.objects.get(animal_id=1001).state.weights.live_weight.value, 320)
+
+
+class LinkSetWriterTests(TestCase):
+    def setUp(self):
+        self.identity = AnimalIdentity.objects.create(animal_id='1001', **mapping.ANIMAL_IDENTITY({}))
+        self.tags = [
+            AnimalTag.objects.create(agri_id=f"tag-{index}", **mapping.ANIMAL_TAG({}))
+            for index in range(3)
+        ]
+
+    def linked(self):
+        return set(self.identity.tags.values_list('agri_id', flat=True))
+
+    def test_set_replaces_the_links(self):
+        first, second, third = self.tags
+
+        self.assertEqual(LinkSetWriter(AnimalIdentity.tags).set(self.identity, [first, second]).write(), (2, 0))
+        self.assertEqual(LinkSetWriter(AnimalIdentity.tags).set(self.identity, [second, third]).write(), (1, 1))
+        self.assertEqual(self.linked(), {'tag-1', 'tag-2'})
+
+        self.assertEqual(LinkSetWriter(AnimalIdentity.tags).set(self.identity, []).write(), (0, 2))
+        self.assertEqual(self.linked(), set())
+
+    def test_add_keeps_the_other_links(self):
+        first, second, third = self.tags
+        LinkSetWriter(AnimalIdentity.tags).set(self.identity, [first]).write()
+
+        self.assertEqual(LinkSetWriter(AnimalIdentity.tags).add(self.identity, first, second).write(), (1, 0))
+        self.assertEqual(LinkSetWriter(AnimalIdentity.tags).add(self.identity, third.pk).write(), (1, 0))
+        self.assertEqual(self.linked(), {'tag-0', 'tag-1', 'tag-2'})
+
+    def test_unchanged_links_write_nothing(self):
+        LinkSetWriter(AnimalIdentity.tags).set(self.identity, self.tags).write()
+
+        self.assertEqual(LinkSetWriter(AnimalIdentity.tags).set(self.identity, self.tags).write(), (0, 0))
+
+
+class PedigreeStoreTests(TestCase):
+    def test_record_builds_the_closure(self):
+        PedigreeStore().record({
+            'calf': {('dam', DAM), ('sire', SIRE)},
+            'dam': {('granddam', DAM)},
+        })
+
+        self.assertEqual(stored_closure(), {
+            ('dam', 'calf', 1),
+            ('sire', 'calf', 1),
+            ('granddam', 'dam', 1),
+            ('granddam', 'calf', 2),
+        })
+        self.assertEqual(stored_closure(), expected_closure())
+
+    def test_ancestors_recorded_after_descendants_are_joined_up(self):
+        store = PedigreeStore()
+        store.record({'calf': {('dam', DAM)}})
+        store.record({'dam': {('granddam', DAM)}})
+        store.record({'granddam': {('greatgranddam', DAM)}})
+
+        self.assertIn(('greatgranddam', 'calf', 3), stored_closure())
+        self.assertEqual(stored_closure(), expected_closure())
+
+    def test_parent_change_rebuilds_the_subtree(self):
+        store = PedigreeStore()
+        store.record({
+            'calf': {('dam', DAM)},
+            'dam': {('granddam', DAM)},
+            'other': {('otherdam', DAM)},
+        })
+
+        self.assertEqual(store.record({'dam': {('other', DAM)}}), (1, 1))
+
+        closure = stored_closure()
+        self.assertNotIn(('granddam', 'calf', 2), closure)
+        self.assertIn(('other', 'calf', 2), closure)
+        self.assertIn(('otherdam', 'calf', 3), closure)
+        self.assertEqual(closure, expected_closure())
+
+    def test_related_parent_changes_in_one_batch(self):
+        store = PedigreeStore()
+        store.record({
+            'a': {('p', DAM)},
+            'c': {('a', DAM)},
+            'b': {('x', SIRE)},
+        })
+
+        # 'c' descends from 'a' and becomes the sire of 'b' while 'a' gets a new dam
+        self.assertEqual(store.record({'a': {('q', DAM)}, 'b': {('c', SIRE)}}), (2, 2))
+
+        closure = stored_closure()
+        self.assertIn(('a', 'b', 2), closure)
+        self.assertIn(('q', 'b', 3), closure)
+        self.assertNotIn(('p', 'c', 2), closure)
+        self.assertEqual(closure, expected_closure())
+
+    def test_detach_returns_the_edges_into_the_subtree(self):
+        store = PedigreeStore()
+        store.record({
+            'calf': {('dam', DAM), ('sire', SIRE)},
+            'dam': {('granddam', DAM)},
+        })
+
+        # new edges into the detached subtree are left out, the stored ones restore it
+        edges = store.detach({'dam'}, [('new', 'dam')])
+
+        self.assertEqual(sorted(edges), [('dam', 'calf'), ('granddam', 'dam'), ('sire', 'calf')])
+        self.assertEqual(stored_closure(), set())
+
+        store.extend(edges)
+        self.assertEqual(stored_closure(), expected_closure())
+
+    def test_unchanged_parents_write_nothing(self):
+        store = PedigreeStore()
+        store.record({'calf': {('dam', DAM)}})
+
+        self.assertEqual(store.record({'calf': {('dam', DAM)}}), (0, 0))
+
+
+class UnitsTests(SimpleTestCase):
+    def test_to_hectares(self):
+        self.assertAlmostEqual(to_hectares(1, 'acre'), 0.40468564224)
+        self.assertAlmostEqual(to_hectares(10000, 'm2'), 1)
+        self.assertAlmostEqual(to_hectares(107639.1041671, 'sqft'), 1)
+        self.assertAlmostEqual(to_hectares(11959.9004630, 'sqyd'), 1)
+        self.assertEqual(to_hectares(2.5, 'hectare'), 2.5)
+
+    def test_to_hectares_defaults_to_hectares(self):
+        self.assertEqual(to_hectares(2.5, None), 2.5)
+        self.assertEqual(to_hectares(2.5, ''), 2.5)
+
+    def test_to_hectares_of_empty_or_unknown(self):
+        self.assertIsNone(to_hectares(None, 'acre'))
+        self.assertIsNone(to_hectares(1, 'furlong'))
+
+    def test_to_hectares_many(self):
+        converted = to_hectares_many([1, 10000, None, 3, 2.5], ['acre', 'm2', 'acre', 'furlong', None])
+
+        self.assertAlmostEqual(converted[0], 0.40468564224)
+        self.assertAlmostEqual(converted[1], 1)
+        self.assertTrue(math.isnan(converted[2]))
+        self.assertTrue(math.isnan(converted[3]))
+        self.assertEqual(converted[4], 2.5)
+
+
+class TilesTests(SimpleTestCase):
+    def test_tile_of(self):
+        self.assertEqual(tile_of(0, 0, 0), (0, 0))
+        self.assertEqual(tile_of(0.1, 0.1, 1), (1, 0))
+        self.assertEqual(tile_of(-0.1, -0.1, 1), (0, 1))
+        # Sydney
+        self.assertEqual(tile_of(151.2093, -33.8688, 10), (942, 614))
+
+    def test_tile_of_clamps_to_the_map(self):
+        self.assertEqual(tile_of(-180, 90, 2), (0, 0))
+        self.assertEqual(tile_of(180, -90, 2), (3, 3))
+
+    def test_tiles_of(self):
+        self.assertEqual(list(tiles_of((0.1, 0.1, 0.2, 0.2), [0, 1])), [(0, 0, 0), (1, 1, 0)])
+        self.assertEqual(
+            sorted(tiles_of((-0.1, -0.1, 0.1, 0.1), [1])),
+            [(1, 0, 0), (1, 0, 1), (1, 1, 0), (1, 1, 1)]
+        )
+
+
+def field_payload(agri_id, name='Paddock', x=151.2):
+    return {
+        'agriId': agri_id,
+        'farmId': FARM_ID,
+        'name': name,
+        'totalArea': 10,
+        'unit': 'hectare',
+        'landUse': 'Grazing',
+        'geometry': {
+            'type': 'Polygon',
+            'coordinates': [[[x, -33.8], [x + 0.01, -33.8], [x + 0.01, -33.81], [x, -33.81], [x, -33.8]]],
+        },
+    }
+
+
+class FarmTilesTests(TestCase):
+    def ingest(self, fields):
+        """
+        Stores a farm with the given fields, returns the geometries whose tiles are dropped.
+        """
+        with mock.patch('main.farms.invalidate_tiles') as invalidate, mock.patch('main.farms.forget_farms'), \
+                self.captureOnCommitCallbacks(execute=True):
+            FarmIngest().ingest([{'id': FARM_ID, 'name': 'Farm', 'fields': fields}])
+        return {pk for call in invalidate.call_args_list for pk in call.args[1]}
+
+    def geometry(self, agri_id):
+        return Field.objects.get(agri_id=agri_id).geometry_id
+
+    def test_unchanged_fields_keep_their_tiles(self):
+        self.ingest([field_payload('field-1')])
+
+        self.assertEqual(self.ingest([field_payload('field-1')]), set())
+
+    def test_dropped_field_drops_its_tiles(self):
+        self.ingest([field_payload('field-1'), field_payload('field-2', x=151.3)])
+        geometry = self.geometry('field-2')
+
+        self.assertEqual(self.ingest([field_payload('field-1')]), {geometry})
+
+    def test_renamed_field_drops_its_tiles(self):
+        self.ingest([field_payload('field-1')])
+
+        self.assertEqual(self.ingest([field_payload('field-1', name='Creek')]), {self.geometry('field-1')})
+
+
+class PartitionTests(SimpleTestCase):
+    def test_partition_of_is_stable_and_in_range(self):
+        for animal_id in ('1001', '1002', 1003, 'abc'):
+            index = partition_of(animal_id, 4)
+            self.assertIn(index, range(4))
+            self.assertEqual(partition_of(animal_id, 4), index)
+        self.assertEqual(partition_of(1003, 4), partition_of('1003', 4))
+
+    def test_partition_keeps_the_payloads_of_an_animal_together(self):
+        animals = [{'animalId': str(animal_id % 50)} for animal_id in range(200)]
+
+        parts = partition(animals, 4)
+
+        self.assertEqual(sum(len(part) for part in parts), len(animals))
+        owners = defaultdict(set)
+        for index, part in enumerate(parts):
+            for animal in part:
+                owners[animal['animalId']].add(index)
+        self.assertTrue(all(len(indexes) == 1 for indexes in owners.values()))
+        self.assertTrue(all(parts))
+
+
+class SelectionsTests(SimpleTestCase):
+    def response_keys(self, tree):
+        keys = set()
+        for key, subtree in tree.items():
+            keys.add(selections.response_key(key))
+            if subtree is not None:
+                keys |= self.response_keys(subtree)
+        return keys
+
+    def test_every_mapping_key_is_selected(self):
+        selected = self.response_keys(selections.ANIMAL_TREE) | self.response_keys(selections.FARM_TREE)
+
+        for name, value in vars(mapping).items():
+            if isinstance(value, mapping.Mapping):
+                missing = set(value.spec.values()) - selected
+                self.assertFalse(missing, f"{name} reads keys the queries do not select: {missing}")
+
+    def test_aliases_query_the_api_field(self):
+        self.assertIn('LastSeen: lastSeen', selections.ANIMAL_TREE['state'])
+        self.assertIn('agriId: id', selections.FARM_TREE['fields'])
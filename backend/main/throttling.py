@@ -0,0 +1,297 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import redis
+
+from django.conf import settings
+from django.utils import timezone
+
+from .exceptions import AgriWebbRateLimitError
+
+GLOBAL_SCOPE = 'global'
+METRICS_KEY = 'agriwebb:throttle:metrics'
+
+# Takes `requested` tokens from every bucket in KEYS at once, or from none of them.
+# ARGV holds the requested amount followed by a (rate, capacity) pair per key. A bucket
+# paused after a 429 (KEYS[i] .. ':pause') blocks the take until the pause expires.
+# Returns the wait in seconds (0 when the tokens were taken) and the tokens left per key.
+TOKEN_BUCKET_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local requested = tonumber(ARGV[1])
+local wait = 0
+local buckets = {}
+
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+    local paused = redis.call('PTTL', key .. ':pause')
+    if paused > 0 then
+        wait = math.max(wait, paused / 1000)
+    end
+    if tokens < requested then
+        wait = math.max(wait, (requested - tokens) / rate)
+    end
+    buckets[i] = {key, tokens, rate, capacity}
+end
+
+local result = {tostring(wait)}
+for i, bucket in ipairs(buckets) do
+    local tokens = bucket[2]
+    if wait == 0 then
+        tokens = tokens - requested
+    end
+    redis.call('HSET', bucket[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', bucket[1], math.ceil(bucket[4] / bucket[3]) * 2 + 1)
+    table.insert(result, tostring(tokens))
+end
+return result
+"""
+
+
+class RedisTokenBuckets:
+    """
+    Token buckets kept in Redis and shared by every worker.
+    """
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, buckets, requested=1):
+        keys = [key for key, _, _ in buckets]
+        args = [requested]
+        for _, rate, capacity in buckets:
+            args.extend([rate, capacity])
+
+        result = self.script(keys=keys, args=args)
+        wait = float(result[0])
+        tokens = {key: float(value) for key, value in zip(keys, result[1:])}
+        return wait, tokens
+
+    def pause(self, key, seconds):
+        self.client.set(f"{key}:pause", 1, px=max(1, int(seconds * 1000)))
+
+    def peek(self, key):
+        tokens, paused = self.client.pipeline().hget(key, 'tokens').pttl(f"{key}:pause").execute()
+        return {
+            'tokens': float(tokens) if tokens is not None else None,
+            'paused_for': max(0, paused) / 1000,
+        }
+
+    def incr(self, field, amount=1):
+        if isinstance(amount, float):
+            self.client.hincrbyfloat(METRICS_KEY, field, amount)
+        else:
+            self.client.hincrby(METRICS_KEY, field, amount)
+
+    def incr_many(self, counts):
+        pipeline = self.client.pipeline(transaction=False)
+        for field, amount in counts.items():
+            if isinstance(amount, float):
+                pipeline.hincrbyfloat(METRICS_KEY, field, amount)
+            else:
+                pipeline.hincrby(METRICS_KEY, field, amount)
+        pipeline.execute()
+
+    def counters(self):
+        return {key.decode(): float(value) for key, value in self.client.hgetall(METRICS_KEY).items()}
+
+
+class LocalTokenBuckets:
+    """
+    In-process token buckets, used when no Redis is configured. They only limit the
+    requests of the current process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = {}
+        self.paused_until = {}
+        self.metrics = {}
+
+    def take(self, buckets, requested=1):
+        now = time.monotonic()
+        wait = 0
+        refilled = {}
+
+        with self.lock:
+            for key, rate, capacity in buckets:
+                tokens, ts = self.state.get(key, (capacity, now))
+                tokens = min(capacity, tokens + max(0, now - ts) * rate)
+                refilled[key] = tokens
+
+                wait = max(wait, self.paused_until.get(key, 0) - now)
+                if tokens < requested:
+                    wait = max(wait, (requested - tokens) / rate)
+
+            for key, tokens in refilled.items():
+                if wait <= 0:
+                    tokens -= requested
+                refilled[key] = tokens
+                self.state[key] = (tokens, now)
+
+        return max(0, wait), refilled
+
+    def pause(self, key, seconds):
+        with self.lock:
+            self.paused_until[key] = time.monotonic() + seconds
+
+    def peek(self, key):
+        with self.lock:
+            tokens = self.state.get(key, (None, None))[0]
+            paused = self.paused_until.get(key, 0) - time.monotonic()
+        return {'tokens': tokens, 'paused_for': max(0, paused)}
+
+    def incr(self, field, amount=1):
+        with self.lock:
+            self.metrics[field] = self.metrics.get(field, 0) + amount
+
+    def incr_many(self, counts):
+        with self.lock:
+            for field, amount in counts.items():
+                self.metrics[field] = self.metrics.get(field, 0) + amount
+
+    def counters(self):
+        with self.lock:
+            return dict(self.metrics)
+
+
+_local_buckets = LocalTokenBuckets()
+_redis_buckets = {}
+
+
+def get_buckets():
+    url = getattr(settings, 'AGRIWEBB_RATE_LIMIT_REDIS_URL', None)
+    if not url:
+        return _local_buckets
+
+    if url not in _redis_buckets:
+        _redis_buckets[url] = RedisTokenBuckets(url)
+    return _redis_buckets[url]
+
+
+class RateLimiter:
+    """
+    Limits AgriWebb API calls with a global token bucket and one token bucket per
+    organization. A call only goes out once both buckets grant a token.
+    """
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets or get_buckets()
+        self.global_rate = getattr(settings, 'AGRIWEBB_RATE_LIMIT_GLOBAL_RATE', 20)
+        self.global_burst = getattr(settings, 'AGRIWEBB_RATE_LIMIT_GLOBAL_BURST', 40)
+        self.organization_rate = getattr(settings, 'AGRIWEBB_RATE_LIMIT_ORGANIZATION_RATE', 5)
+        self.organization_burst = getattr(settings, 'AGRIWEBB_RATE_LIMIT_ORGANIZATION_BURST', 10)
+        self.max_wait = getattr(settings, 'AGRIWEBB_RATE_LIMIT_MAX_WAIT', 60)
+
+    def key(self, scope):
+        return f"agriwebb:throttle:{scope}"
+
+    def scopes(self, organization):
+        buckets = [(self.key(GLOBAL_SCOPE), self.global_rate, self.global_burst)]
+        if organization:
+            buckets.append((self.key(f"organization:{organization}"), self.organization_rate, self.organization_burst))
+        return buckets
+
+    def try_acquire(self, organization=None):
+        """
+        Takes a token from the global and the organization bucket if both have one.
+
+        :return: Seconds to wait before trying again, 0 when the call may go out.
+        """
+        wait, _ = self.buckets.take(self.scopes(organization))
+        return wait
+
+    def acquire(self, organization=None):
+        """
+        Blocks until the global and the organization bucket grant a token.
+        """
+        waited = 0
+
+        while True:
+            wait = self.try_acquire(organization)
+            if wait <= 0:
+                break
+            if waited + wait > self.max_wait:
+                self.buckets.incr('wait_timeouts')
+                raise AgriWebbRateLimitError(
+                    f"Waited {waited:.1f}s for an AgriWebb rate limit token",
+                    status_code=None,
+                    retry_after=wait
+                )
+            time.sleep(wait)
+            waited += wait
+
+        self.buckets.incr('requests')
+        if waited:
+            self.buckets.incr('throttled')
+            self.buckets.incr('throttled_seconds', float(waited))
+
+    def pause(self, organization, seconds):
+        """
+        Stops every worker from calling the API for an organization, after a 429.
+        """
+        self.buckets.pause(self.key(f"organization:{organization}" if organization else GLOBAL_SCOPE), seconds)
+
+    def record(self, field, amount=1):
+        self.buckets.incr(field, amount)
+
+    def record_many(self, counts):
+        """
+        Adds to several counters at once, in one round trip with Redis.
+
+        :param counts: Dict of counter to amount.
+        """
+        if counts:
+            self.buckets.incr_many(counts)
+
+    def state(self, organization=None):
+        """
+        Returns the current throttle state as metrics: the tokens left and remaining pause
+        of the global and organization buckets, and the shared counters.
+        """
+        state = {
+            'global': self.buckets.peek(self.key(GLOBAL_SCOPE)),
+            'counters': self.buckets.counters(),
+        }
+        if organization:
+            state['organization'] = self.buckets.peek(self.key(f"organization:{organization}"))
+        return state
+
+
+def retry_after_seconds(response):
+    """
+    Parses the Retry-After header of a response, given either in seconds or as an HTTP date.
+
+    :return: The seconds to wait, or None without a usable header.
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - timezone.now()).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt):
+    """
+    Exponential backoff with full jitter for the given (zero based) retry attempt.
+    """
+    base = getattr(settings, 'AGRIWEBB_RETRY_BACKOFF_BASE', 0.5)
+    cap = getattr(settings, 'AGRIWEBB_RETRY_BACKOFF_MAX', 30)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
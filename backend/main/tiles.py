@@ -0,0 +1,201 @@
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .geometry import level_for
+from .models import Farm, Field, GeoFeature, GeoFeatureSimplification, MapFeature
+
+CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+EXTENT = 4096
+BUFFER = 64
+MAX_LATITUDE = 85.0511287798
+# map features drawn on the water points layer
+WATER_POINT_TYPES = (MapFeature.TypeChoices.WATERTANK, MapFeature.TypeChoices.TROUGH)
+
+
+def tile_zooms():
+    """
+    The zoom levels tiles are served and invalidated for.
+    """
+    return range(
+        getattr(settings, 'AGRIWEBB_TILE_MIN_ZOOM', 8),
+        getattr(settings, 'AGRIWEBB_TILE_MAX_ZOOM', 20) + 1
+    )
+
+
+def tile_of(long, lat, zoom):
+    """
+    Returns the (x, y) of the web mercator tile containing a WGS 84 point at a zoom level.
+    """
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    tiles = 2 ** zoom
+    x = int((long + 180) / 360 * tiles)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * tiles)
+    return min(max(x, 0), tiles - 1), min(max(y, 0), tiles - 1)
+
+
+def tiles_of(extent, zooms):
+    """
+    Yields the (z, x, y) of every tile an extent (xmin, ymin, xmax, ymax) in WGS 84
+    touches at the given zoom levels.
+    """
+    xmin, ymin, xmax, ymax = extent
+    for zoom in zooms:
+        # tile rows count from the north
+        left, top = tile_of(xmin, ymax, zoom)
+        right, bottom = tile_of(xmax, ymin, zoom)
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                yield zoom, x, y
+
+
+FARMS_KEY = 'agriwebb:tiles:farms'
+
+
+def version_key(farm_id):
+    return f"agriwebb:tiles:{farm_id}:version"
+
+
+def tile_key(farm_id, version, z, x, y):
+    return f"agriwebb:tiles:{farm_id}:{version}:{z}/{x}/{y}"
+
+
+def render_tile(farm_id, z, x, y, using=DEFAULT_DB_ALIAS):
+    """
+    Encodes the paddocks and water points of a farm inside a tile with ST_AsMVT.
+
+    The geometries are read at the simplification level of the zoom, see
+    geometry.level_for, and fall back to full resolution. Needs PostGIS 3.
+
+    :return: The tile as bytes, empty when nothing of the farm is inside it.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    level = level_for(zoom=z)
+
+    through = Farm.fields.through
+    map_through = Farm.map_features.through
+    feature_pk = quote(GeoFeature._meta.pk.column)
+    simplification_pk = quote(GeoFeatureSimplification._meta.pk.column)
+    coordinates = quote(GeoFeature._meta.get_field('coordinates').column)
+    simplified = quote(GeoFeatureSimplification._meta.get_field('geometry').column)
+
+    def layer(name, table, m2m, m2m_table, columns, condition=''):
+        # the simplified geometry may be empty at coarse zooms, the feature is then left out
+        return (
+            f"(SELECT ST_AsMVT({name}, '{name}', {EXTENT}, 'geom') FROM ("
+            f"SELECT {columns}, ST_AsMVTGeom(ST_Transform(CASE WHEN simplifications.{simplification_pk} IS NULL "
+            f"THEN features.{coordinates} ELSE simplifications.{simplified} END, 3857), "
+            f"bounds.envelope, {EXTENT}, {BUFFER}, true) AS geom "
+            f"FROM {quote(table._meta.db_table)} rows "
+            f"JOIN {quote(m2m_table._meta.db_table)} links "
+            f"ON links.{quote(m2m.field.m2m_reverse_name())} = rows.{quote(table._meta.pk.column)} "
+            f"JOIN {quote(Farm._meta.db_table)} farms "
+            f"ON farms.{quote(Farm._meta.pk.column)} = links.{quote(m2m.field.m2m_column_name())} "
+            f"AND farms.{quote(Farm._meta.get_field('agri_id').column)} = %(farm_id)s "
+            f"JOIN {quote(GeoFeature._meta.db_table)} features "
+            f"ON features.{feature_pk} = rows.{quote(table._meta.get_field('geometry').column)} "
+            f"LEFT JOIN {quote(GeoFeatureSimplification._meta.db_table)} simplifications "
+            f"ON simplifications.{quote(GeoFeatureSimplification._meta.get_field('feature').column)} "
+            f"= features.{feature_pk} "
+            f"AND simplifications.{quote(GeoFeatureSimplification._meta.get_field('level').column)} = %(level)s "
+            f"CROSS JOIN bounds "
+            f"WHERE features.{coordinates} && bounds.area {condition}"
+            f") AS {name} WHERE {name}.geom IS NOT NULL)"
+        )
+
+    paddocks = layer(
+        'paddocks', Field, Farm.fields, through,
+        "rows.agri_id AS id, rows.name, rows.land_use, rows.total_area, rows.unit"
+    )
+    water_points = layer(
+        'water_points', MapFeature, Farm.map_features, map_through,
+        "rows.uu_id::text AS id, rows.name, rows.type",
+        "AND rows.type IN %(water_point_types)s"
+    )
+
+    sql = (
+        f"WITH bounds AS (SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS envelope, "
+        f"ST_Transform(ST_TileEnvelope(%(z)s, %(x)s, %(y)s, margin => {BUFFER / EXTENT}), 4326) AS area) "
+        f"SELECT COALESCE({paddocks}, ''::bytea) || COALESCE({water_points}, ''::bytea)"
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'farm_id': farm_id,
+            'level': level,
+            'z': z,
+            'x': x,
+            'y': y,
+            'water_point_types': tuple(str(value) for value in WATER_POINT_TYPES),
+        })
+        tile = cursor.fetchone()[0]
+    return bytes(tile) if tile else b''
+
+
+def farm_ids():
+    """
+    The AgriWebb IDs of the stored farms, cached so a tile request for an unknown farm
+    neither renders nor caches a tile. FarmIngest drops the cached IDs when it commits.
+    """
+    ids = cache.get(FARMS_KEY)
+    if ids is None:
+        ids = set(Farm.objects.values_list('agri_id', flat=True))
+        cache.set(FARMS_KEY, ids, timeout=getattr(settings, 'AGRIWEBB_TILE_CACHE_TIMEOUT', 24 * 60 * 60))
+    return ids
+
+
+def forget_farms():
+    cache.delete(FARMS_KEY)
+
+
+def get_tile(farm_id, z, x, y):
+    """
+    Returns a tile of a farm from the cache, rendering and caching it on a miss. Empty
+    tiles are cached too.
+    """
+    version = cache.get(version_key(farm_id), 0)
+    key = tile_key(farm_id, version, z, x, y)
+
+    tile = cache.get(key)
+    if tile is None:
+        tile = render_tile(farm_id, z, x, y)
+        cache.set(key, tile, timeout=getattr(settings, 'AGRIWEBB_TILE_CACHE_TIMEOUT', 24 * 60 * 60))
+    return tile
+
+
+def invalidate_tiles(farm_id, features):
+    """
+    Drops the cached tiles of a farm the given geometries touch, e.g. the old and the
+    new geometry of a changed field. When more tiles are touched than
+    AGRIWEBB_TILE_INVALIDATION_LIMIT every tile of the farm is dropped at once by
+    moving to a new cache version.
+
+    :param features: GeoFeatures or their primary keys.
+    :return: The number of dropped tiles, None when the whole farm was dropped.
+    """
+    limit = getattr(settings, 'AGRIWEBB_TILE_INVALIDATION_LIMIT', 10000)
+    zooms = tile_zooms()
+
+    tiles = set()
+    rows = GeoFeature.objects.filter(pk__in=features, coordinates__isnull=False).values_list('coordinates', flat=True)
+    for coordinates in rows:
+        for tile in tiles_of(coordinates.extent, zooms):
+            tiles.add(tile)
+            if len(tiles) > limit:
+                bump_version(farm_id)
+                return None
+
+    if tiles:
+        version = cache.get(version_key(farm_id), 0)
+        cache.delete_many([tile_key(farm_id, version, z, x, y) for z, x, y in tiles])
+    return len(tiles)
+
+
+def bump_version(farm_id):
+    key = version_key(farm_id)
+    # the version must outlive the tiles cached under it
+    if not cache.add(key, 1, timeout=None):
+        cache.incr(key)
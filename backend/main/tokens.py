@@ -0,0 +1,143 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models.auth import AgriWebbToken
+
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+class TokenProvider:
+    """
+    Serves AgriWebb tokens from a per-process TTL cache keyed by token id and refreshes them
+    shortly before `expires_at`.
+
+    Refreshes are guarded by a lock in the shared Django cache, so when many Celery workers
+    notice an expiring token at once only one of them calls the OAuth token endpoint and
+    the others pick up the refreshed token from the database.
+    """
+
+    def __init__(self, agriwebb=None, ttl=None, refresh_margin=None, lock_timeout=None):
+        """
+        :param agriwebb: AgriWebb client used to call the OAuth token endpoint, created on first refresh if omitted.
+        :param ttl: Seconds a token stays in the in-process cache, defaults to AGRIWEBB_TOKEN_CACHE_TTL.
+        :param refresh_margin: Seconds before `expires_at` a token gets refreshed, defaults to AGRIWEBB_TOKEN_REFRESH_MARGIN.
+        :param lock_timeout: Seconds the refresh lock is held at most, defaults to AGRIWEBB_TOKEN_LOCK_TIMEOUT.
+        """
+        self._agriwebb = agriwebb
+        self.ttl = ttl if ttl is not None else getattr(settings, 'AGRIWEBB_TOKEN_CACHE_TTL', 300)
+        self.refresh_margin = refresh_margin if refresh_margin is not None else getattr(
+            settings,
+            'AGRIWEBB_TOKEN_REFRESH_MARGIN',
+            120
+        )
+        self.lock_timeout = lock_timeout or getattr(settings, 'AGRIWEBB_TOKEN_LOCK_TIMEOUT', 30)
+
+    @property
+    def agriwebb(self):
+        if self._agriwebb is None:
+            from .agriwebb import AgriWebb
+
+            self._agriwebb = AgriWebb()
+        return self._agriwebb
+
+    def get(self, token_id):
+        """
+        Returns a usable token, refreshing it first if it is about to expire.
+
+        :param token_id: ID of the AgriWebbToken record.
+        :return: The AgriWebbToken.
+        """
+        with _tokens_lock:
+            entry = _tokens.get(str(token_id))
+
+        if entry is not None:
+            token, cached_at = entry
+            if time.monotonic() - cached_at < self.ttl and not self.needs_refresh(token):
+                return token
+
+        token = self.load(token_id)
+
+        if self.needs_refresh(token):
+            token = self.refresh(token_id)
+        else:
+            self.store(token)
+
+        return token
+
+    def load(self, token_id):
+        try:
+            return AgriWebbToken.objects.get(id=token_id)
+        except AgriWebbToken.DoesNotExist:
+            raise ValueError("Token not found")
+
+    def store(self, token):
+        with _tokens_lock:
+            _tokens[str(token.id)] = (token, time.monotonic())
+
+    def invalidate(self, token_id):
+        """
+        Drops a token from the in-process cache, e.g. after the API rejected it.
+        """
+        with _tokens_lock:
+            _tokens.pop(str(token_id), None)
+
+    def needs_refresh(self, token):
+        if not token.expires_at:
+            return False
+        return token.expires_at - timezone.timedelta(seconds=self.refresh_margin) <= timezone.now()
+
+    def refresh(self, token_id, force=False, rejected=None):
+        """
+        Refreshes a token through the OAuth token endpoint while holding the cross-worker lock.
+        Without `force` or `rejected` the token is only refreshed if it is about to expire.
+
+        :param token_id: ID of the AgriWebbToken record.
+        :param force: Always refresh the token.
+        :param rejected: Access token the API rejected, the token is refreshed unless another worker already replaced it.
+        :return: The AgriWebbToken.
+        """
+        self.invalidate(token_id)
+        lock_key = f"agriwebb:token-refresh:{token_id}"
+
+        if not cache.add(lock_key, True, timeout=self.lock_timeout):
+            return self.wait_for_refresh(token_id, lock_key)
+
+        try:
+            token = self.load(token_id)
+
+            if force:
+                should_refresh = True
+            elif rejected is not None:
+                should_refresh = token.access_token == rejected
+            else:
+                should_refresh = self.needs_refresh(token)
+
+            if should_refresh:
+                self.agriwebb.refresh_token(token)
+        finally:
+            cache.delete(lock_key)
+
+        self.store(token)
+        return token
+
+    def wait_for_refresh(self, token_id, lock_key):
+        """
+        Waits for the worker holding the refresh lock and returns the token it stored.
+        """
+        deadline = time.monotonic() + self.lock_timeout
+
+        while cache.get(lock_key) and time.monotonic() < deadline:
+            time.sleep(0.2)
+
+        token = self.load(token_id)
+
+        if token.expires_at and token.expires_at <= timezone.now():
+            raise Exception(f"Token {token_id} expired and was not refreshed in time")
+
+        self.store(token)
+        return token
@@ -0,0 +1,123 @@
+import atexit
+import os
+import socket
+import threading
+
+import requests
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.request import ACCEPT_ENCODING
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+class KeepAliveHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that turns on TCP keep-alive probes for every pooled socket, so idle
+    connections to the AgriWebb API are not silently dropped by NATs and load balancers.
+    """
+
+    def __init__(self, keep_alive=True, keep_alive_idle=60, **kwargs):
+        """
+        :param keep_alive: Enables SO_KEEPALIVE on pooled sockets.
+        :param keep_alive_idle: Seconds a connection stays idle before the first keep-alive probe.
+        """
+        self.keep_alive = keep_alive
+        self.keep_alive_idle = keep_alive_idle
+        super().__init__(**kwargs)
+
+    def get_socket_options(self):
+        options = list(HTTPConnection.default_socket_options)
+
+        if not self.keep_alive:
+            return options
+
+        options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keep_alive_idle))
+        elif hasattr(socket, 'TCP_KEEPALIVE'):
+            # macOS names the idle option differently
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, self.keep_alive_idle))
+
+        return options
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self.get_socket_options()
+        super().init_poolmanager(*args, **kwargs)
+
+
+def get_timeout():
+    """
+    Returns the (connect, read) timeout tuple used for AgriWebb HTTP calls.
+    """
+    return (
+        getattr(settings, 'AGRIWEBB_CONNECT_TIMEOUT', 5),
+        getattr(settings, 'AGRIWEBB_READ_TIMEOUT', 60),
+    )
+
+
+def build_session():
+    """
+    Builds a requests session whose connection pool is sized and tuned from the settings.
+    """
+    keep_alive = getattr(settings, 'AGRIWEBB_KEEP_ALIVE', True)
+
+    adapter = KeepAliveHTTPAdapter(
+        keep_alive=keep_alive,
+        keep_alive_idle=getattr(settings, 'AGRIWEBB_KEEP_ALIVE_IDLE', 60),
+        pool_connections=getattr(settings, 'AGRIWEBB_POOL_CONNECTIONS', 10),
+        pool_maxsize=getattr(settings, 'AGRIWEBB_POOL_MAXSIZE', 10),
+        pool_block=getattr(settings, 'AGRIWEBB_POOL_BLOCK', False),
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+    # gzip and deflate, plus br when the brotli package is installed
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+
+    return session
+
+
+def get_session():
+    """
+    Returns the per-process session shared by every AgriWebb client.
+
+    The session is rebuilt after a fork, so Celery prefork children never share sockets
+    with their parent.
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            _session = build_session()
+            _session_pid = pid
+
+    return _session
+
+
+def close_session():
+    """
+    Closes the pooled connections of the current process, if any were opened.
+    """
+    global _session, _session_pid
+
+    with _session_lock:
+        if _session is not None and _session_pid == os.getpid():
+            _session.close()
+
+        _session = None
+        _session_pid = None
+
+
+atexit.register(close_session)
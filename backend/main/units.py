@@ -0,0 +1,110 @@
+import numpy
+from django.conf import settings
+from django.db.models import Case, F, FloatField, Q, Sum, Value, When
+
+from .models import Field
+
+# hectares in one unit of every Field.UnitChoices
+HECTARES = {
+    Field.UnitChoices.ACRE: 0.40468564224,
+    Field.UnitChoices.SQFT: 0.09290304 / 10000,
+    Field.UnitChoices.SQYD: 0.83612736 / 10000,
+    Field.UnitChoices.M2: 1 / 10000,
+    Field.UnitChoices.HECTARE: 1.0,
+}
+# the unit of a field without one
+DEFAULT_UNIT = Field.UnitChoices.HECTARE
+
+
+def factor(unit):
+    """
+    Returns the hectares in one unit, None for an unknown unit.
+    """
+    return HECTARES.get(unit or DEFAULT_UNIT)
+
+
+def to_hectares(value, unit):
+    """
+    Converts an area in a Field unit to hectares.
+
+    :return: The area in hectares, None for an empty value or an unknown unit.
+    """
+    hectares = factor(unit)
+    if value is None or hectares is None:
+        return None
+    return value * hectares
+
+
+def to_hectares_many(values, units):
+    """
+    Converts many areas at once, e.g. the areas of every field of an organization.
+
+    :param values: A sequence of areas, None for an empty one.
+    :param units: The Field unit of every area.
+    :return: A numpy array of the areas in hectares, NaN where the area is empty or the
+             unit unknown.
+    """
+    areas = numpy.array([numpy.nan if value is None else value for value in values], dtype=float)
+    factors = numpy.array([factor(unit) or numpy.nan for unit in units], dtype=float)
+    return areas * factors
+
+
+def hectares(field, unit='unit'):
+    """
+    Returns an expression converting an area column to hectares in the database, for
+    updates and for rows whose hectare columns are not filled yet.
+
+    :param field: The area field, e.g. total_area.
+    :param unit: The unit field.
+    """
+    return Case(
+        *(
+            When(Q(**{unit: value}), then=F(field) * Value(per_unit))
+            for value, per_unit in HECTARES.items()
+            if value != DEFAULT_UNIT
+        ),
+        When(Q(**{unit: DEFAULT_UNIT}) | Q(**{f"{unit}__isnull": True}) | Q(**{unit: ''}), then=F(field)),
+        default=Value(None),
+        output_field=FloatField(),
+    )
+
+
+def area_totals(queryset):
+    """
+    Sums the hectare columns of a Field queryset, e.g. the fields of a farm or of every
+    farm of an organization, in one query.
+
+    :return: A dict with the `total_area_hectares` and the `grazable_area_hectares`.
+    """
+    return queryset.aggregate(
+        total_area_hectares=Sum('total_area_hectares'),
+        grazable_area_hectares=Sum('grazable_area_hectares'),
+    )
+
+
+def backfill_hectares(batch_size=None):
+    """
+    Fills the hectare columns of the fields stored before they existed, with one UPDATE
+    per batch of primary keys.
+
+    :return: The number of updated fields.
+    """
+    batch_size = batch_size or getattr(settings, 'AGRIWEBB_INGEST_BULK_SIZE', 1000)
+    missing = Field.objects.filter(
+        Q(total_area_hectares__isnull=True, total_area__isnull=False)
+        | Q(grazable_area_hectares__isnull=True, grazable_area__isnull=False)
+    ).order_by('pk')
+
+    updated = 0
+    last_pk = None
+    while True:
+        batch = missing if last_pk is None else missing.filter(pk__gt=last_pk)
+        pks = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return updated
+        last_pk = pks[-1]
+
+        updated += Field.objects.filter(pk__in=pks).update(
+            total_area_hectares=hectares('total_area'),
+            grazable_area_hectares=hectares('grazable_area'),
+        )
@@ -8,4 +8,9 @@ app_name = 'main'
 urlpatterns = [
     path('oauth2/authorize/', views.agriwebb_authorize, name='agriwebb_authorize'),
     path('oauth2/callback/', views.agriwebb_oauth2_callback, name='agriwebb_oauth2_callback'),
+    path('agriwebb/throttle/', views.agriwebb_throttle_state, name='agriwebb_throttle_state'),
+    path('animals/<str:animal_id>/pedigree/', views.animal_pedigree, name='animal_pedigree'),
+    path('farms/<str:farm_id>/geometries/', views.farm_geometries, name='farm_geometries'),
+    path('farms/<str:farm_id>/area/', views.farm_area, name='farm_area'),
+    path('farms/<str:farm_id>/tiles/<int:z>/<int:x>/<int:y>.mvt', views.farm_tile, name='farm_tile'),
 ]
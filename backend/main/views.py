@@ -1,8 +1,21 @@
-from django.http import HttpRequest, JsonResponse
-from django.shortcuts import redirect
+import math
+
+from django.contrib.auth.decorators import user_passes_test
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404, redirect
+
+from account.decorators import api_user_passes_test
+from core.utils import is_admin
 
 from .agriwebb import AgriWebb
+from .geometry import farm_feature_collection, level_for
+from .models import Farm
 from .models.auth import AgriWebbToken
+from .pedigree import ancestors, common_ancestors, descendants
+from .spatial import gis_enabled
+from .throttling import RateLimiter
+from .tiles import CONTENT_TYPE, farm_ids, get_tile, tile_zooms
+from .units import area_totals
 
 
 def agriwebb_authorize(request: HttpRequest) -> JsonResponse:
@@ -39,3 +52,82 @@ def agriwebb_oauth2_callback(request: HttpRequest) -> JsonResponse:
         agriwebb_token.set_organization(organization)
 
     return JsonResponse({'message': "Authentication successful."})
+
+
+@user_passes_test(is_admin)
+def agriwebb_throttle_state(request: HttpRequest) -> JsonResponse:
+    organization = request.GET.get('organization', None)
+
+    return JsonResponse(RateLimiter().state(organization))
+
+
+@user_passes_test(is_admin)
+def animal_pedigree(request: HttpRequest, animal_id: str) -> JsonResponse:
+    depth = request.GET.get('depth', None)
+    try:
+        depth = int(depth) if depth else None
+    except ValueError:
+        depth = -1
+    if depth is not None and depth < 0:
+        return JsonResponse({'message': "depth must be a non-negative integer."}, status=400)
+
+    other_animal_id = request.GET.get('common_with', None)
+
+    if other_animal_id:
+        return JsonResponse({
+            'common_ancestors': list(common_ancestors(animal_id, other_animal_id, depth)),
+        })
+
+    return JsonResponse({
+        'ancestors': list(ancestors(animal_id, depth)),
+        'descendants': list(descendants(animal_id, depth)),
+    })
+
+
+@user_passes_test(is_admin)
+def farm_geometries(request: HttpRequest, farm_id: str) -> JsonResponse:
+    zoom = request.GET.get('zoom', None)
+    resolution = request.GET.get('resolution', None)
+    try:
+        zoom = int(zoom) if zoom else None
+    except ValueError:
+        zoom = -1
+    if zoom is not None and zoom < 0:
+        return JsonResponse({'message': "zoom must be a non-negative integer."}, status=400)
+    try:
+        resolution = float(resolution) if resolution else None
+    except ValueError:
+        resolution = math.nan
+    if resolution is not None and not (math.isfinite(resolution) and resolution > 0):
+        return JsonResponse({'message': "resolution must be a positive number of degrees per pixel."}, status=400)
+
+    level = level_for(zoom=zoom, resolution=resolution)
+
+    farm = get_object_or_404(Farm, agri_id=farm_id)
+
+    return JsonResponse(farm_feature_collection(farm, level))
+
+
+@user_passes_test(is_admin)
+def farm_area(request: HttpRequest, farm_id: str) -> JsonResponse:
+    farm = get_object_or_404(Farm, agri_id=farm_id)
+
+    return JsonResponse({'farm_id': farm_id, **area_totals(farm.fields.all())})
+
+
+def can_view_farms(user):
+    return is_admin(user) or user.has_perm('main.view_farm')
+
+
+@api_user_passes_test(can_view_farms)
+def farm_tile(request: HttpRequest, farm_id: str, z: int, x: int, y: int) -> HttpResponse:
+    if not gis_enabled():
+        return JsonResponse({'message': "Vector tiles need a PostGIS database."}, status=501)
+    if z not in tile_zooms() or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return JsonResponse({'message': "Tile out of range."}, status=404)
+    if farm_id not in farm_ids():
+        return JsonResponse({'message': "Farm not found."}, status=404)
+
+    response = HttpResponse(get_tile(farm_id, z, x, y), content_type=CONTENT_TYPE)
+    response['Cache-Control'] = 'private, max-age=60'
+    return response